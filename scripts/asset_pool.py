@@ -0,0 +1,74 @@
+import os
+import shutil
+import threading
+
+import goldsrc_cache
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_pool_dir():
+    # next to the texture cache, shared by every level converted from this checkout
+    return os.path.join(script_dir, '..', 'output', '.asset-pool')
+
+
+def list_asset_files(folder):
+    """Sorted source files of an asset folder, for its key."""
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        # additive variants are written during the conversion, they are not sources
+        paths += [os.path.join(root, filename) for filename in sorted(files)
+                  if not filename.lower().endswith('_additive.png')]
+    return paths
+
+
+def get_asset_key(kind, name, sources, params=()):
+    """
+    Key of a converted asset: its kind and actor name, the content of its
+    source files and the conversion parameters. The name is part of it
+    because fast64 writes it into the exported symbols.
+    """
+    return goldsrc_cache.make_key(f'{kind}-{name}', sources, tuple(params))
+
+
+def _get_entry_dir(kind, name, key):
+    return os.path.join(get_pool_dir(), kind, name, key)
+
+
+def fetch(kind, name, key, actors_folder):
+    """
+    Copy a pooled actor to actors_folder/<name>, replacing what is there.
+    Returns False if the pool does not have it yet.
+    """
+    entry_dir = _get_entry_dir(kind, name, key)
+    if not os.path.isdir(entry_dir):
+        return False
+
+    actor_dir = os.path.join(actors_folder, name)
+    shutil.rmtree(actor_dir, ignore_errors=True)
+    shutil.copytree(entry_dir, actor_dir)
+    print(f"Reused pooled {kind} {name}")
+    return True
+
+
+def store(kind, name, key, actors_folder):
+    """Add the freshly exported actors_folder/<name> to the pool."""
+    actor_dir = os.path.join(actors_folder, name)
+    entry_dir = _get_entry_dir(kind, name, key)
+    if not os.path.isdir(actor_dir) or os.path.isdir(entry_dir):
+        return
+
+    # copied next to the entry and renamed, so a half-written entry is never used
+    tmp_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copytree(actor_dir, tmp_dir)
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # another level stored the same asset first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def remove_actor(actors_folder, name):
+    """Clear an actor folder before exporting it again."""
+    shutil.rmtree(os.path.join(actors_folder, name), ignore_errors=True)
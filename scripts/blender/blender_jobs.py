@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class BlenderJob:
+    """A background Blender process running one of the scripts in this folder."""
+
+    def __init__(self, name, process, log_path, log_file):
+        self.name = name
+        self.process = process
+        self.log_path = log_path
+        self.log_file = log_file
+        self.started = time.time()
+        self.returncode = None
+        self.duration = None
+
+    def wait(self):
+        if self.returncode is None:
+            self.returncode = self.process.wait()
+            self.duration = time.time() - self.started
+            self.log_file.close()
+        return self.returncode
+
+    @property
+    def ok(self):
+        return self.wait() == 0
+
+
+def get_blender_path():
+    # bpy is only there when running inside Blender
+    try:
+        import bpy
+        return bpy.app.binary_path
+    except ImportError:
+        return os.environ.get('BLENDER_PATH', 'blender')
+
+
+def get_log_dir(folder):
+    log_dir = os.path.join(folder, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    return log_dir
+
+
+def start_blender_job(name, script, args, folder, blend_path=None):
+    """
+    Run `blender --background [blend] --python <script> -- <args>` without
+    waiting for it. Output goes to <folder>/logs/<name>.log, and a Python
+    error in the script makes the process exit with code 1.
+    """
+    command = [get_blender_path(), '--background']
+    if blend_path:
+        command.append(blend_path)
+    command += ['--python-exit-code', '1', '--python', os.path.join(script_dir, script), '--']
+    command += [str(arg) for arg in args]
+
+    log_path = os.path.join(get_log_dir(folder), f"{name}.log")
+    log_file = open(log_path, 'w', encoding='utf-8', errors='replace')
+    process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, cwd=os.path.dirname(script_dir))
+    print(f"Started {name} (pid {process.pid}), log: {log_path}")
+    return BlenderJob(name, process, log_path, log_file)
+
+
+def print_log_tail(job, lines=20):
+    try:
+        with open(job.log_path, 'r', encoding='utf-8', errors='replace') as f:
+            tail = f.readlines()[-lines:]
+    except OSError:
+        return
+    for line in tail:
+        print(f"    {line.rstrip()}")
+
+
+def wait_for_jobs(jobs):
+    """Wait for every job, report each one and return True if all of them succeeded."""
+    all_ok = True
+    for job in jobs:
+        if job.ok:
+            print(f"✅ {job.name} finished in {job.duration:.1f}s")
+        else:
+            all_ok = False
+            print(f"❌ {job.name} failed with exit code {job.returncode}, log: {job.log_path}")
+            print_log_tail(job)
+    sys.stdout.flush()
+    return all_ok
@@ -1,6 +1,7 @@
 import bpy
 import sys
-import os
+import numpy as np
+import stage_cache
 
 ####################
 # combine into uv2 #
@@ -34,45 +35,68 @@ def assign_materials_per_face(original, duplicate):
     """
     if not original.material_slots or not duplicate.material_slots:
         return
-    
-    if len(original.data.polygons) != len(duplicate.data.polygons):
+
+    polygons = original.data.polygons
+    if len(polygons) != len(duplicate.data.polygons):
         return
 
-    # Mapping: (original material name, lightmap index) -> material slot index
-    mat_map = {}
+    orig_indices = np.empty(len(polygons), dtype=np.int32)
+    polygons.foreach_get('material_index', orig_indices)
+    dup_indices = np.empty(len(polygons), dtype=np.int32)
+    duplicate.data.polygons.foreach_get('material_index', dup_indices)
+
+    # slots that share a material share a key, like keying on the material name
+    slot_count = len(original.material_slots)
+    dup_slot_count = len(duplicate.material_slots)
+    slot_mat_ids = np.full(slot_count, -1, dtype=np.int64)
+    mat_ids = {}
+    for i, slot in enumerate(original.material_slots):
+        if slot.material:
+            slot_mat_ids[i] = mat_ids.setdefault(slot.material.name, len(mat_ids))
+
+    valid = (orig_indices < slot_count) & (dup_indices < dup_slot_count)
+    valid[valid] &= slot_mat_ids[orig_indices[valid]] >= 0
+    faces = np.nonzero(valid)[0]
+    if len(faces) == 0:
+        return
+
+    # (original material, lightmap index) per face
+    keys = slot_mat_ids[orig_indices[faces]] * dup_slot_count + dup_indices[faces]
+    unique_keys, firsts, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    # decide each key in the order it first appears, as the per-face walk did
+    targets = np.empty(len(unique_keys), dtype=np.int32)
+    for k in np.argsort(firsts, kind='stable'):
+        poly_idx = int(faces[firsts[k]])
+        orig_mat_index = int(orig_indices[poly_idx])
+        dup_mat_index = int(dup_indices[poly_idx])
 
-    for poly_idx, poly in enumerate(original.data.polygons):
-        dup_mat_index = duplicate.data.polygons[poly_idx].material_index
-        orig_mat_index = poly.material_index
-        
-        if dup_mat_index >= len(duplicate.material_slots) or orig_mat_index >= len(original.material_slots):
-            continue
-        
         orig_mat = original.material_slots[orig_mat_index].material
         dupe_mat = duplicate.material_slots[dup_mat_index].material
 
-        key = (orig_mat.name, dup_mat_index)
-        if key in mat_map:
-            # Already have a material for this lightmap index
-            poly.material_index = mat_map[key]
+        if "lightmap_texture" in orig_mat and orig_mat["lightmap_texture"] != dupe_mat.name:
+            # Duplicate material for this lightmap index
+            mat_copy = orig_mat.copy()
+            mat_copy.name = f"{orig_mat.name}#LM{dup_mat_index}"
+            mat_copy["lightmap_texture"] = dupe_mat.name
+            # Add new material slot
+            original.data.materials.append(mat_copy)
+            targets[k] = len(original.material_slots) - 1
+            print(f"Duplicated material {orig_mat.name} → {mat_copy.name} for face {poly_idx}")
         else:
-            # Need to assign or duplicate material
-            if "lightmap_texture" in orig_mat and orig_mat["lightmap_texture"] != dupe_mat.name:
-                # Duplicate material for this lightmap index
-                mat_copy = orig_mat.copy()
-                mat_copy.name = f"{orig_mat.name}#LM{dup_mat_index}"
-                mat_copy["lightmap_texture"] = dupe_mat.name
-                # Add new material slot
-                original.data.materials.append(mat_copy)
-                slot_index = len(original.material_slots) - 1
-                mat_map[key] = slot_index
-                poly.material_index = slot_index
-                print(f"Duplicated material {orig_mat.name} → {mat_copy.name} for face {poly_idx}")
-            else:
-                # Assign lightmap index property to original material
-                orig_mat["lightmap_texture"] = dupe_mat.name
-                mat_map[key] = orig_mat_index
-                poly.material_index = orig_mat_index
+            # Assign lightmap index property to original material
+            orig_mat["lightmap_texture"] = dupe_mat.name
+            targets[k] = orig_mat_index
+
+    orig_indices[faces] = targets[inverse.ravel()]
+    polygons.foreach_set('material_index', orig_indices)
+
+
+def copy_uvs(src_uv_layer, dst_uv_layer):
+    """Copy every loop's UV in one bulk read and write."""
+    uvs = np.empty(len(src_uv_layer) * 2, dtype=np.float32)
+    src_uv_layer.foreach_get('uv', uvs)
+    dst_uv_layer.foreach_set('uv', uvs)
 
 
 def stage_combine_uv2(num, folder):
@@ -81,22 +105,20 @@ def stage_combine_uv2(num, folder):
     (NAME.001) with the same geometry, copy its UVs to a new UVMap_2 on the original
     and assign materials per-face to correspond to the lightmap.
     """
+    objects = {obj.name: obj for obj in bpy.data.objects}
+
     pairs = []
-    for obj in bpy.data.objects:
-        if obj.type != 'MESH' or '.' in obj.name:
+    for name, obj in objects.items():
+        if obj.type != 'MESH' or '.' in name:
             continue
 
-        base_name = obj.name
-        dup_name = base_name + ".001"
+        duplicate = objects.get(name + ".001")
+        if duplicate:
+            pairs.append((obj, duplicate))
 
-        if dup_name in bpy.data.objects:
-            pairs.append((base_name, dup_name))
-
-    for base_name, dup_name in pairs:
-        original = bpy.data.objects.get(base_name)
-        duplicate = bpy.data.objects.get(dup_name)
-        if not original or not duplicate:
-            continue
+    for original, duplicate in pairs:
+        base_name = original.name
+        dup_name = duplicate.name
 
         if get_mesh_signature(original) != get_mesh_signature(duplicate):
             continue
@@ -119,8 +141,7 @@ def stage_combine_uv2(num, folder):
         src_uv_layer = dup_uv.data
         dst_uv_layer = new_uv.data
         if len(src_uv_layer) == len(dst_uv_layer):
-            for i in range(len(src_uv_layer)):
-                dst_uv_layer[i].uv = src_uv_layer[i].uv
+            copy_uvs(src_uv_layer, dst_uv_layer)
             print(f"Copied UVs from {dup_name} → {base_name}")
         else:
             print(f"UV data mismatch between {base_name} and {dup_name}, skipping")
@@ -133,5 +154,4 @@ def stage_combine_uv2(num, folder):
         bpy.data.objects.remove(duplicate, do_unlink=True)
         print(f"Deleted {dup_name}")
 
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(folder, f"{num}-combine-uv2.blend"))
-
+    stage_cache.save_stage_blend(folder, f"{num}-combine-uv2.blend")
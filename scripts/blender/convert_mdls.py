@@ -1,11 +1,18 @@
 import bpy
 import os
+import sys
 import json
 import re
 import math
+import numpy as np
 import set_fast64_stuff
 import export_level
-from mathutils import Vector
+import mesh_kernels
+import stage_cache
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import asset_pool
+import image_meta
 
 # mdl flags
 STUDIO_NF_FLATSHADE  = 0x0001
@@ -101,7 +108,33 @@ def import_mdl(subdir_path, mdl_collection):
     bpy.ops.object.select_all(action='DESELECT')
 
 
-def import_mdls(folder_path):
+def get_mdl_asset_key(subdir_path):
+    # the scale is baked into the exported bodies, the flags are in mdl.json
+    name = os.path.basename(subdir_path)
+    return asset_pool.get_asset_key('mdl', name, asset_pool.list_asset_files(subdir_path), (stage_cache.get_script_version(),))
+
+
+def fetch_pooled_mdls(folder_path, actors_folder):
+    """
+    Reuse the MDLs already converted for any level. Returns the keys of the
+    ones that still need converting, by name.
+    """
+    mdl_folder = os.path.join(folder_path, "mdl_models")
+    if not os.path.isdir(mdl_folder):
+        return {}
+
+    pending = {}
+    for subdir in os.listdir(mdl_folder):
+        subdir_path = os.path.join(mdl_folder, subdir)
+        if not os.path.isdir(subdir_path):
+            continue
+        key = get_mdl_asset_key(subdir_path)
+        if not asset_pool.fetch('mdl', subdir, key, actors_folder):
+            pending[subdir] = key
+    return pending
+
+
+def import_mdls(folder_path, names=None):
     mdl_folder = os.path.join(folder_path, "mdl_models")
     if not os.path.isdir(mdl_folder):
         return
@@ -115,6 +148,8 @@ def import_mdls(folder_path):
 
     # Iterate through subdirectories in the mdl_models folder
     for subdir in os.listdir(mdl_folder):
+        if names is not None and subdir not in names:
+            continue
         subdir_path = os.path.join(mdl_folder, subdir)
         if os.path.isdir(subdir_path):
             import_mdl(subdir_path, mdl_collection)
@@ -187,45 +222,20 @@ def shift_uvs_into_unit_range(obj):
 
     uv_layer = mesh.uv_layers.active.data
 
-    def can_shift_into_unit(uvs, shift):
-        """Check if shifting all UVs by 'shift' will place them in [0,1]."""
-        for uv in uvs:
-            shifted = uv - shift
-            if not (0.0 <= shifted.x <= 1.0 and 0.0 <= shifted.y <= 1.0):
-                return False
-        return True
-
-    for poly in mesh.polygons:
-        if len(poly.loop_indices) != 3:
-            continue  # only triangles
-
-        loop_idxs = poly.loop_indices
-        uvs = [uv_layer[i].uv.copy() for i in loop_idxs]
-
-        # Compute the rounded average for base integer shift
-        avg = sum(uvs, Vector((0.0, 0.0))) / 3.0
-        base_shift = Vector((round(avg.x), round(avg.y)))
-
-        # Try the base shift first
-        shift_to_use = None
-
-        if can_shift_into_unit(uvs, base_shift):
-            shift_to_use = base_shift
-        else:
-            # Try small integer offsets around that shift (3×3 area)
-            for dx in (-1, 0, 1):
-                for dy in (-1, 0, 1):
-                    test_shift = base_shift + Vector((dx, dy))
-                    if can_shift_into_unit(uvs, test_shift):
-                        shift_to_use = test_shift
-                        break
-                if shift_to_use:
-                    break
+    # Gather the loops of every triangle
+    loop_starts = np.empty(len(mesh.polygons), dtype=np.int64)
+    mesh.polygons.foreach_get('loop_start', loop_starts)
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int64)
+    mesh.polygons.foreach_get('loop_total', loop_totals)
+    tri_loops = loop_starts[loop_totals == 3][:, None] + np.arange(3)  # only triangles
+
+    uvs = np.empty(len(uv_layer) * 2, dtype=np.float32)
+    uv_layer.foreach_get('uv', uvs)
+    uvs = uvs.reshape(-1, 2)
 
-        # Apply shift if one fits the 0..1 range
-        if shift_to_use:
-            for i in loop_idxs:
-                uv_layer[i].uv -= shift_to_use
+    # Shift every triangle at once and write all UVs back
+    uvs[tri_loops] = mesh_kernels.wrap_triangle_uvs(uvs[tri_loops])
+    uv_layer.foreach_set('uv', uvs.ravel())
 
     mesh.update()
 
@@ -272,11 +282,14 @@ def stage_convert_mdls(folder):
     actors_folder = os.path.join(mod_folder, "actors")
     os.makedirs(actors_folder, exist_ok=True)
 
-    import_mdls(folder)
+    # only the MDLs no level has converted yet go through Blender
+    pending = fetch_pooled_mdls(folder, actors_folder)
+    import_mdls(folder, pending)
     export_level.triangulate_and_merge_all()
 
     convert_mdl_materials()
     apply_material_flags_to_objects()
+    image_meta.flush()
 
     shift_mdl_uvs_into_unit_range()
 
@@ -286,7 +299,10 @@ def stage_convert_mdls(folder):
             continue
         if obj.parent:
             continue
+        asset_pool.remove_actor(actors_folder, obj.name)
         export_mdl(obj, actors_folder)
+        if obj.name in pending:
+            asset_pool.store('mdl', obj.name, pending[obj.name], actors_folder)
 
     # Save to new file
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(folder, f"z-convert-mdls.blend"))
+    stage_cache.save_stage_blend(folder, "z-convert-mdls.blend")
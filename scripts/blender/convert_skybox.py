@@ -1,24 +1,28 @@
 import bpy
-import json
 import os
+import sys
 import convert_mdls
 import export_level
 import set_fast64_stuff
+import stage_cache
 
-def read_skybox_name(folder):
-    path = os.path.join(folder, 'bsp.json')
-    if not os.path.exists(path):
-        return None
-
-    # read bsp.json
-    with open(path, 'r') as f:
-        bsp_json = json.loads(f.read())
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import goldsrc_bsp
+import asset_pool
 
+def read_skybox_name(bsp_path):
     try:
-        return bsp_json['entities']['0']['keyvalues']['skyname']
+        bsp = goldsrc_bsp.open_bsp(bsp_path)
     except Exception as ex:
+        print(f"Warning: could not read bsp {bsp_path}: {ex}")
+        return None
+
+    if bsp is None:
         return None
 
+    with bsp:
+        return bsp.worldspawn().get('skyname')
+
 def check_skybox_exists(skybox_name, suffixes, skybox_dir):
     for suffix in suffixes:
         png_filename = f"{skybox_name}{suffix}.png"
@@ -39,33 +43,32 @@ def set_materials(skybox_name, suffixes, skybox_dir):
             material.f3d_mat.tex0.tex = image
             set_fast64_stuff.update_material_cache(material)
 
+def get_skybox_actor_name(skybox_name):
+    skyname = skybox_name
+    if not skyname[0].isalpha():
+        skyname = f'_{skyname}'
+    return f'{skyname}_skybox'
+
+
 def export_skybox(skybox_name, skybox_obj, actors_folder):
     bpy.ops.object.select_all(action='DESELECT')
     skybox_obj.select_set(True)
     bpy.context.view_layer.objects.active = skybox_obj
 
-    skyname = skybox_name
-    if not skyname[0].isalpha():
-        skyname = f'_{skyname}'
-
-    bpy.data.scenes["Scene"].geoTexDir = f'actors/{skyname}_skybox'
+    actor_name = get_skybox_actor_name(skybox_name)
+    bpy.data.scenes["Scene"].geoTexDir = f'actors/{actor_name}'
     bpy.data.scenes["Scene"].geoCustomExport = True
     bpy.data.scenes["Scene"].geoExportPath = actors_folder
-    bpy.data.scenes["Scene"].geoName = f'{skyname}_skybox'
-    bpy.data.scenes["Scene"].geoStructName = f'{skyname}_skybox_geo'
+    bpy.data.scenes["Scene"].geoName = actor_name
+    bpy.data.scenes["Scene"].geoStructName = f'{actor_name}_geo'
     bpy.ops.object.sm64_export_geolayout_object()
 
-def stage_convert_skybox(folder, blend_skybox_path):
+def stage_convert_skybox(folder, blend_skybox_path, bsp_path):
     # get skybox name
-    skybox_name = read_skybox_name(folder)
+    skybox_name = read_skybox_name(bsp_path)
     if not skybox_name:
         return False
 
-    convert_mdls.wipe_scene()
-
-    # Append objects from another .blend file
-    export_level.append_blend_objects(blend_skybox_path)
-
     skybox_dir = os.path.join(folder, "skyboxes")
     mod_folder = os.path.join(folder, "mod")
     actors_folder = os.path.join(mod_folder, "actors")
@@ -77,14 +80,28 @@ def stage_convert_skybox(folder, blend_skybox_path):
     if not skybox_exists:
         return False
 
+    # levels sharing a sky set reuse its actor
+    actor_name = get_skybox_actor_name(skybox_name)
+    sources = [blend_skybox_path] + [os.path.join(skybox_dir, f"{skybox_name}{suffix}.png") for suffix in suffixes]
+    key = asset_pool.get_asset_key('skybox', actor_name, sources, (stage_cache.get_script_version(),))
+    if asset_pool.fetch('skybox', actor_name, key, actors_folder):
+        return True
+
+    convert_mdls.wipe_scene()
+
+    # Append objects from another .blend file
+    export_level.append_blend_objects(blend_skybox_path)
+
     skybox_obj = bpy.data.objects.get("skybox")
     if not skybox_obj:
         return False
 
     set_materials(skybox_name, suffixes, skybox_dir)
+    asset_pool.remove_actor(actors_folder, actor_name)
     export_skybox(skybox_name, skybox_obj, actors_folder)
+    asset_pool.store('skybox', actor_name, key, actors_folder)
 
     # Save to new file
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(folder, f"z-convert-skybox.blend"))
+    stage_cache.save_stage_blend(folder, "z-convert-skybox.blend")
 
     return True
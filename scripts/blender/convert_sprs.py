@@ -3,7 +3,12 @@ import json
 import math
 import convert_mdls
 import os
+import sys
 import set_fast64_stuff
+import stage_cache
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import asset_pool
 
 def set_fast64_material_spr_opaque(mat):
     mat.f3d_mat.draw_layer.sm64 = '1'
@@ -237,10 +242,17 @@ def stage_convert_sprs(folder, scalar):
     if os.path.exists(src_sprites_folder):
         for sprite_folder in os.listdir(src_sprites_folder):
             sprite_path = os.path.join(src_sprites_folder, sprite_folder)
-            if os.path.isdir(sprite_path):
-                convert_spr(src_sprites_folder, sprite_folder, actors_folder, scalar)
+            if not os.path.isdir(sprite_path):
+                continue
+            key = asset_pool.get_asset_key('spr', sprite_folder, asset_pool.list_asset_files(sprite_path),
+                                           (stage_cache.get_script_version(), scalar))
+            if asset_pool.fetch('spr', sprite_folder, key, actors_folder):
+                continue
+            asset_pool.remove_actor(actors_folder, sprite_folder)
+            convert_spr(src_sprites_folder, sprite_folder, actors_folder, scalar)
+            asset_pool.store('spr', sprite_folder, key, actors_folder)
     else:
         print("Warning: sprites folder not found, skipping sprite conversion.")
 
     # Save to new file
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(folder, f"z-convert-sprs.blend"))
+    stage_cache.save_stage_blend(folder, "z-convert-sprs.blend")
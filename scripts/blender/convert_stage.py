@@ -0,0 +1,55 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import convert_mdls
+import convert_sprs
+import convert_skybox
+
+
+def run_mdls(folder_path):
+    convert_mdls.stage_convert_mdls(folder_path)
+
+
+def run_sprs(folder_path, scalar):
+    convert_sprs.stage_convert_sprs(folder_path, float(scalar))
+
+
+def run_skybox(folder_path, skybox_file_path, bsp_path):
+    convert_skybox.stage_convert_skybox(folder_path, skybox_file_path, bsp_path)
+
+
+# stage name -> (function, usage of its arguments)
+stages = {
+    'mdls': (run_mdls, "FOLDER_PATH"),
+    'sprs': (run_sprs, "FOLDER_PATH SCALAR"),
+    'skybox': (run_skybox, "FOLDER_PATH SKYBOX_BLEND BSP_PATH"),
+}
+
+
+def main():
+    # Started by goldsrc_pipeline.py, one background Blender per asset stage
+    argv = sys.argv
+    if "--" in argv:
+        argv = argv[argv.index("--") + 1:]
+    else:
+        argv = []
+
+    if not argv or argv[0] not in stages:
+        print("Usage: blender --background [BLEND] --python convert_stage.py -- STAGE ARGS...")
+        for name, (_, usage) in stages.items():
+            print(f"    {name} {usage}")
+        sys.exit(1)
+
+    fn, usage = stages[argv[0]]
+    args = argv[1:]
+    if len(args) != len(usage.split()):
+        print(f"Usage: blender --background [BLEND] --python convert_stage.py -- {argv[0]} {usage}")
+        sys.exit(1)
+
+    fn(*args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import bpy
 import os
 import sys
+import stage_cache
 
 
-def process_materials():
+def process_materials(folder):
     # Ensure all objects are deselected first
     for obj in bpy.data.objects:
         obj.select_set(False)
@@ -13,9 +14,8 @@ def process_materials():
         if obj.type == 'MESH':
             obj.select_set(True)
 
-    # Determine atlas image path (relative to blend file)
-    blend_dir = os.path.dirname(bpy.data.filepath)
-    atlas_dir = os.path.join(blend_dir, "atlases")
+    # Determine atlas image path (in the level folder, the stage .blend may not be saved yet)
+    atlas_dir = os.path.join(folder, "atlases")
     png_files = [f for f in os.listdir(atlas_dir) if f.lower().endswith('.png')]
     if not png_files:
         raise RuntimeError("No PNG files found in atlas directory")
@@ -55,5 +55,5 @@ def process_materials():
 
 
 def stage_coop_lightmap(num, folder):
-    process_materials()
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(folder, f"{num}-coop-lightmap.blend"))
+    process_materials(folder)
+    stage_cache.save_stage_blend(folder, f"{num}-coop-lightmap.blend")
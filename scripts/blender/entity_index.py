@@ -0,0 +1,98 @@
+import bpy
+import re
+
+# scene property the index is saved in, so stages resumed from a .blend can use it
+SCENE_PROPERTY = "goldsrc_entity_index"
+
+ENTITY_MESH_RE = re.compile(r'ENT_(\d+)#')
+ENTITY_EMPTY_RE = re.compile(r'(\d+)#')
+
+_entity_index = None
+
+
+class EntityIndex:
+    """
+    Entity index -> point entity empty ("<index>#<classname>"), brush mesh
+    ("M_*_ENT_<index>#<classname>") and keyvalues. Objects are stored by
+    name and looked up on use, so removed objects simply return None.
+    """
+
+    def __init__(self, empties=None, meshes=None):
+        self.empties = empties or {}
+        self.meshes = meshes or {}
+        self._keyvalues = {}
+
+    @classmethod
+    def build(cls):
+        """Scan the objects once, the first mesh in name order wins like the old lookups."""
+        index = cls()
+        for obj in bpy.data.objects:
+            name = obj.name
+            if name.startswith("M_"):
+                match = ENTITY_MESH_RE.search(name)
+                if match:
+                    index.meshes.setdefault(int(match.group(1)), name)
+                continue
+
+            match = ENTITY_EMPTY_RE.match(name)
+            if match and obj.type == 'EMPTY':
+                index.empties.setdefault(int(match.group(1)), name)
+        return index
+
+    def save(self, scene=None):
+        scene = scene or bpy.context.scene
+        scene[SCENE_PROPERTY] = {
+            'empties': {str(k): v for k, v in self.empties.items()},
+            'meshes': {str(k): v for k, v in self.meshes.items()},
+        }
+
+    @classmethod
+    def load(cls, scene=None):
+        scene = scene or bpy.context.scene
+        data = scene.get(SCENE_PROPERTY)
+        if data is None:
+            return None
+        return cls(
+            {int(k): v for k, v in data['empties'].items()},
+            {int(k): v for k, v in data['meshes'].items()},
+        )
+
+    def empty(self, entity_index):
+        name = self.empties.get(int(entity_index))
+        return bpy.data.objects.get(name) if name else None
+
+    def mesh(self, entity_index):
+        name = self.meshes.get(int(entity_index))
+        return bpy.data.objects.get(name) if name else None
+
+    def keyvalues(self, entity_index):
+        """The entity's keyvalues, read from the empty's custom properties."""
+        entity_index = int(entity_index)
+        keyvalues = self._keyvalues.get(entity_index)
+        if keyvalues is None:
+            obj = self.empty(entity_index)
+            if obj is None:
+                return {}
+            keyvalues = {k: obj[k] for k in obj.keys() if isinstance(obj[k], str)}
+            self._keyvalues[entity_index] = keyvalues
+        return keyvalues
+
+    def __len__(self):
+        return len(self.empties)
+
+
+def build_entity_index():
+    """Build the index after the entities are imported and store it in the scene."""
+    global _entity_index
+    _entity_index = EntityIndex.build()
+    _entity_index.save()
+    print(f"Indexed {len(_entity_index.empties)} entities, {len(_entity_index.meshes)} brush models")
+    return _entity_index
+
+
+def get_entity_index():
+    """The shared index: the one built this run, the one saved in the scene, or a fresh scan."""
+    global _entity_index
+    if _entity_index is None:
+        _entity_index = EntityIndex.load() or EntityIndex.build()
+    return _entity_index
@@ -5,10 +5,24 @@ import bmesh
 import mathutils
 import re
 import json
-from mathutils import Vector
+import shutil
+from mathutils import Matrix, Vector
+import numpy as np
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 import goldsrc_parse_entities
+from entity_index import get_entity_index
+import blender_jobs
+import stage_cache
+
+# fewest brush entities worth starting an export worker for
+MIN_ENTITIES_PER_SHARD = 8
+
+# fixed per-entity export overhead in vertex-count units, for balancing shards
+SHARD_ENTITY_COST = 500
+
+# names of the actor folders the export wrote, the pipeline checks they are still there
+ACTORS_MANIFEST = "6-export-actors.txt"
 
 
 def append_blend_objects(blend_path, object_names=None):
@@ -36,7 +50,68 @@ def append_blend_objects(blend_path, object_names=None):
             print(f"Appended object: {obj.name}")
 
 
-def export_object(objects_collection, area_obj, actors_folder, level_name, blender_object, entity_index, class_info):
+def select_only(obj):
+    """Make obj the only selected and the active object, without an operator pass over the scene."""
+    for selected in bpy.context.selected_objects:
+        selected.select_set(False)
+    obj.select_set(True)
+    bpy.context.view_layer.objects.active = obj
+
+
+def get_world_matrix(obj):
+    """World matrix from the object's own transforms, valid before the depsgraph is re-evaluated."""
+    if obj.parent:
+        return obj.parent.matrix_world @ obj.matrix_parent_inverse @ obj.matrix_basis
+    return obj.matrix_basis.copy()
+
+
+def apply_transform(obj):
+    """Bake location, rotation and scale into the mesh, like transform_apply."""
+    if obj.type == 'MESH':
+        if obj.data.users > 1:
+            obj.data = obj.data.copy()
+        obj.data.transform(obj.matrix_basis)
+    obj.matrix_basis = Matrix.Identity(4)
+
+
+def set_origin(obj, world_location):
+    """Move the object's origin to a world position without moving its geometry."""
+    local = get_world_matrix(obj).inverted() @ Vector(world_location)
+    obj.data.transform(Matrix.Translation(-local))
+    obj.matrix_basis = obj.matrix_basis @ Matrix.Translation(local)
+
+
+def get_mesh_center(obj):
+    """World space average of all vertices."""
+    co = np.empty(len(obj.data.vertices) * 3, dtype=np.float64)
+    obj.data.vertices.foreach_get('co', co)
+    return get_world_matrix(obj) @ Vector(co.reshape(-1, 3).mean(axis=0))
+
+
+def export_entity_assets(blender_object, actors_folder, level_name, entity_index, class_info):
+    """Run the fast64 geolayout and collision exports of one entity into actors/<level>_ent_<N>."""
+    # Export object visuals
+    select_only(blender_object)
+
+    bpy.data.scenes["Scene"].geoTexDir = f'actors/{level_name}_ent_{entity_index}'
+    bpy.data.scenes["Scene"].geoCustomExport = True
+    bpy.data.scenes["Scene"].geoExportPath = actors_folder
+    bpy.data.scenes["Scene"].geoName = f'{level_name}_ent_{entity_index}'
+    bpy.data.scenes["Scene"].geoStructName = f'{level_name}_ent_{entity_index}_geo'
+    if class_info['_export_geo']:
+        bpy.ops.object.sm64_export_geolayout_object()
+
+    # Export collision
+    select_only(blender_object)
+
+    bpy.data.scenes["Scene"].colCustomExport = True
+    bpy.data.scenes["Scene"].colExportPath = actors_folder
+    bpy.data.scenes["Scene"].colName = f'{level_name}_ent_{entity_index}'
+    if class_info['_export_col']:
+        bpy.ops.object.sm64_export_collision()
+
+
+def export_object(objects_collection, area_obj, actors_folder, level_name, blender_object, entity_index, class_info, export_assets=True):
     # --- Step 1: Find empty entity ---
     classname = blender_object.name.rsplit('#', 1)[-1]
     entity_name = f'{entity_index}#{classname}'
@@ -44,27 +119,19 @@ def export_object(objects_collection, area_obj, actors_folder, level_name, blend
 
     if entity is None:
         print(f"Warning: No entity found for index {entity_index} with classname {classname}")
-        return
+        return False
 
     # --- Step 2: Move empty to object center if at origin ---
     if entity.location == Vector((0.0, 0.0, 0.0)):
         # Calculate object's center of volume (average of all vertices)
-        if blender_object.type == 'MESH':
-            verts_world = [blender_object.matrix_world @ v.co for v in blender_object.data.vertices]
-            center = sum(verts_world, Vector()) / len(verts_world)
-            entity.location = center
+        if blender_object.type == 'MESH' and len(blender_object.data.vertices) > 0:
+            entity.location = get_mesh_center(blender_object)
         else:
             print(f"Warning: {blender_object.name} is not a mesh. Empty left at origin.")
 
     # --- Step 3: Set object origin to empty location ---
-    bpy.context.view_layer.objects.active = blender_object
-    bpy.ops.object.select_all(action='DESELECT')
-    blender_object.select_set(True)
-    bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
-
-    # Move 3D cursor to entity location for origin_set
-    bpy.context.scene.cursor.location = entity.location
-    bpy.ops.object.origin_set(type='ORIGIN_CURSOR')
+    if blender_object.type == 'MESH':
+        set_origin(blender_object, entity.location)
 
     parent_collection = area_obj.users_collection[0] if area_obj.users_collection else bpy.context.scene.collection
 
@@ -80,34 +147,17 @@ def export_object(objects_collection, area_obj, actors_folder, level_name, blend
         bm.free()
         blender_object.data.update()
 
-    # --- Step 4: Export object visuals ---
+    # --- Step 4: Move to the objects collection and export ---
     for col in blender_object.users_collection:
         col.objects.unlink(blender_object)
+    # dropping the parent keeps the local transform, like assigning parent = None
+    basis = blender_object.matrix_basis.copy()
     blender_object.parent = None
+    blender_object.matrix_world = basis
     objects_collection.objects.link(blender_object)
 
-    bpy.ops.object.select_all(action='DESELECT')
-    blender_object.select_set(True)
-    bpy.context.view_layer.objects.active = blender_object
-
-    bpy.data.scenes["Scene"].geoTexDir = f'actors/{level_name}_ent_{entity_index}'
-    bpy.data.scenes["Scene"].geoCustomExport = True
-    bpy.data.scenes["Scene"].geoExportPath = actors_folder
-    bpy.data.scenes["Scene"].geoName = f'{level_name}_ent_{entity_index}'
-    bpy.data.scenes["Scene"].geoStructName = f'{level_name}_ent_{entity_index}_geo'
-    if class_info['_export_geo']:
-        bpy.ops.object.sm64_export_geolayout_object()
-
-    # --- Step 5: Export collision ---
-    bpy.ops.object.select_all(action='DESELECT')
-    blender_object.select_set(True)
-    bpy.context.view_layer.objects.active = blender_object
-
-    bpy.data.scenes["Scene"].colCustomExport = True
-    bpy.data.scenes["Scene"].colExportPath = actors_folder
-    bpy.data.scenes["Scene"].colName = f'{level_name}_ent_{entity_index}'
-    if class_info['_export_col']:
-        bpy.ops.object.sm64_export_collision()
+    if export_assets:
+        export_entity_assets(blender_object, actors_folder, level_name, entity_index, class_info)
 
     # --- Step 6: Set empty properties ---
     entity.sm64_obj_type = 'Object'
@@ -125,8 +175,83 @@ def export_object(objects_collection, area_obj, actors_folder, level_name, blend
     if entity.name not in parent_collection.objects:
         parent_collection.objects.link(entity)
 
+    return True
+
+
+def get_brush_entity_index(name):
+    return int(name.split('#', 1)[0].rsplit('_', 1)[-1])
+
+
+def get_export_class_info(obj):
+    """parse_classes entry of a brush entity object if it has a fast64 export, else None."""
+    if not obj.name.startswith("M_"):
+        return None
+    class_info = goldsrc_parse_entities.parse_classes.get(obj.name.rsplit('#', 1)[-1])
+    if class_info is None or not (class_info['_export_geo'] or class_info['_export_col']):
+        return None
+    return class_info
+
+
+def get_export_shards(workers):
+    """
+    Split the brush entities that have fast64 exports into at most `workers`
+    sets of entity indices, balancing their vertex counts.
+    """
+    weighted = []
+    for obj in bpy.data.objects:
+        if get_export_class_info(obj) is None:
+            continue
+        weight = len(obj.data.vertices) if obj.type == 'MESH' else 1
+        weighted.append((weight, get_brush_entity_index(obj.name)))
+
+    # a worker pays for a Blender start and a .blend load, so keep shards reasonably big
+    workers = min(workers, len(weighted) // MIN_ENTITIES_PER_SHARD)
+    if workers < 2:
+        return []
+
+    # largest first onto the lightest shard
+    shards = [[0, []] for _ in range(workers)]
+    for weight, entity_index in sorted(weighted, reverse=True):
+        shard = min(shards, key=lambda s: s[0])
+        shard[0] += weight + SHARD_ENTITY_COST
+        shard[1].append(entity_index)
+    return [sorted(indices) for _, indices in shards if indices]
+
+
+def get_missing_exports(actors_folder, level_name, exported, entity_indices):
+    """Entity indices whose expected geo.inc.c / collision.inc.c were not written."""
+    missing = []
+    for entity_index in sorted(entity_indices):
+        obj = bpy.data.objects.get(exported.get(entity_index, ''))
+        class_info = get_export_class_info(obj) if obj else None
+        if class_info is None:
+            continue
+        actor_folder = os.path.join(actors_folder, f'{level_name}_ent_{entity_index}')
+        if class_info['_export_geo'] and not os.path.exists(os.path.join(actor_folder, 'geo.inc.c')):
+            missing.append(entity_index)
+        elif class_info['_export_col'] and not os.path.exists(os.path.join(actor_folder, 'collision.inc.c')):
+            missing.append(entity_index)
+    return missing
+
+
+def export_entity_shard(folder, level_name, entity_indices):
+    """Export worker: prepare and export only the given brush entities of the loaded .blend."""
+    actors_folder = os.path.join(folder, "mod", "actors")
+    os.makedirs(actors_folder, exist_ok=True)
+    exported = process_blender_objects(actors_folder, level_name, only_entities=set(entity_indices))
+    print(f"Exported {len(exported)} entities: {sorted(exported)}")
+
+
+def process_blender_objects(actors_folder, level_name, skip_export=(), only_entities=None):
+    """
+    Reparent every brush and point entity under the area and export the brush
+    entities. Entities in skip_export are prepared but left to export workers.
+    With only_entities set, just those brush entities are processed, which is
+    what an export worker does. Returns {entity index: object name} of the
+    brush entities that have exports.
+    """
+    exported = {}
 
-def process_blender_objects(actors_folder, level_name):
     # Get or create "Objects" collection
     if "Objects" not in bpy.data.collections:
         objects_collection = bpy.data.collections.new("Objects")
@@ -151,15 +276,18 @@ def process_blender_objects(actors_folder, level_name):
         print(f"'Area' is not in any collection. Using scene master collection.")
         parent_collection = bpy.context.scene.collection
 
-    for obj in bpy.data.objects:
+    for obj in list(bpy.data.objects):
         if obj.name.startswith("M_"):
+            if only_entities is not None and get_brush_entity_index(obj.name) not in only_entities:
+                continue
+
             # Remove from all collections
             for col in obj.users_collection:
                 col.objects.unlink(obj)
 
             # Get classname and entity index
             classname = obj.name.rsplit('#', 1)[-1]
-            entity_index = int(obj.name.split('#', 1)[0].rsplit('_', 1)[-1])
+            entity_index = get_brush_entity_index(obj.name)
 
             # Set parent
             obj.parent = area_obj
@@ -168,19 +296,17 @@ def process_blender_objects(actors_folder, level_name):
             if obj.name not in parent_collection.objects:
                 parent_collection.objects.link(obj)
 
-            # Select blender object in object mode
-            bpy.ops.object.select_all(action='DESELECT')
-            obj.select_set(True)
-            bpy.context.view_layer.objects.active = obj
-            bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
+            # Bake the transform into the mesh
+            apply_transform(obj)
 
             # Export object or parent it to level's area
             if classname in goldsrc_parse_entities.parse_classes:
-                export_object(objects_collection, area_obj, actors_folder, level_name, obj, entity_index, goldsrc_parse_entities.parse_classes[classname])
+                if export_object(objects_collection, area_obj, actors_folder, level_name, obj, entity_index, goldsrc_parse_entities.parse_classes[classname], entity_index not in skip_export):
+                    exported[entity_index] = obj.name
 
     # deal with point entity export
     collection = bpy.data.collections.get("Entities")
-    if collection:
+    if collection and only_entities is None:
         for obj in collection.objects:
             if '#' not in obj.name:
                 continue
@@ -209,6 +335,10 @@ def process_blender_objects(actors_folder, level_name):
             obj.fast64.sm64.game_object.use_individual_params = False
             obj.fast64.sm64.game_object.bparams = hex(entity_index)
 
+    # one depsgraph pass so matrix_world and bound_box reflect the baked transforms
+    bpy.context.view_layer.update()
+    return exported
+
 
 def triangulate_and_merge_all(threshold=1e-5):
     processed = 0
@@ -253,9 +383,10 @@ def perform_overrides(level_name, override_entities_path):
         overrides = json.load(f)
 
     if overrides['entities']:
+        entities = get_entity_index()
         for k, overrides in overrides['entities'].items():
-            model_obj = next((obj for obj in bpy.data.objects if f"_ENT_{k}#" in obj.name), None)
-            point_obj = next((obj for obj in bpy.data.objects if obj.name.startswith(f"{k}#")), None)
+            model_obj = entities.mesh(k)
+            point_obj = entities.empty(k)
 
             if overrides.get('translate'):
                 translate = mathutils.Vector(overrides['translate'])
@@ -354,7 +485,19 @@ def calculate_aabb_lua():
     return output
 
 
-def stage_export_level(num, folder, level_name, blend_export_path, override_entities_path):
+def remove_level_outputs(levels_folder, actors_folder, level_name):
+    # The output folder is reused between runs, drop the actors of entities
+    # that an override may have removed since. create-lua turns the exported
+    # PNGs into links to a placeholder, so nothing may be written into them.
+    shutil.rmtree(os.path.join(levels_folder, level_name), ignore_errors=True)
+    prefix = f'{level_name}_ent_'
+    for name in os.listdir(actors_folder):
+        path = os.path.join(actors_folder, name)
+        if name.startswith(prefix) and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def stage_export_level(num, folder, level_name, blend_export_path, override_entities_path, export_workers=1):
     # Append objects from another .blend file
     append_blend_objects(blend_export_path)
 
@@ -364,6 +507,7 @@ def stage_export_level(num, folder, level_name, blend_export_path, override_enti
     os.makedirs(levels_folder, exist_ok=True)
     actors_folder = os.path.join(mod_folder, "actors")
     os.makedirs(actors_folder, exist_ok=True)
+    remove_level_outputs(levels_folder, actors_folder, level_name)
 
     # Setup export settings
     bpy.data.scenes["Scene"].exportHiddenGeometry = False
@@ -376,8 +520,42 @@ def stage_export_level(num, folder, level_name, blend_export_path, override_enti
     # Perform overrides
     perform_overrides(level_name, override_entities_path)
 
+    # Hand disjoint sets of brush entities to background workers, they all
+    # start from this exact state and write to their own actors/<level>_ent_<N>
+    shards = get_export_shards(export_workers) if export_workers > 1 else []
+    jobs = []
+    if shards:
+        prepared_path = os.path.join(folder, f"{num}-export-prepared.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=prepared_path, copy=True)
+        for i, shard in enumerate(shards):
+            args = [folder, level_name, ','.join(map(str, shard))]
+            jobs.append(blender_jobs.start_blender_job(f"export-shard-{i}", "export_shard.py", args, folder, prepared_path))
+    sharded = {entity_index for shard in shards for entity_index in shard}
+
     # Perform reparenting and exporting
-    process_blender_objects(actors_folder, level_name)
+    exported = process_blender_objects(actors_folder, level_name, skip_export=sharded)
+
+    # Merge the workers' results. A failed worker may have left any of its
+    # actors half written, those are exported again here like anything
+    # missing, still before the level export like the entities exported in
+    # this process
+    if jobs:
+        blender_jobs.wait_for_jobs(jobs)
+        os.remove(prepared_path)
+        failed = {entity_index for shard, job in zip(shards, jobs) if not job.ok for entity_index in shard}
+        redo = sorted(failed.union(get_missing_exports(actors_folder, level_name, exported, sharded - failed)))
+        if redo:
+            print(f"Warning: {len(redo)} sharded entities were not exported, exporting them here: {redo}")
+            for entity_index in redo:
+                shutil.rmtree(os.path.join(actors_folder, f'{level_name}_ent_{entity_index}'), ignore_errors=True)
+                obj = bpy.data.objects.get(exported.get(entity_index, ''))
+                class_info = get_export_class_info(obj) if obj else None
+                if class_info is not None:
+                    export_entity_assets(obj, actors_folder, level_name, entity_index, class_info)
+            missing = get_missing_exports(actors_folder, level_name, exported, redo)
+            if missing:
+                raise RuntimeError(f"Entities could not be exported: {missing}")
+        print(f"Exported {len(sharded) - len(redo)} of {len(sharded)} entities in {len(jobs)} workers")
 
     move_warpentry_to_spawn()
 
@@ -388,5 +566,11 @@ def stage_export_level(num, folder, level_name, blend_export_path, override_enti
     # Export level
     export_level(levels_folder, level_name)
 
+    prefix = f'{level_name}_ent_'
+    with open(os.path.join(folder, ACTORS_MANIFEST), 'w') as f:
+        for name in sorted(os.listdir(actors_folder)):
+            if name.startswith(prefix) and os.path.isdir(os.path.join(actors_folder, name)):
+                f.write(f"{name}\n")
+
     # Save to new file
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(folder, f"{num}-export.blend"))
+    stage_cache.save_stage_blend(folder, f"{num}-export.blend")
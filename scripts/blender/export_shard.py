@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import export_level
+
+
+def main():
+    # Started by export_level.stage_export_level on the prepared export .blend
+    argv = sys.argv
+    if "--" in argv:
+        argv = argv[argv.index("--") + 1:]
+    else:
+        argv = []
+
+    if len(argv) < 3:
+        print("Usage: blender --background PREPARED_BLEND --python export_shard.py -- FOLDER_PATH LEVEL_NAME ENTITY_INDICES")
+        sys.exit(1)
+
+    folder_path = argv[0]
+    level_name = argv[1]
+    entity_indices = [int(i) for i in argv[2].split(',') if i]
+
+    export_level.export_entity_shard(folder_path, level_name, entity_indices)
+
+
+if __name__ == "__main__":
+    main()
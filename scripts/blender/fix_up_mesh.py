@@ -2,25 +2,16 @@ import bpy
 import bmesh
 import os
 import sys
+import numpy as np
 from mathutils import Vector
-from mathutils.kdtree import KDTree
+
+sys.path.insert(0, os.path.dirname(__file__))
+import mesh_kernels
+import stage_cache
 
 # Threshold for "near edge" and merge distance
 THRESHOLD = 0.025
 
-# Helper function to check if two sets of vertex positions match within threshold
-def verts_match(verts_a, verts_b, threshold):
-    for p in verts_a:
-        found = False
-        for q in verts_b:
-            if (Vector(p) - Vector(q)).length_squared < threshold * threshold:
-                found = True
-                break
-        if not found:
-            return False
-    return True
-
-
 # Helper function to choose outward-facing face for backfaces
 def backface_choose_outward(face_a, face_b, obj_center):
     """
@@ -70,25 +61,37 @@ def find_backfaces(obj, choose_func, choose_data):
         return []
 
     me = obj.data
+    if len(me.polygons) < 2:
+        return []
+
+    # pull the mesh out in bulk and pair faces with the spatial hash kernel
+    positions = np.empty(len(me.vertices) * 3, dtype=np.float64)
+    me.vertices.foreach_get('co', positions)
+    face_starts = np.empty(len(me.polygons), dtype=np.int64)
+    me.polygons.foreach_get('loop_start', face_starts)
+    face_sizes = np.empty(len(me.polygons), dtype=np.int64)
+    me.polygons.foreach_get('loop_total', face_sizes)
+    face_verts = np.empty(len(me.loops), dtype=np.int64)
+    me.loops.foreach_get('vertex_index', face_verts)
+    normals = np.empty(len(me.polygons) * 3, dtype=np.float64)
+    me.polygons.foreach_get('normal', normals)
+
+    pairs = mesh_kernels.find_backface_pairs(positions.reshape(-1, 3), face_starts, face_sizes, face_verts, normals.reshape(-1, 3), THRESHOLD)
+    if len(pairs) == 0:
+        return []
+
     bm = bmesh.new()
     bm.from_mesh(me)
+    bm.faces.ensure_lookup_table()
+    faces = bm.faces
 
     backface_pairs = []
-    faces = list(bm.faces)
-
-    for i, face_a in enumerate(faces):
-        verts_a_set = set(tuple(v.co) for v in face_a.verts)
-        for j in range(i + 1, len(faces)):
-            face_b = faces[j]
-            if len(face_a.verts) != len(face_b.verts):
-                continue
-            verts_b_set = set(tuple(v.co) for v in face_b.verts)
-            if verts_match(verts_a_set, verts_b_set, THRESHOLD) and verts_match(verts_b_set, verts_a_set, THRESHOLD) and (face_a.normal + face_b.normal).length < THRESHOLD:
-                # Prefer the face with normal pointing more upwards (higher Z-component) as first index
-                if choose_func(face_a, face_b, choose_data):
-                    backface_pairs.append((i, j))
-                else:
-                    backface_pairs.append((j, i))
+    for i, j in pairs.tolist():
+        # Prefer the face with normal pointing more upwards (higher Z-component) as first index
+        if choose_func(faces[i], faces[j], choose_data):
+            backface_pairs.append((i, j))
+        else:
+            backface_pairs.append((j, i))
 
     bm.free()
     return backface_pairs
@@ -380,7 +383,7 @@ def delete_non_upward_faces(obj):
 # -------------------------------
 # Helper function: process a single mesh object
 # -------------------------------
-def process_object(obj, phase):
+def process_object(obj):
     if obj.type != 'MESH':
         return 0
 
@@ -388,73 +391,40 @@ def process_object(obj, phase):
     bm = bmesh.new()
     bm.from_mesh(me)
 
-    bm.verts.ensure_lookup_table()
-    bm.edges.ensure_lookup_table()
-
     verts_before = len(bm.verts)
 
     # Merge doubles early (fast)
     bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=THRESHOLD)
 
-    bm.verts.ensure_lookup_table()
-    bm.edges.ensure_lookup_table()
-
     if not bm.verts or not bm.edges:
         bm.to_mesh(me); bm.free()
         return 0
 
-    # ---- Build compact edge center table ----
-    edges = bm.edges
-    edge_count = len(edges)
-
-    kd = KDTree(edge_count)
-    edge_centers = [None] * edge_count
-    edge_data = [None] * edge_count
-
-    max_half = 0.0
-    for i, e in enumerate(edges):
-        v1 = e.verts[0].co
-        v2 = e.verts[1].co
-        center = (v1 + v2) * 0.5
-        edge_centers[i] = center
-        edge_data[i] = (e, v1, v2)
-        kd.insert(center, i)
-        half = (v2 - v1).length_squared ** 0.5 * 0.5
-        if half > max_half:
-            max_half = half
-
-    kd.balance()
-    search_radius = THRESHOLD + max_half
-
-    # ---- Closest point utility (inlined for speed) ----
-    def closest_point_and_t(pt, a, b):
-        ab = b - a
-        ab_len_sq = ab.length_squared
-        if ab_len_sq == 0:
-            return a, 0.0
-        t = (pt - a).dot(ab) / ab_len_sq
-        if t < 0.0: t = 0.0
-        elif t > 1.0: t = 1.0
-        return a + ab * t, t
-
-    # ---- Collect splits ----
-    pending = {}
-
-    for v in bm.verts:
-        A = v.co
-        hits = kd.find_range(A, search_radius)
-        for _, idx, _ in hits:
-            e, v1, v2 = edge_data[idx]
-            if v in e.verts:
-                continue
-            B, t = closest_point_and_t(A, v1, v2)
-            if (A - B).length_squared < THRESHOLD * THRESHOLD:
-                pending.setdefault(e, []).append(t)
+    # ---- Pull merged vertex and edge arrays out in bulk ----
+    # to_mesh keeps the bmesh order, so mesh and bmesh indices match
+    bm.to_mesh(me)
+    positions = np.empty(len(me.vertices) * 3, dtype=np.float64)
+    me.vertices.foreach_get('co', positions)
+    edge_verts = np.empty(len(me.edges) * 2, dtype=np.int64)
+    me.edges.foreach_get('vertices', edge_verts)
+
+    # ---- Find every vertex-on-edge hit in one pass ----
+    split_edges, split_ts = mesh_kernels.find_edge_splits(positions.reshape(-1, 3), edge_verts.reshape(-1, 2), THRESHOLD)
 
     # ---- Apply edge splits ----
-    for e, t_list in pending.items():
-        for t in sorted(set(t_list)):
-            bmesh.utils.edge_split(e, e.verts[0], t)
+    bm.edges.ensure_lookup_table()
+    edges = list(bm.edges)
+    for edge_index, ts in mesh_kernels.group_edge_splits(split_edges, split_ts):
+        e = edges[edge_index]
+        v_start, v_end = e.verts
+        prev = 0.0
+        for t in ts:
+            # factors are relative to the whole edge, rescale them to the piece that is left
+            new_edge, new_vert = bmesh.utils.edge_split(e, v_start, (t - prev) / (1.0 - prev))
+            if v_end in new_edge.verts:
+                e = new_edge
+            v_start = new_vert
+            prev = t
 
     # Final merge + final triangulate
     bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=THRESHOLD)
@@ -468,7 +438,7 @@ def process_object(obj, phase):
 
     verts_after = len(me.vertices)
     created = verts_after - verts_before
-    print(f"Processed {obj.name}, phase {phase}: {created} verts")
+    print(f"Processed {obj.name}: {created} verts")
     return created
 
 # -------------------------------
@@ -479,11 +449,7 @@ def process_objects():
     for obj in bpy.context.scene.objects:
         if obj.type == 'MESH':
             #remove_backfaces(obj)
-            for i in range(3):
-                created = process_object(obj, i)
-                total_created += created
-                if created == 0:
-                    break
+            total_created += process_object(obj)
     print(f"Total vertices created across scene: {total_created}")
 
 
@@ -496,4 +462,4 @@ def stage_fix_up_mesh(num, folder):
         split_backfaces(target_obj)
 
     process_objects()
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(folder, f"{num}-fix-up-mesh.blend"))
+    stage_cache.save_stage_blend(folder, f"{num}-fix-up-mesh.blend")
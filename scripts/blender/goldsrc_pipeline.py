@@ -1,3 +1,6 @@
+import argparse
+import bpy
+import collections
 import os
 import sys
 
@@ -12,6 +15,194 @@ import convert_mdls
 import convert_sprs
 import convert_skybox
 import fix_up_mesh
+import blender_jobs
+import stage_cache
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import goldsrc_cache
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="blender --background --python goldsrc_pipeline.py --",
+        description="Convert an exported GoldSrc level into a sm64coopdx mod.",
+    )
+    parser.add_argument("folder_path", metavar="FOLDER_PATH")
+    parser.add_argument("level_name", metavar="LEVEL_NAME")
+    parser.add_argument("export_file_path", metavar="APPEND_BLEND")
+    parser.add_argument("skybox_file_path", metavar="SKYBOX_BLEND")
+    parser.add_argument("scalar", metavar="SCALAR", type=float)
+    parser.add_argument("override_entities_path", metavar="OVERRIDE_ENTITIES_PATH")
+    parser.add_argument("bsp_path", metavar="BSP_PATH")
+    parser.add_argument("--export-workers", type=int, default=1,
+                        help="background Blender processes for the per-entity fast64 export (default: 1, no workers)")
+    parser.add_argument("--serial-assets", action="store_true",
+                        help="convert MDLs, sprites and the skybox in this process instead of in parallel background jobs")
+    parser.add_argument("--keep-blends", choices=stage_cache.KEEP_BLENDS_POLICIES, default=stage_cache.DEFAULT_KEEP_BLENDS,
+                        help="which stage .blend files to write: all of them, or only the checkpoints that are read back (default)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="run every stage even if its inputs did not change")
+    return parser.parse_args(argv)
+
+
+# A stage of the level conversion: its .blend, the files that must still be
+# there for it to count as done, and how to run it
+Stage = collections.namedtuple('Stage', 'name blend outputs run')
+
+# An asset conversion: its key, the arguments of its convert_stage.py job and
+# how to run it in this process
+AssetStage = collections.namedtuple('AssetStage', 'name key job_args run')
+
+
+def get_level_stages(args):
+    folder_path = args.folder_path
+    return [
+        Stage('import', "1-imported-objs.blend", (),
+              lambda: import_all_objs.stage_import_all_objs(1, folder_path, args.scalar)),
+        Stage('combine-uv2', "2-combine-uv2.blend", (),
+              lambda: combine_into_uv2.stage_combine_uv2(2, folder_path)),
+        Stage('fix-up-mesh', "3-fix-up-mesh.blend", (),
+              lambda: fix_up_mesh.stage_fix_up_mesh(3, folder_path)),
+        Stage('coop-lightmap', "4-coop-lightmap.blend", (),
+              lambda: coop_lightmap.stage_coop_lightmap(4, folder_path)),
+        Stage('set-fast64', "5-set-fast64.blend", (),
+              lambda: set_fast64_stuff.stage_set_fast64_stuff(5, folder_path)),
+        Stage('export', "6-export.blend", get_export_outputs(args),
+              lambda: export_level.stage_export_level(6, folder_path, args.level_name, args.export_file_path,
+                                                      args.override_entities_path, args.export_workers)),
+    ]
+
+
+def get_export_outputs(args):
+    """
+    What the export stage leaves in the level folder: its .blend, the AABBs,
+    the exported level and the actor folders listed by its last run.
+    """
+    outputs = ["6-export.blend", "aabb.lua", export_level.ACTORS_MANIFEST, os.path.join("mod", "levels", args.level_name)]
+    try:
+        with open(os.path.join(args.folder_path, export_level.ACTORS_MANIFEST), 'r') as f:
+            outputs += [os.path.join("mod", "actors", name) for name in f.read().split()]
+    except OSError:
+        pass
+    return tuple(outputs)
+
+
+def list_source_files(folder):
+    # the additive variants are written during the conversion, they are not inputs
+    return [path for path in stage_cache.list_files(folder, recursive=True)
+            if not path.lower().endswith('_additive.png')]
+
+
+def list_texture_files(folder_path):
+    return list_source_files(os.path.join(folder_path, "textures"))
+
+
+def get_level_stage_keys(args, stages, script_version):
+    """
+    Each stage is keyed by the key of the one before it, so a change to an
+    input reruns the stage that reads it and everything after.
+    """
+    folder_path = args.folder_path
+    sources = stage_cache.list_files(folder_path, ('.obj', '.mtl'))
+    sources.append(os.path.join(folder_path, "entities.txt"))
+    sources += stage_cache.list_files(os.path.join(folder_path, "atlases"))
+    sources += list_texture_files(folder_path)
+
+    key = stage_cache.get_stage_key('import', sources, (script_version, args.scalar))
+    keys = [key]
+    for stage in stages[1:-1]:
+        key = stage_cache.get_stage_key(stage.name, [], (key,))
+        keys.append(key)
+
+    override_path = os.path.join(args.override_entities_path, f"{args.level_name}.json")
+    keys.append(stage_cache.get_stage_key('export', [override_path, args.export_file_path], (key, args.level_name)))
+    return keys
+
+
+def get_asset_stages(args, script_version):
+    """
+    The asset conversions wipe the scene and only read their own source
+    folders, so they are not keyed by the level stages.
+    """
+    folder_path = args.folder_path
+    scalar = args.scalar
+    extra = (script_version, scalar)
+    # the jobs start from the exported level, which has the export .blend appended
+    mdl_sources = [args.export_file_path] + list_source_files(os.path.join(folder_path, "mdl_models"))
+    spr_sources = [args.export_file_path] + list_source_files(os.path.join(folder_path, "sprites"))
+    skybox_sources = [args.export_file_path, args.skybox_file_path, args.bsp_path]
+    skybox_sources += stage_cache.list_files(os.path.join(folder_path, "skyboxes"), recursive=True)
+    return [
+        AssetStage('mdls', stage_cache.get_stage_key('mdls', mdl_sources, extra), ["mdls", folder_path],
+                   lambda: convert_mdls.stage_convert_mdls(folder_path)),
+        AssetStage('sprs', stage_cache.get_stage_key('sprs', spr_sources, extra), ["sprs", folder_path, scalar],
+                   lambda: convert_sprs.stage_convert_sprs(folder_path, scalar)),
+        AssetStage('skybox', stage_cache.get_stage_key('skybox', skybox_sources, extra),
+                   ["skybox", folder_path, args.skybox_file_path, args.bsp_path],
+                   lambda: convert_skybox.stage_convert_skybox(folder_path, args.skybox_file_path, args.bsp_path)),
+    ]
+
+
+def run_level_stages(folder_path, stages, keys, rebuild=False):
+    """
+    Skip the stages that are current, resume from the newest .blend written
+    in front of the first stale one and run everything from there on.
+    """
+    cache_dir = goldsrc_cache.get_cache_dir(folder_path)
+    records = [None if rebuild else stage_cache.load_stage(cache_dir, folder_path, stage.name, key, stage.outputs)
+               for stage, key in zip(stages, keys)]
+
+    first_stale = next((i for i, record in enumerate(records) if record is None), len(stages))
+    if first_stale == len(stages):
+        print("Level stages are up to date")
+        return
+
+    start = 0
+    for i in reversed(range(first_stale)):
+        if records[i].has_blend(folder_path):
+            print(f"Resuming from {records[i].blend}")
+            bpy.ops.wm.open_mainfile(filepath=os.path.join(folder_path, records[i].blend))
+            start = i + 1
+            break
+
+    for stage, key in zip(stages[start:], keys[start:]):
+        print(f"Running stage {stage.name}")
+        stage_cache.clear_stage(cache_dir, stage.name)
+        stage.run()
+        stage_cache.store_stage(cache_dir, folder_path, stage.name, key, stage.blend)
+
+
+def run_asset_stages(folder_path, asset_stages, export_blend_path, serial=False, rebuild=False):
+    """
+    Run the stale MDL, sprite and skybox conversions, as concurrent background
+    Blender jobs unless serial is set. Each one wipes the scene and only writes
+    its own actors, so they start from the exported level like the serial run did.
+    """
+    cache_dir = goldsrc_cache.get_cache_dir(folder_path)
+    stale = [stage for stage in asset_stages
+             if rebuild or stage_cache.load_stage(cache_dir, folder_path, stage.name, stage.key) is None]
+    for stage in asset_stages:
+        if stage not in stale:
+            print(f"Asset stage {stage.name} is up to date")
+
+    if serial:
+        if stale and os.path.normpath(bpy.data.filepath) != os.path.normpath(export_blend_path):
+            bpy.ops.wm.open_mainfile(filepath=export_blend_path)
+        for stage in stale:
+            stage_cache.clear_stage(cache_dir, stage.name)
+            stage.run()
+            stage_cache.store_stage(cache_dir, folder_path, stage.name, stage.key)
+        return True
+
+    for stage in stale:
+        stage_cache.clear_stage(cache_dir, stage.name)
+    jobs = [blender_jobs.start_blender_job(f"convert-{stage.name}", "convert_stage.py", stage.job_args, folder_path, export_blend_path)
+            for stage in stale]
+    all_ok = blender_jobs.wait_for_jobs(jobs)
+    for stage, job in zip(stale, jobs):
+        if job.ok:
+            stage_cache.store_stage(cache_dir, folder_path, stage.name, stage.key)
+    return all_ok
+
 
 def main():
     # Parse command-line arguments
@@ -21,38 +212,25 @@ def main():
     else:
         argv = []
 
-    if len(argv) < 3:
-        print("Usage: blender --background --python goldsrc_pipeline.py -- FOLDER_PATH LEVEL_NAME APPEND_BLEND SCALAR OVERRIDE_ENTITIES_PATH")
-        sys.exit(1)
-
-    folder_path = argv[0]
-    level_name = argv[1]
-    export_file_path = argv[2]
-    skybox_file_path = argv[3]
-
-    try:
-        scalar = float(argv[4])
-    except ValueError:
-        print("Error: SCALAR must be a float")
-        sys.exit(1)
-
-    override_entities_path = argv[5]
+    args = parse_args(argv)
+    folder_path = args.folder_path
 
     if not os.path.isdir(folder_path):
         print(f"Error: folder does not exist: {folder_path}")
         sys.exit(1)
 
-    # perform this stage
-    import_all_objs.stage_import_all_objs(1, folder_path, scalar)
-    combine_into_uv2.stage_combine_uv2(2, folder_path)
-    fix_up_mesh.stage_fix_up_mesh(3, folder_path)
-    coop_lightmap.stage_coop_lightmap(4, folder_path)
-    set_fast64_stuff.stage_set_fast64_stuff(5, folder_path)
-    export_level.stage_export_level(6, folder_path, level_name, export_file_path, override_entities_path)
-
-    convert_mdls.stage_convert_mdls(folder_path)
-    convert_sprs.stage_convert_sprs(folder_path, scalar)
-    convert_skybox.stage_convert_skybox(folder_path, skybox_file_path)
+    # background jobs read the policy from the environment
+    stage_cache.set_keep_blends(args.keep_blends)
+    script_version = stage_cache.get_script_version()
+
+    # perform the stages that are not current
+    stages = get_level_stages(args)
+    run_level_stages(folder_path, stages, get_level_stage_keys(args, stages, script_version), args.rebuild)
+
+    asset_stages = get_asset_stages(args, script_version)
+    if not run_asset_stages(folder_path, asset_stages, os.path.join(folder_path, "6-export.blend"), args.serial_assets, args.rebuild):
+        print("Error: asset conversion failed")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,14 @@
 import bpy
 import os
 import sys
-import re
 import math
 import bmesh
+import entity_index
+import stage_cache
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import goldsrc_cache
+import goldsrc_parse_ents
 
 
 def delete_default_objects():
@@ -55,37 +60,10 @@ def import_level_objs(folder_path):
     recalc_normals_for_clipnode_objects()
 
 
-def parse_entities(filepath):
-    """Parse a GoldSrc-style entity lump file into a list of dicts, with simple logging."""
-    print(f"Parsing entity file: {filepath}")
-
-    try:
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            text = f.read()
-    except Exception as e:
-        print(f"❌ Failed to read file: {e}")
-        return []
-
-    # Split the text into entity blocks {...}
-    blocks = re.findall(r'\{([^}]*)\}', text, re.DOTALL)
-    print(f"Found {len(blocks)} entity blocks")
-
-    entities = []
-    for i, block in enumerate(blocks, 1):
-        entity = {}
-        # Find all key-value pairs like "key" "value"
-        pairs = re.findall(r'"([^"]+)"\s+"([^"]*)"', block)
-        for key, value in pairs:
-            entity[key] = value
-
-        entities.append(entity)
-
-    return entities
-
-
 def import_entities(filepath, scalar):
     scalar = 1 / -scalar
-    entities = parse_entities(filepath)
+    cache_dir = goldsrc_cache.get_cache_dir(os.path.dirname(filepath))
+    entities = goldsrc_parse_ents.load_entities_file(filepath, cache_dir)
 
     # Get or create "Entities" collection
     if "Entities" not in bpy.data.collections:
@@ -133,4 +111,5 @@ def stage_import_all_objs(num, folder_path, scalar):
     delete_default_objects()
     import_level_objs(folder_path)
     import_entities(folder_path + "/entities.txt", scalar)
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(folder_path, f"{num}-imported-objs.blend"))
+    entity_index.build_entity_index()
+    stage_cache.save_stage_blend(folder_path, f"{num}-imported-objs.blend")
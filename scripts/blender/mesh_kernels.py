@@ -0,0 +1,487 @@
+"""
+Plain NumPy mesh kernels used by the Blender stages. Nothing here imports
+bpy, so the kernels can be checked and benchmarked outside of Blender:
+
+    python mesh_kernels.py
+"""
+import sys
+import time
+
+import numpy as np
+
+# the 27 cells around (and including) a cell
+NEIGHBOR_OFFSETS = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64)
+
+# odd multipliers for hashing integer tuples into one uint64
+HASH_PRIMES = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5], dtype=np.uint64)
+
+
+def hash_cells(counts, cells):
+    """
+    Hash (count, cx, cy, cz) rows into uint64 keys. Collisions only add
+    candidates that the exact test rejects, they never lose a match.
+    """
+    with np.errstate(over='ignore'):
+        key = counts.astype(np.uint64) * HASH_PRIMES[0]
+        for axis in range(3):
+            key ^= cells[:, axis].astype(np.uint64) * HASH_PRIMES[axis + 1]
+    return key
+
+
+def expand_groups(firsts, group_starts, group_counts):
+    """
+    For every query i with a matching group, pair firsts[i] with each member
+    index of that group. Returns (queries, members) as flat arrays.
+    """
+    total = int(group_counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    queries = np.repeat(firsts, group_counts)
+    # position inside the group for every expanded entry
+    ends = np.cumsum(group_counts)
+    within = np.arange(total) - np.repeat(ends - group_counts, group_counts)
+    members = np.repeat(group_starts, group_counts) + within
+    return queries, members
+
+
+def find_backface_pairs(positions, face_starts, face_sizes, face_verts, normals, threshold):
+    """
+    Pairs of faces with the same corner count whose vertex positions match
+    within threshold in both directions and whose normals are opposite,
+    the same test as the original O(F^2) scan.
+
+    Every vertex of a matching face lies within threshold of the other face,
+    so the corners of the two bounding boxes are also within threshold.
+    Faces are hashed by the grid cell of their bounding box minimum and only
+    faces in the 27 surrounding cells are tested.
+
+    Args:
+        positions: (V, 3) vertex positions.
+        face_starts: (F,) offset of each face's first corner in face_verts.
+        face_sizes: (F,) corner count of each face.
+        face_verts: (L,) vertex index of every face corner.
+        normals: (F, 3) face normals.
+        threshold: match distance.
+
+    Returns:
+        (P, 2) int array of face index pairs (i, j) with i < j, sorted.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    normals = np.asarray(normals, dtype=np.float64)
+    face_starts = np.asarray(face_starts, dtype=np.int64)
+    face_sizes = np.asarray(face_sizes, dtype=np.int64)
+    face_verts = np.asarray(face_verts, dtype=np.int64)
+
+    face_count = len(face_sizes)
+    if face_count < 2:
+        return np.empty((0, 2), dtype=np.int64)
+
+    # bounding box minimum of every face
+    corner_faces = np.repeat(np.arange(face_count), face_sizes)
+    face_mins = np.full((face_count, 3), np.inf)
+    np.minimum.at(face_mins, corner_faces, positions[face_verts])
+
+    cells = np.floor(face_mins / threshold).astype(np.int64)
+    keys = hash_cells(face_sizes, cells)
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    unique_keys, group_starts, group_counts = np.unique(sorted_keys, return_index=True, return_counts=True)
+
+    # candidate pairs from the neighbouring cells
+    cand_a = []
+    cand_b = []
+    for offset in NEIGHBOR_OFFSETS:
+        neighbor_keys = hash_cells(face_sizes, cells + offset)
+        slot = np.searchsorted(unique_keys, neighbor_keys)
+        slot[slot == len(unique_keys)] = 0
+        found = np.nonzero(unique_keys[slot] == neighbor_keys)[0]
+        queries, members = expand_groups(found, group_starts[slot[found]], group_counts[slot[found]])
+        others = order[members]
+        keep = queries < others
+        cand_a.append(queries[keep])
+        cand_b.append(others[keep])
+
+    cand = np.stack((np.concatenate(cand_a), np.concatenate(cand_b)), axis=1)
+    if len(cand) == 0:
+        return cand
+    cand = np.unique(cand, axis=0)
+
+    # exact test, cheap checks first
+    cand = cand[face_sizes[cand[:, 0]] == face_sizes[cand[:, 1]]]
+    normal_sum = normals[cand[:, 0]] + normals[cand[:, 1]]
+    cand = cand[np.sqrt((normal_sum * normal_sum).sum(axis=1)) < threshold]
+
+    threshold_sq = threshold * threshold
+    matched = np.zeros(len(cand), dtype=bool)
+    sizes = face_sizes[cand[:, 0]]
+    for size in np.unique(sizes):
+        rows = np.nonzero(sizes == size)[0]
+        corners = np.arange(size)
+        pa = positions[face_verts[face_starts[cand[rows, 0]][:, None] + corners]]
+        pb = positions[face_verts[face_starts[cand[rows, 1]][:, None] + corners]]
+        diff = pa[:, :, None, :] - pb[:, None, :, :]
+        close = (diff * diff).sum(axis=3) < threshold_sq
+        matched[rows] = close.any(axis=2).all(axis=1) & close.any(axis=1).all(axis=1)
+
+    return cand[matched]
+
+
+def find_backface_pairs_bruteforce(positions, face_starts, face_sizes, face_verts, normals, threshold):
+    """Reference O(F^2) version of find_backface_pairs, for checking and benchmarking."""
+    positions = np.asarray(positions, dtype=np.float64)
+    normals = np.asarray(normals, dtype=np.float64)
+    threshold_sq = threshold * threshold
+
+    def verts_match(a, b):
+        return all(any(((p - q) ** 2).sum() < threshold_sq for q in b) for p in a)
+
+    face_points = [positions[face_verts[s:s + n]] for s, n in zip(face_starts, face_sizes)]
+    pairs = []
+    for i in range(len(face_points)):
+        for j in range(i + 1, len(face_points)):
+            if face_sizes[i] != face_sizes[j]:
+                continue
+            if verts_match(face_points[i], face_points[j]) and verts_match(face_points[j], face_points[i]) and np.linalg.norm(normals[i] + normals[j]) < threshold:
+                pairs.append((i, j))
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+def find_edge_splits(positions, edges, threshold, cell_size=None):
+    """
+    Find every vertex that lies within threshold of an edge it is not part
+    of (a T-junction) in one vectorized pass.
+
+    Vertices are bucketed in a uniform grid. Each edge is cut into segments
+    no longer than a cell, and only the cells touched by a segment's bounding
+    box grown by threshold are looked at, which is at most 27 per segment.
+
+    Args:
+        positions: (V, 3) vertex positions.
+        edges: (E, 2) vertex indices of every edge.
+        threshold: distance below which a vertex counts as on the edge.
+        cell_size: grid cell size, defaults to the median edge length.
+
+    Returns:
+        (split_edges, split_ts): edge index and factor from the edge's first
+        vertex of every split, sorted by edge then factor, without duplicates.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+    if len(edges) == 0 or len(positions) < 3:
+        return empty
+
+    p0 = positions[edges[:, 0]]
+    d = positions[edges[:, 1]] - p0
+    lengths = np.sqrt((d * d).sum(axis=1))
+
+    if cell_size is None:
+        cell_size = float(np.median(lengths))
+    cell_size = max(cell_size, 2.0 * threshold)
+
+    # segments of at most one cell along every edge
+    segment_counts = np.maximum(1, np.ceil(lengths / cell_size).astype(np.int64))
+    segment_edges = np.repeat(np.arange(len(edges)), segment_counts)
+    ends = np.cumsum(segment_counts)
+    within = np.arange(int(ends[-1])) - np.repeat(ends - segment_counts, segment_counts)
+    steps = np.repeat(segment_counts, segment_counts)
+    a = p0[segment_edges] + d[segment_edges] * (within / steps)[:, None]
+    b = p0[segment_edges] + d[segment_edges] * ((within + 1) / steps)[:, None]
+    lo = np.floor((np.minimum(a, b) - threshold) / cell_size).astype(np.int64)
+    span = np.floor((np.maximum(a, b) + threshold) / cell_size).astype(np.int64) - lo
+
+    # vertex grid
+    no_counts = np.zeros(len(positions), dtype=np.int64)
+    vert_keys = hash_cells(no_counts, np.floor(positions / cell_size).astype(np.int64))
+    order = np.argsort(vert_keys, kind='stable')
+    unique_keys, group_starts, group_counts = np.unique(vert_keys[order], return_index=True, return_counts=True)
+
+    candidates = []
+    for offset in NEIGHBOR_OFFSETS + 1:
+        segments = np.nonzero((offset <= span).all(axis=1))[0]
+        keys = hash_cells(np.zeros(len(segments), dtype=np.int64), lo[segments] + offset)
+        slot = np.searchsorted(unique_keys, keys)
+        slot[slot == len(unique_keys)] = 0
+        found = np.nonzero(unique_keys[slot] == keys)[0]
+        queries, members = expand_groups(segments[found], group_starts[slot[found]], group_counts[slot[found]])
+        # encode (edge, vertex) in one integer so duplicates collapse cheaply
+        candidates.append(segment_edges[queries] * len(positions) + order[members])
+
+    candidates = np.unique(np.concatenate(candidates))
+    cand_edges = candidates // len(positions)
+    cand_verts = candidates % len(positions)
+
+    # a vertex never splits its own edge
+    own = (edges[cand_edges, 0] == cand_verts) | (edges[cand_edges, 1] == cand_verts)
+    cand_edges = cand_edges[~own]
+    cand_verts = cand_verts[~own]
+
+    # exact closest point test
+    ce = d[cand_edges]
+    length_sq = (ce * ce).sum(axis=1)
+    rel = positions[cand_verts] - p0[cand_edges]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length_sq > 0, (rel * ce).sum(axis=1) / length_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    offset = rel - ce * t[:, None]
+    hit = (offset * offset).sum(axis=1) < threshold * threshold
+
+    # splits at the end points only make a vertex that the merge removes again
+    hit &= (t > 0.0) & (t < 1.0)
+
+    split = np.unique(np.stack((cand_edges[hit].astype(np.float64), t[hit]), axis=1), axis=0)
+    if len(split) == 0:
+        return empty
+    return split[:, 0].astype(np.int64), split[:, 1]
+
+
+def find_edge_splits_bruteforce(positions, edges, threshold):
+    """Reference version of find_edge_splits testing every vertex against every edge."""
+    positions = np.asarray(positions, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    split = set()
+    vert_ids = np.arange(len(positions))
+    for i, (a, b) in enumerate(edges):
+        p0 = positions[a]
+        d = positions[b] - p0
+        length_sq = d.dot(d)
+        rel = positions - p0
+        t = np.clip(rel.dot(d) / length_sq, 0.0, 1.0) if length_sq > 0 else np.zeros(len(positions))
+        offset = rel - d * t[:, None]
+        hit = ((offset * offset).sum(axis=1) < threshold * threshold) & (vert_ids != a) & (vert_ids != b) & (t > 0.0) & (t < 1.0)
+        split.update((i, float(x)) for x in t[hit])
+    split = sorted(split)
+    return np.array([s[0] for s in split], dtype=np.int64), np.array([s[1] for s in split], dtype=np.float64)
+
+
+def group_edge_splits(split_edges, split_ts):
+    """[(edge index, [factors...]), ...] from the sorted output of find_edge_splits."""
+    if len(split_edges) == 0:
+        return []
+    starts = np.flatnonzero(np.r_[True, split_edges[1:] != split_edges[:-1]])
+    return list(zip(split_edges[starts].tolist(), (ts.tolist() for ts in np.split(split_ts, starts[1:]))))
+
+
+# integer offsets tried around a triangle's rounded average UV, in order
+UV_SHIFT_OFFSETS = np.array([(0, 0)] + [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)], dtype=np.float32)
+
+
+def wrap_triangle_uvs(uvs):
+    """
+    Shift each triangle's UVs by a whole number so they fit into [0, 1],
+    without scaling. The rounded average UV is tried first, then the 3x3
+    offsets around it, and the first shift that fits wins. Triangles that
+    fit no shift are left alone.
+
+    Works in float32 like mathutils, so results match the per-triangle
+    Vector code bit for bit.
+
+    Args:
+        uvs: (T, 3, 2) UVs of every triangle corner.
+
+    Returns:
+        (T, 3, 2) float32 shifted UVs.
+    """
+    uvs = np.asarray(uvs, dtype=np.float32)
+    if len(uvs) == 0:
+        return uvs.copy()
+
+    # same summation order as sum(uvs, Vector((0.0, 0.0))) / 3.0
+    avg = ((np.float32(0.0) + uvs[:, 0]) + uvs[:, 1] + uvs[:, 2]) / np.float32(3.0)
+    base = np.round(avg)
+
+    shifts = base[:, None, :] + UV_SHIFT_OFFSETS[None, :, :]
+    shifted = uvs[:, None, :, :] - shifts[:, :, None, :]
+    fits = ((shifted >= 0.0) & (shifted <= 1.0)).all(axis=(2, 3))
+
+    found = fits.any(axis=1)
+    first = fits.argmax(axis=1)
+    shift = np.where(found[:, None], shifts[np.arange(len(uvs)), first], np.float32(0.0))
+    return uvs - shift[:, None, :]
+
+
+def wrap_triangle_uvs_scalar(uvs):
+    """Per-triangle reference for wrap_triangle_uvs, the loop convert_mdls used to run."""
+    out = np.array(uvs, dtype=np.float32)
+    f32 = np.float32
+
+    def can_shift_into_unit(tri, shift):
+        for u, v in tri:
+            if not (0.0 <= u - shift[0] <= 1.0 and 0.0 <= v - shift[1] <= 1.0):
+                return False
+        return True
+
+    for tri in out:
+        avg = [(f32(0.0) + tri[0][i] + tri[1][i] + tri[2][i]) / f32(3.0) for i in range(2)]
+        base_shift = (f32(round(avg[0])), f32(round(avg[1])))
+
+        shift_to_use = None
+        if can_shift_into_unit(tri, base_shift):
+            shift_to_use = base_shift
+        else:
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    test_shift = (base_shift[0] + f32(dx), base_shift[1] + f32(dy))
+                    if can_shift_into_unit(tri, test_shift):
+                        shift_to_use = test_shift
+                        break
+                if shift_to_use:
+                    break
+
+        if shift_to_use:
+            tri -= np.array(shift_to_use, dtype=np.float32)
+    return out
+
+
+def make_backface_test_mesh(quads_per_side, backface_ratio=0.25, jitter=0.0, seed=0):
+    """
+    Synthetic mesh: a grid of quads in the XZ plane facing +Y, plus reversed
+    copies of a fraction of them (optionally jittered) facing -Y.
+    """
+    rng = np.random.default_rng(seed)
+    n = quads_per_side
+    xs, zs = np.meshgrid(np.arange(n + 1, dtype=np.float64), np.arange(n + 1, dtype=np.float64), indexing='ij')
+    grid = np.stack((xs.ravel(), np.zeros(xs.size), zs.ravel()), axis=1)
+
+    ix, iz = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    v0 = (ix * (n + 1) + iz).ravel()
+    quads = np.stack((v0, v0 + 1, v0 + n + 2, v0 + n + 1), axis=1)
+
+    back = rng.choice(len(quads), int(len(quads) * backface_ratio), replace=False)
+    back_quads = quads[back][:, ::-1] + len(grid)
+    back_grid = grid + rng.uniform(-jitter, jitter, grid.shape)
+
+    positions = np.concatenate((grid, back_grid))
+    faces = np.concatenate((quads, back_quads))
+    normals = np.concatenate((np.tile([0.0, 1.0, 0.0], (len(quads), 1)), np.tile([0.0, -1.0, 0.0], (len(back_quads), 1))))
+
+    face_sizes = np.full(len(faces), 4, dtype=np.int64)
+    face_starts = np.arange(len(faces), dtype=np.int64) * 4
+    return positions, face_starts, face_sizes, faces.ravel(), normals
+
+
+def benchmark_backfaces(threshold=0.025):
+    print("backface pairing")
+
+    # equivalence with the brute force scan, including near-threshold jitter
+    for seed in range(4):
+        mesh = make_backface_test_mesh(12, backface_ratio=0.5, jitter=threshold * 0.9, seed=seed)
+        fast = find_backface_pairs(*mesh, threshold)
+        slow = find_backface_pairs_bruteforce(*mesh, threshold)
+        if not np.array_equal(fast, slow):
+            print(f"  MISMATCH seed {seed}: {len(fast)} vs {len(slow)} pairs")
+            return False
+    print("  matches the O(F^2) scan")
+
+    for size in (20, 100, 200, 400):
+        mesh = make_backface_test_mesh(size)
+        faces = len(mesh[2])
+
+        start = time.perf_counter()
+        pairs = find_backface_pairs(*mesh, threshold)
+        fast_time = time.perf_counter() - start
+
+        line = f"  {faces:7d} faces: {len(pairs):6d} pairs in {fast_time * 1000:8.1f} ms"
+        if faces <= 1000:
+            start = time.perf_counter()
+            find_backface_pairs_bruteforce(*mesh, threshold)
+            line += f", brute force {time.perf_counter() - start:7.2f} s"
+        print(line)
+    return True
+
+
+def make_tjunction_test_mesh(quads_per_side, seed=0):
+    """
+    Synthetic mesh with T-junctions: a grid of unit quads next to a grid of
+    half size quads, so every other fine vertex on the shared border sits on
+    a coarse edge. A little jitter below the threshold is added.
+    """
+    rng = np.random.default_rng(seed)
+    n = quads_per_side
+
+    def grid(cells, size, x0):
+        xs, zs = np.meshgrid(np.arange(cells + 1) * size + x0, np.arange(cells + 1) * size, indexing='ij')
+        points = np.stack((xs.ravel(), np.zeros(xs.size), zs.ravel()), axis=1)
+        ix, iz = np.meshgrid(np.arange(cells), np.arange(cells), indexing='ij')
+        v0 = (ix * (cells + 1) + iz).ravel()
+        quads = np.stack((v0, v0 + 1, v0 + cells + 2, v0 + cells + 1), axis=1)
+        return points, quads
+
+    coarse_points, coarse_quads = grid(n, 1.0, 0.0)
+    fine_points, fine_quads = grid(2 * n, 0.5, float(n))
+    positions = np.concatenate((coarse_points, fine_points))
+    positions += rng.uniform(-0.004, 0.004, positions.shape)
+    quads = np.concatenate((coarse_quads, fine_quads + len(coarse_points)))
+
+    edges = np.stack((quads, np.roll(quads, -1, axis=1)), axis=2).reshape(-1, 2)
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    return positions, edges
+
+
+def benchmark_tjunctions(threshold=0.025):
+    print("T-junction splits")
+
+    for seed in range(3):
+        positions, edges = make_tjunction_test_mesh(8, seed=seed)
+        fast = find_edge_splits(positions, edges, threshold)
+        slow = find_edge_splits_bruteforce(positions, edges, threshold)
+        if not (np.array_equal(fast[0], slow[0]) and np.allclose(fast[1], slow[1])):
+            print(f"  MISMATCH seed {seed}: {len(fast[0])} vs {len(slow[0])} splits")
+            return False
+    print("  matches the all pairs scan")
+
+    for size in (10, 50, 100, 200):
+        positions, edges = make_tjunction_test_mesh(size)
+
+        start = time.perf_counter()
+        split_edges, _ = find_edge_splits(positions, edges, threshold)
+        fast_time = time.perf_counter() - start
+
+        line = f"  {len(edges):7d} edges: {len(split_edges):6d} splits in {fast_time * 1000:8.1f} ms"
+        if len(edges) <= 2000:
+            start = time.perf_counter()
+            find_edge_splits_bruteforce(positions, edges, threshold)
+            line += f", all pairs {time.perf_counter() - start:7.2f} s"
+        print(line)
+    return True
+
+
+def check_uv_wrapping():
+    """wrap_triangle_uvs must match the scalar version exactly."""
+    print("MDL UV wrapping")
+    rng = np.random.default_rng(0)
+
+    cases = [
+        # random triangles spread over a few tiles
+        rng.uniform(-3.0, 3.0, (20000, 3, 2)),
+        # small triangles, mostly wrappable
+        rng.uniform(-3.0, 3.0, (20000, 1, 2)) + rng.uniform(0.0, 0.9, (20000, 3, 2)),
+        # UVs exactly on tile borders and rounding ties
+        rng.integers(-4, 5, (20000, 3, 2)) * 0.5,
+    ]
+    for i, uvs in enumerate(cases):
+        fast = wrap_triangle_uvs(uvs)
+        slow = wrap_triangle_uvs_scalar(uvs)
+        if not np.array_equal(fast, slow):
+            bad = np.nonzero((fast != slow).any(axis=(1, 2)))[0]
+            print(f"  MISMATCH in case {i}: {len(bad)} triangles, first {uvs[bad[0]].tolist()}")
+            return False
+
+    uvs = cases[1]
+    start = time.perf_counter()
+    wrap_triangle_uvs(uvs)
+    fast_time = time.perf_counter() - start
+    start = time.perf_counter()
+    wrap_triangle_uvs_scalar(uvs)
+    slow_time = time.perf_counter() - start
+    print(f"  matches the scalar version, {len(uvs)} triangles in {fast_time * 1000:.1f} ms (scalar {slow_time:.2f} s)")
+    return True
+
+
+if __name__ == "__main__":
+    ok = benchmark_backfaces()
+    ok = benchmark_tjunctions() and ok
+    ok = check_uv_wrapping() and ok
+    if not ok:
+        sys.exit(1)
@@ -2,6 +2,13 @@ import bpy
 import os
 import sys
 import re
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import image_meta
+import image_stage
+from entity_index import get_entity_index
+import stage_cache
 
 ignore_collision_classes = [
     "func_illusionary",
@@ -57,23 +64,71 @@ def update_material_cache(mat):
         bpy.ops.material.update_f3d_nodes()
 
 
+def read_image_pixels(image):
+    """Copy an image's float pixels into an (h, w, channels) array in one call."""
+    width, height = image.size
+    pixels = np.empty(width * height * image.channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(height, width, image.channels)
+
+
+# image name -> meta dict for this run
+_image_meta = {}
+
+
+def get_image_meta(image):
+    """Per-image facts (has_alpha, grayscale, unique_colors), cached by file content across runs."""
+    meta = _image_meta.get(image.name)
+    if meta is None:
+        filepath = bpy.path.abspath(image.filepath) if image.filepath else None
+        meta = image_meta.get_image_meta(filepath, lambda: read_image_pixels(image))
+        _image_meta[image.name] = meta
+    return meta
+
+
 def check_image_has_transparency(image):
-    if image.channels != 4:
+    if not image or image.channels != 4:
         return False  # No alpha channel
-    pixels = list(image.pixels)
-    # Check alpha values (every 4th value starting from index 3)
-    for i in range(3, len(pixels), 4):
-        if pixels[i] < 1.0:
-            return True
-    return False
+    return get_image_meta(image)['has_alpha']
+
+
+# source texture path -> additive path, so each variant is looked at once per run
+_additive_paths = {}
+
+# the level's textures folder, only its textures get generated additive variants
+_additive_source_dir = None
+
+
+def get_additive_filepath(filepath):
+    """
+    Path of the additive variant of a texture. A texture of the level's
+    textures folder gets it written next to it the first time an additive
+    material asks for it, other textures only have one if it already exists.
+    """
+    source = os.path.normpath(bpy.path.abspath(filepath))
+    additive_filepath = _additive_paths.get(source)
+    if additive_filepath:
+        return additive_filepath
+
+    additive_filepath = image_stage.get_additive_path(source)
+    in_textures = _additive_source_dir is not None and os.path.commonpath([os.path.abspath(source), _additive_source_dir]) == _additive_source_dir
+    if in_textures and (not os.path.exists(additive_filepath) or os.path.getmtime(additive_filepath) < os.path.getmtime(source)):
+        image_stage.write_additive(source)
+
+    _additive_paths[source] = additive_filepath
+    return additive_filepath
 
 
 def load_additive_image(tex):
     if not tex or not tex.filepath:
         return tex
 
-    # Construct the additive filepath
-    additive_filepath = tex.filepath.replace('.png', '_additive.png')
+    # Construct the additive filepath, generating the image if needed
+    try:
+        additive_filepath = get_additive_filepath(tex.filepath)
+    except Exception as ex:
+        print(f"Warning: Could not create additive image for {tex.filepath}: {ex}, using original")
+        return tex
 
     # Check if additive image is already loaded
     additive_image = bpy.data.images.get(os.path.basename(additive_filepath))
@@ -163,6 +218,7 @@ def set_faces_smooth_for_material(obj, mat):
 
 
 def apply_brush_types_to_objects():
+    entities = get_entity_index()
     for obj in bpy.data.objects:
         obj_name = obj.name
 
@@ -183,7 +239,7 @@ def apply_brush_types_to_objects():
             if obj_name.startswith("M_"):
                 try:
                     entity_index = int(re.search(r'ENT_(\d+)#', obj_name).group(1))
-                    entity_obj = next((o for o in bpy.data.objects if o.name.startswith(f"{entity_index}#")), None)
+                    entity_obj = entities.empty(entity_index)
                     if entity_obj and entity_obj["zhlt_noclip"] and str(entity_obj["zhlt_noclip"]) == "1":
                         obj["ignore_collision"] = True
                     if entity_obj and entity_obj["zhlt_invisible"] and str(entity_obj["zhlt_invisible"]) == "1":
@@ -210,6 +266,7 @@ def apply_invisible_materials_to_objects():
 
 
 def apply_rendermode_to_objects():
+    entities = get_entity_index()
     for obj in bpy.data.objects:
         # Only check objects that have material slots
         if not hasattr(obj, "material_slots"):
@@ -219,7 +276,7 @@ def apply_rendermode_to_objects():
         try:
             obj_name = obj.name
             entity_index = int(re.search(r'ENT_(\d+)#', obj_name).group(1))
-            entity_obj = next((o for o in bpy.data.objects if o.name.startswith(f"{entity_index}#")), None)
+            entity_obj = entities.empty(entity_index)
             entity_rendermode = int(entity_obj.get("rendermode") or 0)
             entity_renderamt = int(entity_obj.get("renderamt") or 255)
             entity_rendercolor = list(map(int, (entity_obj.get("rendercolor") or "255 255 255").split()))
@@ -260,10 +317,14 @@ def apply_rendermode_to_objects():
 
 
 def stage_set_fast64_stuff(num, folder):
+    global _additive_source_dir
+    _additive_source_dir = os.path.normpath(os.path.abspath(os.path.join(folder, "textures")))
+
     bpy.data.scenes["Scene"].f3d_simple = False
 
     apply_brush_types_to_objects()
     apply_invisible_materials_to_objects()
     apply_rendermode_to_objects()
+    image_meta.flush()
 
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(folder, f"{num}-set-fast64.blend"))
+    stage_cache.save_stage_blend(folder, f"{num}-set-fast64.blend")
@@ -0,0 +1,129 @@
+import bpy
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import goldsrc_cache
+
+# Which stage .blend files get written. Background jobs inherit the policy
+# through the environment.
+KEEP_BLENDS_ENV = 'GOLDSRC_KEEP_BLENDS'
+KEEP_BLENDS_POLICIES = ('all', 'checkpoints')
+DEFAULT_KEEP_BLENDS = 'checkpoints'
+
+# .blend files that are read back: the resume point in front of the export
+# stage, and the exported level the asset jobs start from
+CHECKPOINT_BLENDS = {'5-set-fast64.blend', '6-export.blend'}
+
+scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# paths of the .blend files written by this process
+_saved_blends = set()
+
+
+def get_keep_blends():
+    policy = os.environ.get(KEEP_BLENDS_ENV, DEFAULT_KEEP_BLENDS)
+    return policy if policy in KEEP_BLENDS_POLICIES else DEFAULT_KEEP_BLENDS
+
+
+def set_keep_blends(policy):
+    os.environ[KEEP_BLENDS_ENV] = policy
+
+
+def save_stage_blend(folder, filename):
+    """
+    Save the current file as a stage's .blend, unless the policy skips it.
+    A skipped file left over from an earlier run is removed, it would be stale.
+    """
+    path = os.path.join(folder, filename)
+    if get_keep_blends() != 'all' and filename not in CHECKPOINT_BLENDS:
+        if os.path.exists(path):
+            os.remove(path)
+        print(f"Skipped writing {filename}")
+        return None
+
+    bpy.ops.wm.save_mainfile(filepath=path)
+    _saved_blends.add(os.path.normpath(path))
+    return path
+
+
+def list_files(folder, extensions=None, recursive=False):
+    """Sorted paths of the files in a folder, for hashing. A missing folder has none."""
+    if not os.path.isdir(folder):
+        return []
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for filename in sorted(files):
+            if extensions is None or filename.lower().endswith(extensions):
+                paths.append(os.path.join(root, filename))
+        if not recursive:
+            break
+    return paths
+
+
+def list_script_files():
+    """Every importable module the stages can run: scripts/, scripts/blender/ and packages."""
+    paths = []
+    for root, dirs, files in os.walk(scripts_dir):
+        dirs[:] = sorted(d for d in dirs if d.isidentifier() and d != '__pycache__')
+        for filename in sorted(files):
+            if filename.endswith('.py') and filename[:-3].isidentifier():
+                paths.append(os.path.join(root, filename))
+    return paths
+
+
+def get_script_version():
+    """Key of the code that produces the stage outputs, including the Blender version."""
+    return goldsrc_cache.make_key('scripts', list_script_files(), (bpy.app.version_string,))
+
+
+def get_stage_key(name, sources, extra=()):
+    return goldsrc_cache.make_key(f'stage-{name}', sources, extra)
+
+
+def _blend_stamp(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class StageRecord:
+    """What a finished stage left behind: its .blend checkpoint, if one was written."""
+
+    def __init__(self, blend=None, stamp=None):
+        self.blend = blend
+        self.stamp = stamp
+
+    def has_blend(self, folder):
+        if not self.blend:
+            return False
+        path = os.path.join(folder, self.blend)
+        return os.path.exists(path) and _blend_stamp(path) == self.stamp
+
+
+def load_stage(cache_dir, folder, name, key, outputs=()):
+    """
+    The record of a stage that finished with the same key and whose outputs
+    still exist, otherwise None.
+    """
+    value = goldsrc_cache.load(cache_dir, f'stage-{name}', key)
+    if value is None:
+        return None
+    if not all(os.path.exists(os.path.join(folder, output)) for output in outputs):
+        return None
+    return StageRecord(value.get('blend'), value.get('stamp'))
+
+
+def store_stage(cache_dir, folder, name, key, blend_filename=None):
+    """Record a finished stage, with its .blend only if this process just wrote it."""
+    value = {'blend': None, 'stamp': None}
+    if blend_filename:
+        path = os.path.normpath(os.path.join(folder, blend_filename))
+        if path in _saved_blends and os.path.exists(path):
+            value = {'blend': blend_filename, 'stamp': _blend_stamp(path)}
+    goldsrc_cache.store(cache_dir, f'stage-{name}', key, value)
+
+
+def clear_stage(cache_dir, name):
+    """Forget a stage before it runs, so an interrupted run is not taken as current."""
+    goldsrc_cache.remove(cache_dir, f'stage-{name}')
@@ -3,9 +3,21 @@ import sys
 import re
 import shutil
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import extract_hulls
+import goldsrc_bsp
+import goldsrc_cache
 from goldsrc_parse_ents import convert_entities_to_lua
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl that makes a file share the blocks of another (btrfs, XFS)
+FICLONE = 0x40049409
+
 # Load the template from template-main.lua
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -55,12 +67,40 @@ def get_entity_aabbs(path):
     with open(path, 'r') as f:
         return f.read()
 
-def process_textures(path, missing_png_path, override_texture_path):
+def _link_or_copy(src, dst):
+    """
+    Make dst a reflink or hardlink of src where the filesystem allows it,
+    a copy otherwise. dst is replaced through a temporary file, so other
+    links to the old dst never see the write.
+    """
+    tmp = f"{dst}.{threading.get_ident()}.tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        if fcntl is None:
+            raise OSError("reflinks are not supported here")
+        with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _copy_file(src, dst):
+    # never write into dst itself, it may be linked to other textures
+    tmp = f"{dst}.{threading.get_ident()}.tmp"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def collect_texture_pngs(path):
     levels_dir = os.path.join(path, 'levels')
     actors_dir = os.path.join(path, 'actors')
-    textures_dir = os.path.join(path, 'textures')
-    os.makedirs(textures_dir, exist_ok=True)
-
     png_files = []
 
     # Collect PNGs from levels (recursive)
@@ -70,7 +110,7 @@ def process_textures(path, missing_png_path, override_texture_path):
                 if file.lower().endswith('.png'):
                     png_files.append(os.path.join(root, file))
 
-    # Collect PNGs from actors (recursive)
+    # Collect PNGs from actors (recursive), the converted assets keep their textures
     if os.path.exists(actors_dir):
         for root, dirs, files in os.walk(actors_dir):
             dirs[:] = [d for d in dirs if not d.endswith('_mdl') and not d.endswith("_spr") and not d.endswith("_skybox")]
@@ -78,21 +118,81 @@ def process_textures(path, missing_png_path, override_texture_path):
                 if file.lower().endswith('.png'):
                     png_files.append(os.path.join(root, file))
 
-    # Process each PNG
-    for png_path in png_files:
-        basename = os.path.basename(png_path)
+    return png_files
 
-        # Determine source path: use override if available, otherwise original
-        source_path = png_path
-        if override_texture_path and os.path.exists(os.path.join(override_texture_path, basename)):
-            source_path = os.path.join(override_texture_path, basename)
 
-        # Copy to textures directory
-        dest = os.path.join(textures_dir, basename)
-        shutil.copy2(source_path, dest)
+def process_textures(path, missing_png_path, override_texture_path, cache_dir, workers=None):
+    """
+    Move the level's textures to mod/textures and leave the placeholder in
+    their place. Every PNG is hashed once, each distinct payload is copied
+    once and the other names and all placeholders are links to it.
+    """
+    textures_dir = os.path.join(path, 'textures')
+    os.makedirs(textures_dir, exist_ok=True)
+    png_files = collect_texture_pngs(path)
+
+    # the placeholders link to a copy outside the mod, not to the one in scripts/
+    missing_hash = goldsrc_cache.hash_file(missing_png_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    placeholder_path = os.path.join(cache_dir, 'missing_texture.png')
+    if not os.path.exists(placeholder_path) or goldsrc_cache.hash_file(placeholder_path) != missing_hash:
+        _copy_file(missing_png_path, placeholder_path)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        hashes = list(pool.map(goldsrc_cache.hash_file, png_files))
+
+        # Determine the source of every name, use override if available, otherwise
+        # original. Like before the last PNG of a name wins, differing ones are reported.
+        sources = {}
+        versions = {}
+        placeholders = []
+        for png_path, png_hash in zip(png_files, hashes):
+            basename = os.path.basename(png_path)
+            if png_hash == missing_hash:
+                # replaced by an earlier run of this script, mod/textures has the texture
+                if not os.path.exists(os.path.join(textures_dir, basename)):
+                    print(f"Warning: {png_path} is a placeholder and textures/{basename} is missing")
+                continue
 
-        # Replace original with copy of missing_png_path
-        shutil.copy2(missing_png_path, png_path)
+            source_path = png_path
+            if override_texture_path and os.path.exists(os.path.join(override_texture_path, basename)):
+                source_path = os.path.join(override_texture_path, basename)
+            source_hash = png_hash if source_path == png_path else goldsrc_cache.hash_file(source_path)
+            sources[basename] = (source_path, source_hash)
+            versions.setdefault(basename, set()).add(source_hash)
+            placeholders.append(png_path)
+
+        # names by payload, the first name of each payload gets the copy
+        names_by_hash = {}
+        for basename, (source_path, source_hash) in sources.items():
+            names_by_hash.setdefault(source_hash, []).append(basename)
+
+        def package(source_hash):
+            names = names_by_hash[source_hash]
+            first_path = os.path.join(textures_dir, names[0])
+            written = 0
+            for i, basename in enumerate(names):
+                dest = os.path.join(textures_dir, basename)
+                if os.path.exists(dest) and goldsrc_cache.hash_file(dest) == source_hash:
+                    continue
+                if i == 0:
+                    _copy_file(sources[basename][0], dest)
+                else:
+                    _link_or_copy(first_path, dest)
+                written += 1
+            return written
+
+        written = sum(pool.map(package, names_by_hash))
+
+        # Replace originals with the placeholder
+        list(pool.map(lambda png_path: _link_or_copy(placeholder_path, png_path), placeholders))
+
+    collisions = {basename: len(v) for basename, v in versions.items() if len(v) > 1}
+    for basename, count in sorted(collisions.items()):
+        print(f"Warning: {count} different textures are named {basename}, the last one is used")
+
+    print(f"Packaged {len(sources)} textures ({len(names_by_hash)} unique, {written} written, "
+          f"{len(collisions)} name collisions)")
 
 def collect_sprite_data(levelname):
     src_sprites_folder = os.path.join("output", levelname, "sprites")
@@ -140,8 +240,8 @@ def collect_skyboxes(path):
     return output
 
 def main():
-    if len(sys.argv) < 6:
-        print("Usage: python generate_level_script.py <levelname> <entities.txt filepath> <bspguy_scale> <lua_only=0|1> <override_texture_path>")
+    if len(sys.argv) < 7:
+        print("Usage: python generate_level_script.py <levelname> <entities.txt filepath> <bspguy_scale> <lua_only=0|1> <override_texture_path> <bsp filepath> [workers]")
         sys.exit(1)
 
     levelname = sys.argv[1]
@@ -150,6 +250,9 @@ def main():
     bspguy_scale = int(sys.argv[3])
     lua_only = int(sys.argv[4]) == 1
     override_texture_path = sys.argv[5]
+    bsp_path = sys.argv[6]
+    # processes for the hull solver and threads for the textures, all cores if not given
+    workers = int(sys.argv[7]) if len(sys.argv) > 7 else None
 
     # Build output path
     output_dir = os.path.join("output", levelname, "mod")
@@ -158,7 +261,15 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
 
     # Parse entities
-    entities, entities_lua = convert_entities_to_lua(entities_path, bspguy_scale)
+    cache_dir = goldsrc_cache.get_cache_dir(os.path.join("output", levelname))
+    entities, entities_lua = convert_entities_to_lua(entities_path, bspguy_scale, cache_dir)
+
+    # Map the bsp for hull extraction
+    bsp = goldsrc_bsp.open_bsp(bsp_path)
+    if bsp is None:
+        print(f"Warning: bsp not found at {bsp_path}, skipping hull extraction.")
+
+    water_hulls = extract_hulls.load_water_hulls(bsp, bspguy_scale, cache_dir, workers)
 
     # Copy goldsrc dir
     shutil.copytree(os.path.join(script_dir, "lua", "goldsrc"), os.path.join(output_dir, "goldsrc"), dirs_exist_ok=True)
@@ -197,13 +308,18 @@ def main():
         "$ENTITIES":         entities_lua,
         "$REGISTER_OBJECTS": collect_register_objects(output_dir),
         "$ENT_AABBS":        get_entity_aabbs(os.path.join("output", levelname, "aabb.lua")),
-        "$WATER_HULLS":      extract_hulls.get_water_hulls(os.path.join("output", levelname, "bsp.json"), bspguy_scale),
-        "$MODEL_HULLS":      extract_hulls.get_model_hulls(os.path.join("output", levelname, "bsp.json"), bspguy_scale),
+        "$WATER_HULLS":      extract_hulls.fmt_hulls(water_hulls),
+        "$WATER_GRID":       extract_hulls.fmt_water_grid(extract_hulls.build_water_grid(water_hulls)),
+        "$MODEL_HULLS":      extract_hulls.get_model_hulls(bsp, bspguy_scale, cache_dir, workers),
+        "$MODEL_TREES":      extract_hulls.get_model_trees(bsp, bspguy_scale, cache_dir),
         "$SKYBOXES":         collect_skyboxes(output_dir),
         "$CLASS_REQUIRES":   '\n'.join(class_requires),
         "$SPRITE_DATA":      collect_sprite_data(levelname),
     }
 
+    if bsp is not None:
+        bsp.close()
+
     # Generate lua files from templates
     for lua_file_s in template_files:
         lua_file_r, lua_file_w = lua_file_s
@@ -224,7 +340,7 @@ def main():
     # Process textures
     if not lua_only:
         missing_png_path = os.path.join(script_dir, 'missing_texture.png')
-        process_textures(output_dir, missing_png_path, override_texture_path)
+        process_textures(output_dir, missing_png_path, override_texture_path, cache_dir, workers)
 
     print(f"✅ Mod generated at: {output_dir}")
 
@@ -0,0 +1,446 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# distance within which a point counts as inside a half-space or on a plane
+PLANE_EPSILON = 0.01
+
+# below this many leaves the hulls are solved in this process, a pool costs more to start
+PARALLEL_MIN_HULLS = 64
+
+# clip hulls are the brushes expanded by the player size, their bounds are the model's plus this
+CLIP_HULL_PADDING = 64.0
+
+# plane triples intersected at a time, bounds the vertex and distance arrays
+TRIPLE_CHUNK = 16384
+
+
+def _walk_tree(headnode, children, planenums):
+    """
+    Walk a node or clipnode tree from headnode with an explicit stack. Yields
+    (child, path) for every negative child reached, path indexes into the
+    returned path arrays: plane number, side taken and the parent path entry.
+    """
+    path_plane = []
+    path_side = []
+    path_parent = []
+
+    def walk():
+        stack = [(int(headnode), -1)]
+        while stack:
+            node, path = stack.pop()
+            if node < 0:
+                yield node, path
+                continue
+            for side in (1, 0):
+                path_plane.append(int(planenums[node]))
+                path_side.append(side)
+                path_parent.append(path)
+                stack.append((int(children[node][side]), len(path_plane) - 1))
+
+    return walk(), (path_plane, path_side, path_parent)
+
+
+def _path_halfspaces(path, path_arrays, plane_rows):
+    """
+    Half-spaces along a path as (k, 4) rows nx, ny, nz, d meaning n.p >= d,
+    root first. The front child (0) keeps the plane, the back child flips it.
+    """
+    path_plane, path_side, path_parent = path_arrays
+    indices = []
+    sides = []
+    while path >= 0:
+        indices.append(path_plane[path])
+        sides.append(path_side[path])
+        path = path_parent[path]
+
+    rows = plane_rows[indices[::-1]] if indices else np.zeros((0, 4))
+    signs = np.where(np.array(sides[::-1], dtype=np.int64) == 0, 1.0, -1.0)
+    return rows * signs[:, None]
+
+
+def get_plane_rows(planes):
+    rows = np.empty((len(planes), 4), dtype=np.float64)
+    rows[:, :3] = planes['normal']
+    rows[:, 3] = planes['dist']
+    return rows
+
+
+def get_box_halfspaces(mins, maxs):
+    mins = np.asarray(mins, dtype=np.float64)
+    maxs = np.asarray(maxs, dtype=np.float64)
+    rows = np.zeros((6, 4), dtype=np.float64)
+    rows[0:3, :3] = np.eye(3)
+    rows[0:3, 3] = mins
+    rows[3:6, :3] = -np.eye(3)
+    rows[3:6, 3] = -maxs
+    return rows
+
+
+def _prune_rows(rows, box_mins, box_maxs):
+    """
+    Normalized half-space rows that can bound the region inside the box,
+    then the box rows, with a mask of which rows are box sides. Rows every
+    box corner satisfies are dropped, and of parallel rows only the
+    tightest is kept, a real plane winning a tie with a box side.
+    """
+    lengths = np.linalg.norm(rows[:, :3], axis=1)
+    rows = rows[lengths > 1e-9] / lengths[lengths > 1e-9, None]
+
+    corners = np.array(list(itertools.product(*zip(box_mins, box_maxs))), dtype=np.float64)
+    rows = rows[(corners @ rows[:, :3].T - rows[:, 3] < PLANE_EPSILON).any(axis=0)]
+
+    rows = np.vstack([rows, get_box_halfspaces(box_mins, box_maxs)])
+    is_box = np.arange(len(rows)) >= len(rows) - 6
+    normals = np.round(rows[:, :3], 4)
+    order = np.lexsort((is_box, -np.round(rows[:, 3], 2), normals[:, 2], normals[:, 1], normals[:, 0]))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (normals[order[1:]] != normals[order[:-1]]).any(axis=1)
+    keep = np.sort(order[first])
+    return rows[keep], is_box[keep]
+
+
+def _solve_region(rows, box_mins, box_maxs):
+    """
+    Vertices of the convex region of half-space rows n.p >= d inside a box.
+    After pruning, every plane triple is intersected, a chunk at a time, and
+    the corners inside all half-spaces are kept. Returns (rows, vertices)
+    with only the rows that carry a face of the region, never a box side,
+    or None if the region is empty or flat.
+    """
+    rows, is_box = _prune_rows(np.asarray(rows, dtype=np.float64).reshape(-1, 4), box_mins, box_maxs)
+
+    vertices = []
+    triples = itertools.combinations(range(len(rows)), 3)
+    while True:
+        chunk = np.array(list(itertools.islice(triples, TRIPLE_CHUNK)), dtype=np.int64).reshape(-1, 3)
+        if len(chunk) == 0:
+            break
+        a = rows[chunk, :3]
+        solvable = np.abs(np.linalg.det(a)) > 1e-9
+        points = np.linalg.solve(a[solvable], rows[chunk[solvable], 3][..., None])[..., 0]
+        inside = (points @ rows[:, :3].T - rows[:, 3] >= -PLANE_EPSILON).all(axis=1)
+        vertices.append(points[inside])
+
+    # corners where more than three planes meet are found once per triple
+    vertices = np.concatenate(vertices) if vertices else np.zeros((0, 3))
+    _, first = np.unique(np.round(vertices, 4), axis=0, return_index=True)
+    vertices = vertices[first]
+    if len(vertices) < 4 or np.any(np.ptp(vertices, axis=0) <= PLANE_EPSILON):
+        return None
+
+    # a plane is needed if the vertices on it span a face, not just an edge or a corner
+    on_plane = np.abs(vertices @ rows[:, :3].T - rows[:, 3]) <= PLANE_EPSILON
+    keep = []
+    for j in np.flatnonzero(~is_box):
+        points = vertices[on_plane[:, j]]
+        if len(points) >= 3 and np.linalg.matrix_rank(points[1:] - points[0], tol=PLANE_EPSILON) >= 2:
+            keep.append(j)
+
+    return rows[keep], vertices
+
+
+def solve_hull(halfspaces, box_mins, box_maxs):
+    """
+    Tight form of a convex region given as half-spaces n.p >= d, clipped to
+    a bounding box. Returns (planes, mins, maxs) or None if the region is
+    empty or flat. The box only limits mins and maxs, its sides are never
+    among the planes.
+    """
+    region = _solve_region(halfspaces, box_mins, box_maxs)
+    if region is None:
+        return None
+
+    rows, vertices = region
+    return rows, vertices.min(axis=0), vertices.max(axis=0)
+
+
+def _solve_job(job):
+    return solve_hull(*job)
+
+
+def solve_job_lists(job_lists, workers=None):
+    """
+    Solve several lists of (halfspaces, box_mins, box_maxs) jobs in one go,
+    across worker processes when there are many, so one pool serves all of
+    them. Returns the hulls of each list.
+    """
+    jobs = [job for job_list in job_lists for job in job_list]
+    workers = workers or os.cpu_count() or 1
+    if len(jobs) >= PARALLEL_MIN_HULLS and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_solve_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = [_solve_job(job) for job in jobs]
+
+    hull_lists = []
+    start = 0
+    for job_list in job_lists:
+        hull_lists.append([_make_hull(*result) for result in results[start:start + len(job_list)] if result is not None])
+        start += len(job_list)
+    return hull_lists
+
+
+def solve_hulls(jobs, workers=None):
+    """Solve (halfspaces, box_mins, box_maxs) jobs, across worker processes when there are many."""
+    return solve_job_lists([jobs], workers)[0]
+
+
+def _make_hull(planes, mins, maxs):
+    return {
+        'mins': mins.tolist(),
+        'maxs': maxs.tolist(),
+        # + 0.0 turns -0.0 into 0.0 for the lua output
+        'planes': [{'normal': (p[:3] + 0.0).tolist(), 'dist': float(p[3]) + 0.0} for p in planes],
+    }
+
+
+def _hull_region(hull):
+    """Region of a hull dict, its bounds are part of its shape as much as its planes."""
+    rows = np.array([(*plane['normal'], plane['dist']) for plane in hull['planes']], dtype=np.float64).reshape(-1, 4)
+    return _solve_region(rows, hull['mins'], hull['maxs'])
+
+
+def _plane_key(row):
+    return tuple(np.round(row, 3))
+
+
+def _merge_regions(a, b, split):
+    """
+    Union of two regions lying against the split plane, or None if it is
+    not convex. The candidate union is cut by every plane of either region
+    that holds all the vertices of both and by their common box, it is
+    their union only if its parts on each side of the split are inside a
+    and b.
+    """
+    points = np.vstack([a[1], b[1]])
+    rows = np.vstack([a[0], b[0]])
+    split_key = _plane_key(split)
+    flipped_key = _plane_key(-split)
+    rows = rows[[_plane_key(row) not in (split_key, flipped_key) for row in rows]]
+    rows = rows[(points @ rows[:, :3].T - rows[:, 3] >= -PLANE_EPSILON).all(axis=0)]
+    box_mins = points.min(axis=0)
+    box_maxs = points.max(axis=0)
+
+    for region, side in ((a, split), (b, -split)):
+        part = _solve_region(np.vstack([rows, side]), box_mins, box_maxs)
+        if part is None:
+            return None
+        outside = part[1] @ region[0][:, :3].T - region[0][:, 3] < -PLANE_EPSILON
+        if outside.any():
+            return None
+        # sides the region has no plane for are bounded by its box
+        if np.any(part[1] < region[1].min(axis=0) - PLANE_EPSILON) or np.any(part[1] > region[1].max(axis=0) + PLANE_EPSILON):
+            return None
+
+    return _solve_region(rows, box_mins, box_maxs)
+
+
+def merge_hulls(hulls):
+    """
+    Merge hulls that lie on either side of a shared plane while their union
+    stays convex, and drop planes that do not bound a hull. Leaves split off
+    one volume by the bsp compiler come back together this way. Only a
+    merged hull is tried again, so every hull is revisited at most once per
+    merge and there are fewer merges than hulls.
+    """
+    regions = {i: region for i, region in enumerate(r for r in (_hull_region(hull) for hull in hulls) if r is not None)}
+
+    by_plane = {}
+
+    def index(i, add):
+        for row in regions[i][0]:
+            ids = by_plane.setdefault(_plane_key(row), set())
+            if add:
+                ids.add(i)
+            else:
+                ids.discard(i)
+
+    for i in regions:
+        index(i, True)
+
+    queue = list(regions)
+    while queue:
+        i = queue.pop()
+        if i not in regions:
+            continue
+        for row in regions[i][0]:
+            union = None
+            for j in sorted(by_plane.get(_plane_key(-row), ())):
+                if j != i:
+                    union = _merge_regions(regions[i], regions[j], row)
+                    if union is not None:
+                        break
+            if union is not None:
+                index(i, False)
+                index(j, False)
+                del regions[j]
+                regions[i] = union
+                index(i, True)
+                queue.append(i)
+                break
+
+    return [_make_hull(rows, vertices.min(axis=0), vertices.max(axis=0)) for rows, vertices in regions.values()]
+
+
+def collect_node_and_leaves_jobs(nodes, leaves, planes, headnode, contents):
+    """Solver jobs of the leaves with the contents below a node, bounded by each leaf's box."""
+    if headnode < 0 or headnode >= len(nodes):
+        return []
+
+    plane_rows = get_plane_rows(planes)
+    leaves_contents = leaves['contents']
+    walk, path_arrays = _walk_tree(headnode, nodes['children'], nodes['planenum'])
+
+    jobs = []
+    for child, path in walk:
+        leaf = -child - 1
+        if leaf >= len(leaves) or leaves_contents[leaf] != contents:
+            continue
+        # leaf 0 is the shared solid leaf, its box is meaningless, use the subtree's
+        box = leaves[leaf] if leaf != 0 else nodes[headnode]
+        jobs.append((_path_halfspaces(path, path_arrays, plane_rows), box['mins'] - 1.0, box['maxs'] + 1.0))
+    return jobs
+
+
+def collect_clipnode_jobs(clipnodes, planes, model_record, contents, hull=1):
+    """Solver jobs of the regions with the contents in one of a model's clip hulls."""
+    headnode = int(model_record['headnode'][hull])
+    if headnode >= len(clipnodes):
+        return []
+
+    plane_rows = get_plane_rows(planes)
+    walk, path_arrays = _walk_tree(headnode, clipnodes['children'], clipnodes['planenum'])
+    box_mins = np.asarray(model_record['mins'], dtype=np.float64) - CLIP_HULL_PADDING
+    box_maxs = np.asarray(model_record['maxs'], dtype=np.float64) + CLIP_HULL_PADDING
+
+    jobs = []
+    for child, path in walk:
+        # clipnode children are contents values themselves
+        if child == contents:
+            jobs.append((_path_halfspaces(path, path_arrays, plane_rows), box_mins, box_maxs))
+    return jobs
+
+
+def extract_node_and_leaves_contents(nodes, leaves, planes, headnode, contents, workers=None):
+    """Hulls of the leaves with the contents below a node of the render tree."""
+    return solve_hulls(collect_node_and_leaves_jobs(nodes, leaves, planes, headnode, contents), workers)
+
+
+def extract_clipnode_contents_from_model(clipnodes, planes, model_record, contents, hull=1, workers=None):
+    """Hulls of the regions with the contents in a model's clip hull (1 is the standing player hull)."""
+    return solve_hulls(collect_clipnode_jobs(clipnodes, planes, model_record, contents, hull), workers)
+
+
+def make_box_tree(mins, maxs, contents):
+    """Node tree of an axis aligned box whose inside leaf has the contents, for the self check."""
+    import goldsrc_bsp
+
+    planes = np.zeros(6, dtype=goldsrc_bsp.plane_dtype)
+    for axis in range(3):
+        planes['normal'][axis, axis] = 1
+        planes['dist'][axis] = mins[axis]
+        planes['normal'][axis + 3, axis] = 1
+        planes['dist'][axis + 3] = maxs[axis]
+
+    # leaf 0 solid, 1 empty outside, 2 the inside
+    leaves = np.zeros(3, dtype=goldsrc_bsp.leaf_dtype)
+    leaves['contents'] = (goldsrc_bsp.CONTENTS_SOLID, goldsrc_bsp.CONTENTS_EMPTY, contents)
+    leaves['mins'][2] = np.floor(mins)
+    leaves['maxs'][2] = np.ceil(maxs)
+
+    # node i tests plane i, in front of a min plane and behind a max plane continues
+    nodes = np.zeros(6, dtype=goldsrc_bsp.node_dtype)
+    for i in range(6):
+        nodes['planenum'][i] = i
+        inner = i + 1 if i < 5 else -3
+        nodes['children'][i] = (inner, -2) if i < 3 else (-2, inner)
+    nodes['mins'][0] = np.floor(mins) - 16
+    nodes['maxs'][0] = np.ceil(maxs) + 16
+    return nodes, leaves, planes
+
+
+def check_extraction():
+    import goldsrc_bsp
+
+    mins, maxs = np.array([-32.0, 0.0, 8.0]), np.array([64.0, 16.0, 40.0])
+    nodes, leaves, planes = make_box_tree(mins, maxs, goldsrc_bsp.CONTENTS_WATER)
+
+    # a redundant plane on the path: x >= -100 before the box
+    planes = np.concatenate([planes, np.zeros(1, dtype=planes.dtype)])
+    planes['normal'][6] = (1, 0, 0)
+    planes['dist'][6] = -100
+    nodes = np.concatenate([np.zeros(1, dtype=nodes.dtype), nodes])
+    nodes['planenum'][0] = 6
+    nodes['children'][0] = (1, -2)
+    nodes['children'][1:] = np.where(nodes['children'][1:] >= 0, nodes['children'][1:] + 1, nodes['children'][1:])
+    nodes['mins'][0] = nodes['mins'][1]
+    nodes['maxs'][0] = nodes['maxs'][1]
+
+    hulls = extract_node_and_leaves_contents(nodes, leaves, planes, 0, goldsrc_bsp.CONTENTS_WATER)
+    assert len(hulls) == 1, hulls
+    hull = hulls[0]
+    assert np.allclose(hull['mins'], mins) and np.allclose(hull['maxs'], maxs), hull
+    assert len(hull['planes']) == 6, hull['planes']
+    for plane in hull['planes']:
+        n = np.array(plane['normal'])
+        # every kept plane faces into the box and touches it
+        center = (mins + maxs) / 2
+        assert n @ center - plane['dist'] > 0
+    assert not extract_node_and_leaves_contents(nodes, leaves, planes, 0, goldsrc_bsp.CONTENTS_LAVA)
+
+    # the same box in a clip hull, and many of them across worker processes
+    clipnodes = np.zeros(6, dtype=goldsrc_bsp.clipnode_dtype)
+    clipnodes['planenum'] = np.arange(6)
+    for i in range(6):
+        inner = i + 1 if i < 5 else goldsrc_bsp.CONTENTS_WATER
+        clipnodes['children'][i] = (inner, goldsrc_bsp.CONTENTS_EMPTY) if i < 3 else (goldsrc_bsp.CONTENTS_EMPTY, inner)
+    model = np.zeros(1, dtype=goldsrc_bsp.model_dtype)[0]
+    model['mins'] = mins
+    model['maxs'] = maxs
+    hulls = extract_clipnode_contents_from_model(clipnodes, planes[:6], model, goldsrc_bsp.CONTENTS_WATER)
+    assert len(hulls) == 1 and np.allclose(hulls[0]['mins'], mins) and np.allclose(hulls[0]['maxs'], maxs), hulls
+
+    # a region open at the top within its box keeps mins and maxs from the box but not its side
+    box_mins, box_maxs = mins - CLIP_HULL_PADDING, maxs + CLIP_HULL_PADDING
+    planes_rows, hull_mins, hull_maxs = solve_hull(get_box_halfspaces(mins, maxs)[:5], box_mins, box_maxs)
+    assert len(planes_rows) == 5 and np.allclose(hull_maxs[2], box_maxs[2]), planes_rows
+    assert not any(np.allclose(row, side) for row in planes_rows for side in get_box_halfspaces(box_mins, box_maxs))
+
+    # a long path of parallel and implied planes is pruned to the box's own six
+    rows = [get_box_halfspaces(mins - offset, maxs + offset) for offset in range(32)]
+    rows += [[x, y, 1.0, -1000.0] for x in range(-3, 4) for y in range(-3, 4)]
+    planes_rows, hull_mins, hull_maxs = solve_hull(np.vstack(rows), mins - 1.0, maxs + 1.0)
+    assert len(planes_rows) == 6 and np.allclose(hull_mins, mins) and np.allclose(hull_maxs, maxs), planes_rows
+
+    # the box split in two by y = 4 merges back, an L shape does not
+    halves = [
+        {'mins': [-32, 0, 8], 'maxs': [64, 4, 40]},
+        {'mins': [-32, 4, 8], 'maxs': [64, 16, 40]},
+        {'mins': [-32, 4, 8], 'maxs': [0, 16, 40]},
+    ]
+    for half in halves:
+        half['planes'] = [{'normal': row[:3].tolist(), 'dist': row[3]} for row in get_box_halfspaces(half['mins'], half['maxs'])]
+    merged = merge_hulls(halves[:2])
+    assert len(merged) == 1 and len(merged[0]['planes']) == 6, merged
+    assert np.allclose(merged[0]['mins'], mins) and np.allclose(merged[0]['maxs'], maxs), merged
+    assert len(merge_hulls([halves[0], halves[2]])) == 2
+
+    # a row of slabs comes back together as one box
+    slabs = []
+    for x in range(-32, 64, 8):
+        slab = {'mins': [x, 0, 8], 'maxs': [x + 8, 16, 40]}
+        slab['planes'] = [{'normal': row[:3].tolist(), 'dist': row[3]} for row in get_box_halfspaces(slab['mins'], slab['maxs'])]
+        slabs.append(slab)
+    merged = merge_hulls(slabs)
+    assert len(merged) == 1 and np.allclose(merged[0]['mins'], mins) and np.allclose(merged[0]['maxs'], maxs), merged
+
+    jobs = collect_clipnode_jobs(clipnodes, planes[:6], model, goldsrc_bsp.CONTENTS_WATER) * (PARALLEL_MIN_HULLS * 2)
+    assert len(solve_hulls(jobs, workers=4)) == len(jobs)
+    print("extract_clipnode_contents checks passed")
+
+
+if __name__ == "__main__":
+    check_extraction()
@@ -1,171 +1,373 @@
-import os
-import json
-from extract_clipnode_contents import extract_clipnode_contents_from_model, extract_node_and_leaves_contents, CONTENTS_WATER, CONTENTS_SOLID
+import numpy as np
+import extract_clipnode_contents
+import goldsrc_cache
+from extract_clipnode_contents import collect_clipnode_jobs, collect_node_and_leaves_jobs, get_plane_rows, merge_hulls, solve_job_lists
+from goldsrc_bsp import CONTENTS_WATER, CONTENTS_SOLID
 
 export_model_classnames = [
     "trigger_teleport"
 ]
 
+# the cached hulls and trees depend on this code as much as on the bsp
+HULL_CODE = [__file__, extract_clipnode_contents.__file__]
+
+# radius update_water_level tests mario with, in sm64 units
+WATER_RADIUS = 40
+
+# smallest grid cell, and the most cells a water grid may have before its cells grow
+WATER_GRID_MIN_CELL = 256
+WATER_GRID_MAX_CELLS = 64 * 64
+
 def fmt_num(n, precision=2):
     s = f"{n:.{precision}f}"
     s = s.rstrip('0').rstrip('.')   # remove trailing zeros and dot
     return s
 
-def fmt_vec3(v, precision=2):
-    return f"{fmt_num(v[0], precision)}, {fmt_num(v[1], precision)}, {fmt_num(v[2], precision)}"
-
-
-def fmt_plane(p):
-    return f"{{ n = {{ {fmt_vec3(p['normal'], 6)} }}, d = {fmt_num(p['dist'])} }}"
-
-def fmt_hulls(hulls, scalar, space_indent=8):
-    output = ''
-    for hull in hulls:
-        n_hull = convert_hull(hull, scalar)
-        planes_str = ", ".join(fmt_plane(p) for p in n_hull['planes'])
-        output += ( " " * space_indent + "{"
-            f" min = {{ {fmt_vec3(n_hull['mins'])} }},"
-            f" max = {{ {fmt_vec3(n_hull['maxs'])} }},"
-            f" planes = {{ {planes_str} }},"
-            " },\n"
-        )
-    return output
-
-def convert_hull(hull, scalar):
-    e_min = hull['mins']
-    e_max = hull['maxs']
-
-    n_hull = {}
-
-    n_hull['mins'] = [
-        e_min[0] * scalar,
-        e_min[2] * scalar,
-        e_max[1] * -scalar,
-    ]
-
-    n_hull['maxs'] = [
-        e_max[0] * scalar,
-        e_max[2] * scalar,
-        e_min[1] * -scalar,
-    ]
-
-    n_planes = []
-    inv_s = 1.0 / scalar
-
-    for plane in hull['planes']:
-        n = plane['normal']
-        d = plane['dist']
-
-        # Transform normal (using inverse-transpose)
-        nx = n[0] * inv_s
-        ny = n[2] * inv_s
-        nz = -n[1] * inv_s
-
-        # Renormalize
-        length = (nx*nx + ny*ny + nz*nz) ** 0.5
-        nx /= length
-        ny /= length
-        nz /= length
+def fmt_nums(values, precision=2):
+    """fmt_num over a whole array at once, returns an array of strings."""
+    s = np.char.mod(f"%.{precision}f", np.asarray(values, dtype=np.float64))
+    s = np.char.rstrip(np.char.rstrip(s, '0'), '.')
+    return np.where(s == '-0', '0', s)
+
+def fmt_plane_rows(rows):
+    """Strings of (n, 4) plane rows, normals with 6 decimals and distances with 2."""
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 4)
+    return np.column_stack([fmt_nums(rows[:, :3], 6), fmt_nums(rows[:, 3])])
+
+def fmt_hulls(n_hulls, space_indent=8):
+    """
+    One flat array per hull: min x, y, z, max x, y, z and then nx, ny, nz, d
+    for each plane, read through GoldsrcHull's accessors.
+    """
+    packed = pack_hulls(n_hulls)
+    aabbs = fmt_nums(np.hstack([packed['mins'], packed['maxs']]))
+    planes = fmt_plane_rows(packed['planes'])
+    offsets = packed['offsets']
+
+    indent = " " * space_indent
+    lines = []
+    for i in range(len(aabbs)):
+        values = np.concatenate([aabbs[i], planes[offsets[i]:offsets[i + 1]].ravel()])
+        lines.append(f"{indent}{{ {', '.join(values)} }},\n")
+    return ''.join(lines)
+
+def convert_plane_rows(rows, scalar):
+    """
+    Transform (n, 4) plane rows nx, ny, nz, d to sm64 space: the normal
+    through the inverse transpose of the swizzle and scale, renormalized,
+    and the distance by the same uniform scale.
+    """
+    normals = np.stack([rows[:, 0], rows[:, 2], -rows[:, 1]], axis=1) * (1.0 / scalar)
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.column_stack([normals, rows[:, 3] * scalar]) + 0.0
+
+def convert_aabbs(mins, maxs, scalar):
+    """Transform (n, 3) AABB mins and maxs to sm64 space, y up and z flipped."""
+    new_mins = np.column_stack([mins[:, 0], mins[:, 2], -maxs[:, 1]]) * scalar
+    new_maxs = np.column_stack([maxs[:, 0], maxs[:, 2], -mins[:, 1]]) * scalar
+    return new_mins, new_maxs
+
+def convert_packed_hulls(packed, scalar):
+    """Transform hulls packed by pack_hulls to sm64 space, keeping their layout."""
+    mins, maxs = convert_aabbs(packed['mins'], packed['maxs'], scalar)
+    return {
+        'mins': mins,
+        'maxs': maxs,
+        'planes': convert_plane_rows(packed['planes'], scalar),
+        'offsets': packed['offsets'],
+        'groups': packed['groups'],
+    }
+
+def pack_hulls(hulls, groups=None):
+    """Pack a list of hull dicts into flat arrays, optionally tagging each hull with a group (model index)."""
+    counts = [len(hull['planes']) for hull in hulls]
+    planes = [(*plane['normal'], plane['dist']) for hull in hulls for plane in hull['planes']]
+
+    return {
+        'mins': np.array([hull['mins'] for hull in hulls], dtype=np.float64).reshape(-1, 3),
+        'maxs': np.array([hull['maxs'] for hull in hulls], dtype=np.float64).reshape(-1, 3),
+        'planes': np.array(planes, dtype=np.float64).reshape(-1, 4),
+        'offsets': np.concatenate(([0], np.cumsum(counts, dtype=np.int64))),
+        'groups': np.array(groups if groups is not None else [0] * len(hulls), dtype=np.int64),
+    }
+
+def unpack_hulls(packed):
+    """Inverse of pack_hulls, returns (hulls, groups)."""
+    offsets = packed['offsets']
+    hulls = []
+    for i in range(len(offsets) - 1):
+        planes = packed['planes'][offsets[i]:offsets[i + 1]]
+        hulls.append({
+            'mins': packed['mins'][i].tolist(),
+            'maxs': packed['maxs'][i].tolist(),
+            'planes': [{'normal': p[:3].tolist(), 'dist': float(p[3])} for p in planes],
+        })
+    return hulls, packed['groups'].tolist()
+
+def load_converted_hulls(bsp, name, collect, scalar, cache_dir, workers=None):
+    """
+    Collect hulls from the bsp and convert them to sm64 space, reusing both
+    the decoded and the converted hulls from the parse cache when the bsp
+    is unchanged. collect solves with at most workers processes.
+    """
+    def build_decoded():
+        hulls, groups = collect(bsp, workers)
+        return pack_hulls(hulls, groups)
+
+    def build_converted():
+        decoded = goldsrc_cache.cached(cache_dir, name, [bsp.path], build_decoded, code=HULL_CODE)
+        return convert_packed_hulls(decoded, scalar)
+
+    converted = goldsrc_cache.cached(cache_dir, f"{name}_converted", [bsp.path], build_converted, extra=(scalar,), code=HULL_CODE)
+    return unpack_hulls(converted)
+
+def get_entities_by_model(bsp):
+    entities_by_model = {}
+    for entity in bsp.entities:
+        model = entity.get('model', '')
+        if not model.startswith('*'):
+            continue
+        try:
+            entities_by_model[int(model[1:])] = entity
+        except ValueError:
+            pass
+    return entities_by_model
+
+def get_exported_models(bsp):
+    entities_by_model = get_entities_by_model(bsp)
+    exported = []
+    for model_idx in range(1, len(bsp.models)):
+        entity = entities_by_model.get(model_idx)
+        if entity is not None and entity.get('classname') in export_model_classnames:
+            exported.append(model_idx)
+    return exported
+
+def collect_model_hulls(bsp, workers=None):
+    models = get_exported_models(bsp)
+    job_lists = [collect_node_and_leaves_jobs(bsp.nodes, bsp.leaves, bsp.planes, int(bsp.models[model_idx]['headnode'][0]), CONTENTS_SOLID)
+                 for model_idx in models]
+
+    hulls = []
+    groups = []
+    for model_idx, nl_hulls in zip(models, solve_job_lists(job_lists, workers)):
+        hulls += nl_hulls
+        groups += [model_idx] * len(nl_hulls)
+
+    return hulls, groups
+
+def count_planes(hulls):
+    return sum(len(hull['planes']) for hull in hulls)
+
+def optimize_hulls(hulls, groups, label):
+    """
+    Merge hulls whose union is convex and drop planes that never bound them,
+    reporting the counts. Hulls are only merged within their group (model),
+    a moving or toggled model must keep its own hulls.
+    """
+    by_group = {}
+    for hull, group in zip(hulls, groups):
+        by_group.setdefault(group, []).append(hull)
+
+    optimized = []
+    optimized_groups = []
+    for group, group_hulls in by_group.items():
+        merged = merge_hulls(group_hulls)
+        optimized += merged
+        optimized_groups += [group] * len(merged)
+
+    print(f"{label}: {len(hulls)} hulls with {count_planes(hulls)} planes -> {len(optimized)} hulls with {count_planes(optimized)} planes")
+    return optimized, optimized_groups
+
+def collect_water_hulls(bsp, workers=None):
+    # the hulls each source could give, a model only uses the first that has any
+    candidates = []
+
+    # node and leaf hulls from root
+    candidates.append((0, collect_node_and_leaves_jobs(bsp.nodes, bsp.leaves, bsp.planes, 0, CONTENTS_WATER)))
+
+    # model hulls, from the node tree or else the clip hull
+    for model_idx in range(1, len(bsp.models)):
+        model = bsp.models[model_idx]
+        candidates.append((model_idx, collect_node_and_leaves_jobs(bsp.nodes, bsp.leaves, bsp.planes, int(model['headnode'][0]), CONTENTS_WATER)))
+        candidates.append((model_idx, collect_clipnode_jobs(bsp.clipnodes, bsp.planes, model, CONTENTS_WATER)))
 
-        # Dist scales with the same uniform scale
-        d_new = d * scalar
+    # find entities with a skin of CONTENTS_WATER and replace their CONTENTS_SOLID
+    for model_idx, entity in get_entities_by_model(bsp).items():
+        if entity.get('skin') != str(CONTENTS_WATER):
+            continue
 
-        n_planes.append({
-            'normal': [nx, ny, nz],
-            'dist': d_new,
-        })
+        if model_idx == 0 or model_idx >= len(bsp.models):
+            continue
 
-    n_hull['planes'] = n_planes
+        model = bsp.models[model_idx]
+        candidates.append((model_idx, collect_node_and_leaves_jobs(bsp.nodes, bsp.leaves, bsp.planes, int(model['headnode'][0]), CONTENTS_SOLID)))
 
-    return n_hull
+    # every candidate is solved in one go, which are used depends on the results
+    models_with_water = set()
+    hulls = []
+    groups = []
+    for (model_idx, _), candidate_hulls in zip(candidates, solve_job_lists([jobs for _, jobs in candidates], workers)):
+        if model_idx in models_with_water or len(candidate_hulls) == 0:
+            continue
+        hulls += candidate_hulls
+        groups += [model_idx] * len(candidate_hulls)
+        models_with_water.add(model_idx)
 
+    return optimize_hulls(hulls, groups, "Water hulls")
 
-def get_model_hulls(path, bspguy_scale):
-    if not os.path.exists(path):
+def get_model_hulls(bsp, bspguy_scale, cache_dir=None, workers=None):
+    if bsp is None:
         return ''
 
     scalar = 100 / -bspguy_scale
     output = ''
 
-    # read bsp.json
-    with open(path, 'r') as f:
-        bsp_json = json.loads(f.read())
+    hulls, groups = load_converted_hulls(bsp, 'model_hulls', collect_model_hulls, scalar, cache_dir, workers)
 
-    # convert model hulls and export them
-    for model_idx, model in bsp_json['models'].items():
-        if model_idx == "0":
-            continue
+    # export hulls grouped by model
+    by_model = {}
+    for hull, model_idx in zip(hulls, groups):
+        by_model.setdefault(model_idx, []).append(hull)
 
-        if model['entity_info']['classname'] not in export_model_classnames:
-            continue
-
-        nl_hulls = extract_node_and_leaves_contents(bsp_json['nodes'], bsp_json['leaves'], model['hulls'][0]['headnode'], CONTENTS_SOLID)
-        if len(nl_hulls) > 0:
-            output += f"        [{model_idx}] = {{\n"
-            output += fmt_hulls(nl_hulls, scalar, space_indent=12)
-            output += "        },\n"
+    for model_idx, model_hulls in by_model.items():
+        output += f"        [{model_idx}] = {{\n"
+        output += fmt_hulls(model_hulls, space_indent=12)
+        output += "        },\n"
 
     return output
 
-def get_water_hulls(path, bspguy_scale):
-    if not os.path.exists(path):
-        return ''
-
-    scalar = 100 / -bspguy_scale
-    models_with_water = []
-    output = ''
-
-    # read bsp.json
-    with open(path, 'r') as f:
-        bsp_json = json.loads(f.read())
-
-    # convert node and leaf hulls from root and export them
-    root_hulls = extract_node_and_leaves_contents(bsp_json['nodes'], bsp_json['leaves'], 0, CONTENTS_WATER)
-    output += fmt_hulls(root_hulls, scalar)
-
-    # convert model hulls and export them
-    for model_idx, model in bsp_json['models'].items():
-        if model_idx == "0":
+def build_model_tree(bsp, headnode, scalar):
+    """
+    Flatten a model's node subtree for GoldsrcHull's tree queries. Nodes are
+    (plane, front, back) triples, a child above 0 is a 1 based node and any
+    other child is the contents of a leaf. Subtrees whose leaves all have
+    the same contents collapse into that leaf.
+    """
+    children = bsp.nodes['children']
+    planenums = bsp.nodes['planenum']
+    leaves_contents = bsp.leaves['contents']
+
+    nodes = []
+    used_planes = {}
+    encoded = {}
+
+    # post-order with an explicit stack, so children are encoded before their node
+    stack = [(headnode, False)]
+    while stack:
+        node, ready = stack.pop()
+        if not ready:
+            stack.append((node, True))
+            stack += [(int(child), False) for child in children[node] if child >= 0]
             continue
 
-        if model_idx in models_with_water:
+        front, back = (encoded[int(child)] if child >= 0 else int(leaves_contents[-child - 1]) for child in children[node])
+        if front == back and front <= 0:
+            encoded[node] = front
             continue
 
-        nl_hulls = extract_node_and_leaves_contents(bsp_json['nodes'], bsp_json['leaves'], model['hulls'][0]['headnode'], CONTENTS_WATER)
-        if len(nl_hulls) > 0:
-            output += fmt_hulls(nl_hulls, scalar)
-            models_with_water.append(model_idx)
-
-        if model_idx in models_with_water:
-            continue
+        plane = used_planes.setdefault(int(planenums[node]), len(used_planes) + 1)
+        nodes.append((plane, front, back))
+        encoded[node] = len(nodes)
+
+    rows = get_plane_rows(bsp.planes[list(used_planes)]) if used_planes else np.zeros((0, 4))
+    return {
+        'root': encoded[headnode],
+        'planes': convert_plane_rows(rows, scalar),
+        'nodes': np.array(nodes, dtype=np.int64).reshape(-1, 3),
+    }
+
+def has_solid_leaf(tree):
+    return tree['root'] == CONTENTS_SOLID or bool(np.any(tree['nodes'][:, 1:] == CONTENTS_SOLID))
+
+def collect_model_trees(bsp, scalar):
+    trees = {}
+    for model_idx in get_exported_models(bsp):
+        tree = build_model_tree(bsp, int(bsp.models[model_idx]['headnode'][0]), scalar)
+        # without a solid leaf the tree never matches, the entity falls back to its hulls or AABB
+        if has_solid_leaf(tree):
+            trees[model_idx] = tree
+    return trees
+
+def get_model_trees(bsp, bspguy_scale, cache_dir=None):
+    if bsp is None:
+        return ''
 
-        hulls = extract_clipnode_contents_from_model(model, CONTENTS_WATER)
-        if len(hulls) > 0:
-            output += fmt_hulls(hulls, scalar)
-            models_with_water.append(model_idx)
+    scalar = 100 / -bspguy_scale
+    trees = goldsrc_cache.cached(cache_dir, 'model_trees', [bsp.path], lambda: collect_model_trees(bsp, scalar), extra=(scalar,), code=HULL_CODE)
 
-    # find entities with a skin of CONTENTS_WATER and replace their CONTENTS_SOLID
-    for entity_idx, entity in bsp_json['entities'].items():
-        if 'keyvalues' not in entity:
-            continue
-        if 'skin' not in entity['keyvalues']:
-            continue
-        if 'model' not in entity['keyvalues']:
-            continue
-        if not entity['keyvalues']['model'].startswith('*'):
-            continue
-        if entity['keyvalues']['skin'] != str(CONTENTS_WATER):
-            continue
+    output = ''
+    for model_idx, tree in trees.items():
+        planes = ", ".join(fmt_plane_rows(tree['planes']).ravel())
+        nodes = ", ".join(str(v) for v in tree['nodes'].ravel())
+        output += f"        [{model_idx}] = {{\n"
+        output += f"            root = {tree['root']},\n"
+        output += f"            planes = {{ {planes} }},\n"
+        output += f"            nodes = {{ {nodes} }},\n"
+        output += "        },\n"
 
-        model_idx = entity['keyvalues']['model'].lstrip('*')
-        if model_idx in models_with_water or model_idx == '0':
-            continue
+    return output
 
-        model = bsp_json['models'][model_idx]
+def load_water_hulls(bsp, bspguy_scale, cache_dir=None, workers=None):
+    if bsp is None:
+        return []
 
-        nl_hulls = extract_node_and_leaves_contents(bsp_json['nodes'], bsp_json['leaves'], model['hulls'][0]['headnode'], CONTENTS_SOLID)
-        if len(nl_hulls) > 0:
-            output += fmt_hulls(nl_hulls, scalar)
-            models_with_water.append(model_idx)
+    scalar = 100 / -bspguy_scale
 
+    hulls, _ = load_converted_hulls(bsp, 'water_hulls', collect_water_hulls, scalar, cache_dir, workers)
+    return hulls
+
+def get_water_hulls(bsp, bspguy_scale, cache_dir=None, workers=None):
+    return fmt_hulls(load_water_hulls(bsp, bspguy_scale, cache_dir, workers))
+
+def build_water_grid(hulls, radius=WATER_RADIUS):
+    """
+    Uniform grid over the XZ extent of the hulls' AABBs grown by the radius.
+    Each cell lists the (1 based) hulls that mario can touch from inside it,
+    so update_water_level only tests those.
+    """
+    if not hulls:
+        return None
+
+    mins = np.array([hull['mins'] for hull in hulls], dtype=np.float64)[:, [0, 2]] - radius
+    maxs = np.array([hull['maxs'] for hull in hulls], dtype=np.float64)[:, [0, 2]] + radius
+    # whole numbers, so the lua side computes the same cells
+    origin = np.floor(mins.min(axis=0))
+    extent = maxs.max(axis=0) - origin
+
+    # about one hull across per cell, fewer cells on very spread out maps
+    cell = max(WATER_GRID_MIN_CELL, float(np.ceil(np.median((maxs - mins).max(axis=1)))))
+    while np.prod(np.ceil(extent / cell)) > WATER_GRID_MAX_CELLS:
+        cell *= 2
+    counts = np.maximum(np.ceil(extent / cell).astype(np.int64), 1)
+
+    first = np.clip(((mins - origin) // cell).astype(np.int64), 0, counts - 1)
+    last = np.clip(((maxs - origin) // cell).astype(np.int64), 0, counts - 1)
+
+    cells = {}
+    for i in range(len(hulls)):
+        for ix in range(first[i, 0], last[i, 0] + 1):
+            for iz in range(first[i, 1], last[i, 1] + 1):
+                cells.setdefault(int(iz * counts[0] + ix + 1), []).append(i + 1)
+
+    return {
+        'cell': cell,
+        'x': float(origin[0]),
+        'z': float(origin[1]),
+        'nx': int(counts[0]),
+        'nz': int(counts[1]),
+        'cells': cells,
+    }
+
+def fmt_water_grid(grid, space_indent=4):
+    if grid is None:
+        return 'nil'
+
+    indent = " " * space_indent
+    output = "{\n"
+    output += f"{indent}    cell = {fmt_num(grid['cell'])}, x = {fmt_num(grid['x'])}, z = {fmt_num(grid['z'])}, nx = {grid['nx']}, nz = {grid['nz']},\n"
+    output += f"{indent}    cells = {{\n"
+    for key in sorted(grid['cells']):
+        output += f"{indent}        [{key}] = {{ {', '.join(str(i) for i in grid['cells'][key])} }},\n"
+    output += f"{indent}    }},\n"
+    output += f"{indent}}}"
     return output
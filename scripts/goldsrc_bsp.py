@@ -0,0 +1,218 @@
+import os
+import mmap
+import struct
+from functools import cached_property
+
+import numpy as np
+
+from goldsrc_parse_ents import iter_entities
+
+BSP_VERSION = 30
+
+# lump indices
+LUMP_ENTITIES     = 0
+LUMP_PLANES       = 1
+LUMP_TEXTURES     = 2
+LUMP_VERTICES     = 3
+LUMP_VISIBILITY   = 4
+LUMP_NODES        = 5
+LUMP_TEXINFO      = 6
+LUMP_FACES        = 7
+LUMP_LIGHTING     = 8
+LUMP_CLIPNODES    = 9
+LUMP_LEAVES       = 10
+LUMP_MARKSURFACES = 11
+LUMP_EDGES        = 12
+LUMP_SURFEDGES    = 13
+LUMP_MODELS       = 14
+HEADER_LUMPS      = 15
+
+# leaf / clipnode contents
+CONTENTS_EMPTY       = -1
+CONTENTS_SOLID       = -2
+CONTENTS_WATER       = -3
+CONTENTS_SLIME       = -4
+CONTENTS_LAVA        = -5
+CONTENTS_SKY         = -6
+CONTENTS_ORIGIN      = -7
+CONTENTS_CLIP        = -8
+CONTENTS_TRANSLUCENT = -15
+
+MAX_MAP_HULLS = 4
+
+# on-disk record layouts (little endian)
+plane_dtype = np.dtype([
+    ('normal', '<f4', 3),
+    ('dist', '<f4'),
+    ('type', '<i4'),
+])
+
+node_dtype = np.dtype([
+    ('planenum', '<u4'),
+    ('children', '<i2', 2),
+    ('mins', '<i2', 3),
+    ('maxs', '<i2', 3),
+    ('firstface', '<u2'),
+    ('numfaces', '<u2'),
+])
+
+clipnode_dtype = np.dtype([
+    ('planenum', '<i4'),
+    ('children', '<i2', 2),
+])
+
+leaf_dtype = np.dtype([
+    ('contents', '<i4'),
+    ('visofs', '<i4'),
+    ('mins', '<i2', 3),
+    ('maxs', '<i2', 3),
+    ('firstmarksurface', '<u2'),
+    ('nummarksurfaces', '<u2'),
+    ('ambient_level', 'u1', 4),
+])
+
+model_dtype = np.dtype([
+    ('mins', '<f4', 3),
+    ('maxs', '<f4', 3),
+    ('origin', '<f4', 3),
+    ('headnode', '<i4', MAX_MAP_HULLS),
+    ('visleafs', '<i4'),
+    ('firstface', '<i4'),
+    ('numfaces', '<i4'),
+])
+
+texinfo_dtype = np.dtype([
+    ('vecs', '<f4', (2, 4)),
+    ('miptex', '<i4'),
+    ('flags', '<i4'),
+])
+
+face_dtype = np.dtype([
+    ('planenum', '<u2'),
+    ('side', '<u2'),
+    ('firstedge', '<i4'),
+    ('numedges', '<u2'),
+    ('texinfo', '<u2'),
+    ('styles', 'u1', 4),
+    ('lightofs', '<i4'),
+])
+
+vertex_dtype = np.dtype(('<f4', 3))
+edge_dtype = np.dtype(('<u2', 2))
+
+
+class BspFile:
+    """
+    Memory-mapped GoldSrc (v30) BSP reader. Lumps are exposed as read-only
+    NumPy structured arrays that view the mapped file and are only decoded
+    the first time they are accessed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        header = struct.unpack_from(f'<i{HEADER_LUMPS * 2}i', self._mm, 0)
+        self.version = header[0]
+        if self.version != BSP_VERSION:
+            self.close()
+            raise ValueError(f"{path}: unsupported BSP version {self.version} (expected {BSP_VERSION})")
+
+        self.lumps = [(header[1 + i * 2], header[2 + i * 2]) for i in range(HEADER_LUMPS)]
+
+    def close(self):
+        # drop cached views so the mapping can be released
+        for name in ('planes', 'nodes', 'clipnodes', 'leaves', 'models', 'texinfo', 'faces', 'vertices', 'edges', 'surfedges', 'marksurfaces'):
+            self.__dict__.pop(name, None)
+        try:
+            self._mm.close()
+        except BufferError:
+            # a caller still holds an array view, let the GC release it
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lump(self, index):
+        """Return the raw bytes of a lump as a memoryview into the mapping."""
+        offset, length = self.lumps[index]
+        return memoryview(self._mm)[offset:offset + length]
+
+    def _array(self, index, dtype):
+        offset, length = self.lumps[index]
+        count = length // dtype.itemsize
+        return np.frombuffer(self._mm, dtype=dtype, count=count, offset=offset)
+
+    @cached_property
+    def planes(self):
+        return self._array(LUMP_PLANES, plane_dtype)
+
+    @cached_property
+    def nodes(self):
+        return self._array(LUMP_NODES, node_dtype)
+
+    @cached_property
+    def clipnodes(self):
+        return self._array(LUMP_CLIPNODES, clipnode_dtype)
+
+    @cached_property
+    def leaves(self):
+        return self._array(LUMP_LEAVES, leaf_dtype)
+
+    @cached_property
+    def models(self):
+        return self._array(LUMP_MODELS, model_dtype)
+
+    @cached_property
+    def texinfo(self):
+        return self._array(LUMP_TEXINFO, texinfo_dtype)
+
+    @cached_property
+    def faces(self):
+        return self._array(LUMP_FACES, face_dtype)
+
+    @cached_property
+    def vertices(self):
+        return self._array(LUMP_VERTICES, vertex_dtype)
+
+    @cached_property
+    def edges(self):
+        return self._array(LUMP_EDGES, edge_dtype)
+
+    @cached_property
+    def surfedges(self):
+        return self._array(LUMP_SURFEDGES, np.dtype('<i4'))
+
+    @cached_property
+    def marksurfaces(self):
+        return self._array(LUMP_MARKSURFACES, np.dtype('<u2'))
+
+    def iter_entities(self):
+        """Stream the entity lump straight out of the mapping."""
+        return iter_entities(self.lump(LUMP_ENTITIES), f"{self.path}:entities")
+
+    @cached_property
+    def entities(self):
+        return list(self.iter_entities())
+
+    def worldspawn(self):
+        if 'entities' in self.__dict__:
+            entities = self.entities
+            return entities[0] if entities else {}
+        return next(self.iter_entities(), {})
+
+
+def open_bsp(path):
+    """Open a BSP if it exists, returning None otherwise."""
+    if not path or not os.path.exists(path):
+        return None
+    return BspFile(path)
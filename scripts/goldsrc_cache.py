@@ -0,0 +1,174 @@
+import os
+import hashlib
+import pickle
+import threading
+
+import numpy as np
+
+# Bump when the layout of anything stored in the cache changes
+CACHE_VERSION = 3
+
+CACHE_DIRNAME = '.cache'
+RECORD_SUFFIX = '.entry'
+
+# path -> (size, mtime_ns, digest), so each source is hashed once per process
+_file_hashes = {}
+
+
+def get_cache_dir(level_dir):
+    return os.path.join(level_dir, CACHE_DIRNAME)
+
+
+def hash_file(path):
+    """Content hash of a file, memoized on its size and mtime."""
+    st = os.stat(path)
+    known = _file_hashes.get(path)
+    if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+        return known[2]
+
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    _file_hashes[path] = (st.st_size, st.st_mtime_ns, digest)
+    return digest
+
+
+def make_key(name, sources, extra=()):
+    """Key of a cache entry: its name, the content of its source files and any extra parameters."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(repr((CACHE_VERSION, name, tuple(extra))).encode('utf-8'))
+    for path in sources:
+        h.update(hash_file(path).encode('ascii') if os.path.exists(path) else b'-')
+    return h.hexdigest()
+
+
+def get_code_version(paths):
+    """Key of the code files that produce a cache entry, so editing them invalidates it."""
+    return make_key('code', paths)
+
+
+def _get_record_path(cache_dir, name):
+    return os.path.join(cache_dir, f"{name}{RECORD_SUFFIX}")
+
+
+def _replace_atomic(path, write):
+    """Write a file through a temporary one, so readers see the old or the new file, never half of one."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_record(cache_dir, name):
+    try:
+        with open(_get_record_path(cache_dir, name), 'rb') as f:
+            record = pickle.load(f)
+        if record.get('version') == CACHE_VERSION:
+            return record
+    except Exception:
+        pass
+    return None
+
+
+def _is_array_dict(value):
+    return isinstance(value, dict) and len(value) > 0 and all(isinstance(v, np.ndarray) for v in value.values())
+
+
+def load(cache_dir, name, key):
+    """Return the cached value of an entry, or None if it is missing or stale."""
+    if not cache_dir:
+        return None
+
+    record = _read_record(cache_dir, name)
+    if not record or record['key'] != key:
+        return None
+
+    path = os.path.join(cache_dir, record['file'])
+    try:
+        if record['file'].endswith('.npz'):
+            with np.load(path, allow_pickle=False) as data:
+                return {k: data[k] for k in data.files}
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        # replaced by another process storing a newer value
+        return None
+    except Exception as ex:
+        print(f"Warning: could not read cache entry {name}: {ex}")
+        return None
+
+
+def _remove_stale_files(cache_dir, name, current):
+    for filename in os.listdir(cache_dir):
+        stem, ext = os.path.splitext(filename)
+        if ext in ('.npz', '.pickle') and filename != current and stem.rsplit('-', 1)[0] == name:
+            try:
+                os.remove(os.path.join(cache_dir, filename))
+            except OSError:
+                # still open in another process
+                pass
+
+
+def store(cache_dir, name, key, value):
+    """
+    Store a value: dicts of arrays go to a .npz, anything else is pickled.
+    Every entry has its own record file and its data file is named after
+    its key, so processes sharing a cache dir never overwrite each other's
+    entries or read a file that is still being written.
+    """
+    if not cache_dir:
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    if _is_array_dict(value):
+        filename = f"{name}-{key[:16]}.npz"
+        _replace_atomic(os.path.join(cache_dir, filename), lambda f: np.savez(f, **value))
+    else:
+        filename = f"{name}-{key[:16]}.pickle"
+        _replace_atomic(os.path.join(cache_dir, filename), lambda f: pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+    record = {'version': CACHE_VERSION, 'key': key, 'file': filename}
+    _replace_atomic(_get_record_path(cache_dir, name), lambda f: pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL))
+    _remove_stale_files(cache_dir, name, filename)
+
+
+def remove(cache_dir, name):
+    """Forget an entry, e.g. while the outputs it describes are being rewritten."""
+    if not cache_dir:
+        return
+
+    try:
+        os.remove(_get_record_path(cache_dir, name))
+    except FileNotFoundError:
+        pass
+
+
+def cached(cache_dir, name, sources, build, extra=(), code=()):
+    """
+    Return the cached value of `name` if it was built from the same source
+    file contents, extra parameters and code files, otherwise build and
+    store it.
+    """
+    if not cache_dir:
+        return build()
+
+    if code:
+        extra = tuple(extra) + (get_code_version(code),)
+    key = make_key(name, sources, extra)
+    value = load(cache_dir, name, key)
+    if value is not None:
+        print(f"Using cached {name}")
+        return value
+
+    value = build()
+    store(cache_dir, name, key, value)
+    return value
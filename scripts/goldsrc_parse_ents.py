@@ -1,31 +1,189 @@
+import codecs
 import re
+import goldsrc_cache
 from goldsrc_parse_entities import *
 
+# After any whitespace: a whole well formed entity, a // comment, or the
+# first character of anything else, which goes through the token parser
+ENTITY_RE = re.compile(r'\s*(?:\{((?:\s*"[^"]*"\s*"[^"]*")*)\s*\}|//[^\n]*|(\S))')
+
+# After any whitespace: a // comment, a brace or quoted string, or an unexpected character
+ENTITY_TOKEN_RE = re.compile(r'\s*(?://[^\n]*|([{}]|"[^"]*")|(\S))')
+
+ENTITY_PAIR_RE = re.compile(r'"([^"]*)"\s*"([^"]*)"')
+
+ENTITY_CHUNK_SIZE = 64 * 1024
+
+class EntityParseError(ValueError):
+    def __init__(self, message, source, line, column):
+        super().__init__(f"{source}:{line}:{column}: {message}")
+        self.line = line
+        self.column = column
+
+def iter_entity_chunks(source):
+    """Text of an entity lump in bounded chunks, UTF-8 sequences split between reads are kept whole."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(ENTITY_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk if isinstance(chunk, str) else decoder.decode(chunk)
+    else:
+        # bytes, memoryview or mmap
+        view = memoryview(source)
+        for i in range(0, len(view), ENTITY_CHUNK_SIZE):
+            yield decoder.decode(bytes(view[i:i + ENTITY_CHUNK_SIZE]))
+    yield decoder.decode(b'', final=True)
+
+def make_entity(block):
+    """Entity dict of the key/value pairs between an entity's braces, pairs with an empty key are dropped."""
+    entity = dict(ENTITY_PAIR_RE.findall(block))
+    entity.pop('', None)
+    return entity
+
+def parse_entity_tokens(buffer, pos, eof, error):
+    """
+    Parse one entity token by token from pos, for what the whole entity
+    pattern does not take: comments inside an entity or malformed input.
+    Returns (entity, end), or None if the buffer ends first and more is to
+    come. error(message, pos) raises an EntityParseError.
+    """
+    entity = None
+    key = None
+
+    while True:
+        match = ENTITY_TOKEN_RE.match(buffer, pos)
+        if match is None or match.group(2) == '\0':
+            # only whitespace left, or the bsp lump's NUL terminator
+            if not eof and match is None:
+                return None
+            error("unterminated entity", len(buffer) if match is None else match.start(2))
+
+        token, other = match.group(1), match.group(2)
+        if other is not None:
+            if other == '"':
+                if not eof:
+                    return None
+                error("unterminated string", match.start(2))
+            if other == '/' and match.end() == len(buffer) and not eof:
+                # the start of a comment split between chunks
+                return None
+            error(f"unexpected character {other!r}", match.start(2))
+
+        if token is None:
+            # a comment, it may continue in the next chunk
+            if match.end() == len(buffer) and not eof:
+                return None
+        elif token == '{':
+            if entity is not None:
+                error("'{' inside an entity", match.start(1))
+            entity = {}
+        elif token == '}':
+            if entity is None:
+                error("'}' outside an entity", match.start(1))
+            if key is not None:
+                error(f"key \"{key}\" has no value", match.start(1))
+            return entity, match.end()
+        else:
+            if entity is None:
+                error("string outside an entity", match.start(1))
+            text = token[1:-1]
+            if key is None:
+                key = text
+            else:
+                if key:
+                    entity[key] = text
+                key = None
+        pos = match.end()
+
+def iter_entities(source, source_name='<entities>'):
+    """
+    Incrementally parse a GoldSrc-style entity lump from a binary file object,
+    bytes or mmap, yielding one dict per entity. Well formed entities are
+    matched whole, line and column are only worked out for an error.
+    """
+    chunks = iter_entity_chunks(source)
+    buffer = ''
+    # line and column of buffer[0]
+    line = 1
+    column = 1
+    eof = False
+
+    def error(message, pos):
+        newline = buffer.rfind('\n', 0, pos)
+        error_line = line + buffer.count('\n', 0, pos)
+        error_column = pos - newline if newline >= 0 else column + pos
+        raise EntityParseError(message, source_name, error_line, error_column)
+
+    while not eof:
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+        else:
+            buffer += chunk
+
+        pos = 0
+        rescan = True
+        while rescan:
+            rescan = False
+            for match in ENTITY_RE.finditer(buffer, pos):
+                block, other = match.group(1), match.group(2)
+                if block is not None:
+                    yield make_entity(block)
+                elif other is None:
+                    # a comment, it may continue in the next chunk
+                    if match.end() == len(buffer) and not eof:
+                        break
+                elif other == '\0':
+                    # the bsp entity lump is NUL terminated
+                    return
+                else:
+                    parsed = parse_entity_tokens(buffer, match.start(2), eof, error)
+                    if parsed is None:
+                        break
+                    entity, pos = parsed
+                    yield entity
+                    rescan = True
+                    break
+                pos = match.end()
+
+        # the unfinished tail is carried into the next chunk
+        newlines = buffer.count('\n', 0, pos)
+        if newlines:
+            line += newlines
+            column = pos - buffer.rfind('\n', 0, pos)
+        else:
+            column += pos
+        buffer = buffer[pos:]
+
 def parse_entities_file(filepath):
-    """Parse a GoldSrc-style entity lump file into a list of dicts, with simple logging."""
+    """Parse a GoldSrc-style entity lump file, yielding one dict per entity, with simple logging."""
     print(f"Parsing entity file: {filepath}")
 
     try:
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            text = f.read()
+        f = open(filepath, 'rb')
     except Exception as e:
         print(f"❌ Failed to read file: {e}")
-        return []
+        return
 
-    # Split the text into entity blocks {...}
-    blocks = re.findall(r'\{([^}]*)\}', text, re.DOTALL)
-    print(f"Found {len(blocks)} entity blocks")
+    count = 0
+    with f:
+        for entity in iter_entities(f, filepath):
+            count += 1
+            yield entity
 
-    entities = []
-    for _, block in enumerate(blocks, 1):
-        entity = {}
-        # Find all key-value pairs like "key" "value"
-        pairs = re.findall(r'"([^"]+)"\s+"([^"]*)"', block)
-        for key, value in pairs:
-            entity[key] = value
-        entities.append(entity)
+    print(f"Found {count} entity blocks")
 
-    return entities
+def load_entities_file(filepath, cache_dir=None):
+    """
+    Return the raw entity dicts of an entity file as a list, reusing the
+    parse cache when the file is unchanged. Without a cache dir this streams
+    straight from parse_entities_file.
+    """
+    if not cache_dir:
+        return parse_entities_file(filepath)
+    return goldsrc_cache.cached(cache_dir, 'entities', [filepath], lambda: list(parse_entities_file(filepath)), code=[__file__])
 
 def interpret_entities(entities, bspguy_scalar, to_sm64_coords):
     iscalar = 1 / -bspguy_scalar
@@ -64,7 +222,9 @@ def dump_entities_to_lua(entities):
         lines.append("        },")
     return "\n".join(lines)
 
-def convert_entities_to_lua(entities_filepath, bspguy_scalar):
-    entities = parse_entities_file(entities_filepath)
-    interpret_entities(entities, bspguy_scalar, 1)
+def convert_entities_to_lua(entities_filepath, bspguy_scalar, cache_dir=None):
+    entities = []
+    for entity in load_entities_file(entities_filepath, cache_dir):
+        interpret_entities((entity,), bspguy_scalar, 1)
+        entities.append(entity)
     return entities, dump_entities_to_lua(entities)
@@ -0,0 +1,381 @@
+import argparse
+import contextlib
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import goldsrc_wad
+import image_stage
+from task_graph import TaskGraph
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+tools_dir = os.path.join(repo_dir, "tools")
+
+# Default location of each external tool. Override one with --tool NAME=PATH
+# or the GOLDSRC_<NAME> environment variable, e.g. to use a local stand-in
+# that takes the same command line.
+if sys.platform == 'win32':
+    DEFAULT_TOOLS = {
+        'bspguy': os.path.join(tools_dir, "bspguy", "bspguy.exe"),
+        'blender': os.path.join(tools_dir, "blender-3.6.23-windows-x64", "blender.exe"),
+    }
+else:
+    DEFAULT_TOOLS = {
+        'bspguy': "bspguy",
+        'blender': "blender",
+    }
+
+BSPGUY_INI_PATH = os.path.join(tools_dir, "bspguy", "bspguy.ini")
+BLEND_EXPORT_PATH = os.path.join(script_dir, "blender", "blend-export.blend")
+BLEND_SKYBOX_PATH = os.path.join(script_dir, "blender", "skybox.blend")
+OVERRIDE_ENTITIES_PATH = os.path.join(repo_dir, "override-entities")
+OVERRIDE_TEXTURES_PATH = os.path.join(repo_dir, "override-textures")
+
+# files and folders `bspguy exportobj` writes, cleared before exporting again
+BSPGUY_OBJ_OUTPUTS = ("atlases", "mdl_models", "sprites", "skyboxes")
+
+# bspguy exports here first, its textures are dropped since wad-textures writes them
+BSPGUY_SCRATCH_DIRNAME = ".bspguy-export"
+
+BATCH_SUMMARY_PATH = os.path.join(repo_dir, "output", "batch-summary.txt")
+
+# fast64 display list triangle commands
+TRIANGLE_RE = re.compile(rb'gsSP(1Triangle|2Triangles)\(')
+
+
+class ToolError(Exception):
+    pass
+
+
+def parse_tools(tool_args):
+    tools = {}
+    for name, default in DEFAULT_TOOLS.items():
+        tools[name] = os.environ.get(f"GOLDSRC_{name.upper()}", default)
+    for tool_arg in tool_args:
+        name, sep, path = tool_arg.partition('=')
+        if not sep or name not in DEFAULT_TOOLS:
+            raise SystemExit(f"Error: --tool expects NAME=PATH with NAME one of: {', '.join(DEFAULT_TOOLS)}")
+        tools[name] = path
+    return tools
+
+
+def get_tool_command(path):
+    # a stand-in can be a Python script
+    if path.lower().endswith('.py'):
+        return [sys.executable, path]
+    return [path]
+
+
+def check_tool(name, path):
+    if not (os.path.isfile(path) or shutil.which(path)):
+        raise SystemExit(f"Error: {name} not found: {path}")
+
+
+def get_scale(kz):
+    return -15 if kz else -25
+
+
+def get_level_name(bsp_path):
+    return os.path.splitext(os.path.basename(bsp_path))[0]
+
+
+def get_out_dir(level_name):
+    # create-lua.py resolves output/<level> against the repo root
+    return os.path.join(repo_dir, "output", level_name)
+
+
+def run_logged(name, command, log_dir, cwd=repo_dir):
+    """Run a command with its output in <log_dir>/<name>.log, raise ToolError if it fails."""
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{name}.log")
+    with open(log_path, 'w', encoding='utf-8', errors='replace') as log_file:
+        result = subprocess.run([str(arg) for arg in command], stdout=log_file, stderr=subprocess.STDOUT, cwd=cwd)
+    if result.returncode != 0:
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f.readlines()[-20:]:
+                print(f"    [{name}] {line.rstrip()}")
+        raise ToolError(f"exit code {result.returncode}, log: {log_path}")
+
+
+def clear_obj_outputs(out_dir):
+    for filename in os.listdir(out_dir):
+        if filename.lower().endswith(('.obj', '.mtl')):
+            os.remove(os.path.join(out_dir, filename))
+    for folder in BSPGUY_OBJ_OUTPUTS:
+        shutil.rmtree(os.path.join(out_dir, folder), ignore_errors=True)
+
+
+def collect_obj_outputs(scratch_dir, out_dir):
+    """Move bspguy's export into the level folder, leaving textures/ to the WAD decoder."""
+    for name in os.listdir(scratch_dir):
+        if name.lower() == "textures":
+            continue
+        dst = os.path.join(out_dir, name)
+        if os.path.isdir(dst):
+            shutil.rmtree(dst)
+        os.replace(os.path.join(scratch_dir, name), dst)
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def set_hl_dir(ini_path):
+    # interactive when the stored dir is invalid, so it runs before the graph
+    result = subprocess.run([sys.executable, os.path.join(script_dir, "prompt-for-hl-dir.py"), ini_path])
+    if result.returncode != 0:
+        raise SystemExit("❌ Failed to set Half-Life directory. Exiting.")
+
+
+def build_graph(bsp_path, options, tools, workers):
+    """
+    The conversion of one BSP as a task graph:
+
+        export-ent ─────────────────────┐
+        export-obj ── image-stage ──────┼── blender ── create-lua ── copy-mod
+        wad-textures ───────────────────┘
+
+    With --lua-only only create-lua and copy-mod are in it.
+    """
+    level_name = get_level_name(bsp_path)
+    out_dir = get_out_dir(level_name)
+    log_dir = os.path.join(out_dir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    scale = get_scale(options.kz)
+    bspguy = get_tool_command(tools['bspguy'])
+    blender = get_tool_command(tools['blender'])
+
+    graph = TaskGraph(expected_errors=(ToolError, subprocess.CalledProcessError))
+    lua_deps = ()
+    if not options.lua_only:
+        def export_obj():
+            # exported aside so it never writes textures/ while wad-textures does
+            clear_obj_outputs(out_dir)
+            scratch_dir = os.path.join(out_dir, BSPGUY_SCRATCH_DIRNAME)
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            os.makedirs(scratch_dir)
+            run_logged("export-obj", bspguy + ["exportobj", bsp_path, "-scale", scale, "-lightmap", "1", "-withmdl", "0", "-o", scratch_dir], log_dir)
+            collect_obj_outputs(scratch_dir, out_dir)
+
+        def export_ent():
+            run_logged("export-ent", bspguy + ["exportent", bsp_path, "-o", os.path.join(out_dir, "entities.txt")], log_dir)
+
+        def wad_textures():
+            hl_dir = goldsrc_wad.load_hl_dir(options.bspguy_ini)
+            goldsrc_wad.extract_textures(bsp_path, os.path.join(out_dir, "textures"), hl_dir, goldsrc_wad.get_texture_cache_dir())
+
+        def run_image_stage():
+            if not image_stage.run_image_stage(out_dir, workers):
+                raise ToolError("some images failed to process")
+
+        def run_blender():
+            run_logged("blender", blender + [
+                "--background", "--python-exit-code", "1",
+                "--python", os.path.join(script_dir, "blender", "goldsrc_pipeline.py"), "--",
+                out_dir, level_name, BLEND_EXPORT_PATH, BLEND_SKYBOX_PATH, scale,
+                OVERRIDE_ENTITIES_PATH, bsp_path, "--export-workers", workers,
+            ], log_dir)
+
+        graph.add("export-obj", export_obj)
+        graph.add("export-ent", export_ent)
+        graph.add("wad-textures", wad_textures)
+        graph.add("image-stage", run_image_stage, ["export-obj"])
+        graph.add("blender", run_blender, ["export-obj", "export-ent", "wad-textures", "image-stage"])
+        lua_deps = ["blender"]
+
+    def create_lua():
+        run_logged("create-lua", [sys.executable, os.path.join(script_dir, "create-lua.py"),
+                                  level_name, os.path.join(out_dir, "entities.txt"), scale,
+                                  1 if options.lua_only else 0, OVERRIDE_TEXTURES_PATH, bsp_path, workers], log_dir)
+
+    graph.add("create-lua", create_lua, lua_deps)
+
+    if options.output_mod:
+        def copy_mod():
+            print(f"Copying mod to {options.output_mod}")
+            shutil.copytree(os.path.join(out_dir, "mod"), options.output_mod, dirs_exist_ok=True)
+
+        graph.add("copy-mod", copy_mod, ["create-lua"])
+
+    return graph
+
+
+def count_triangles(mod_dir):
+    """Triangles in the fast64 display lists of a mod, None if it was not generated."""
+    if not os.path.isdir(mod_dir):
+        return None
+    total = 0
+    for root, _, files in os.walk(mod_dir):
+        for filename in files:
+            if not filename.endswith('.c'):
+                continue
+            with open(os.path.join(root, filename), 'rb') as f:
+                for match in TRIANGLE_RE.finditer(f.read()):
+                    total += 1 if match.group(1) == b'1Triangle' else 2
+    return total
+
+
+def find_bsps(paths):
+    """Expand the BSP arguments, a directory stands for the .bsp files in it."""
+    bsp_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            bsp_paths += [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.lower().endswith('.bsp')]
+        else:
+            bsp_paths.append(path)
+    return [os.path.abspath(path) for path in bsp_paths]
+
+
+def convert_map(bsp_path, options, tools, workers):
+    """
+    Convert one map of a batch in a pool process. Its output goes to
+    output/<level>/logs/driver.log, and a failure is returned instead of raised.
+    """
+    level_name = get_level_name(bsp_path)
+    out_dir = get_out_dir(level_name)
+    log_dir = os.path.join(out_dir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    # every map gets its own folder under --output-mod
+    options = argparse.Namespace(**vars(options))
+    if options.output_mod:
+        options.output_mod = os.path.join(options.output_mod, level_name)
+
+    result = {'map': level_name, 'ok': False, 'duration': None, 'triangles': None, 'failed': ''}
+    started = time.time()
+    with open(os.path.join(log_dir, "driver.log"), 'w', encoding='utf-8', errors='replace') as log_file:
+        with contextlib.redirect_stdout(log_file):
+            try:
+                graph = build_graph(bsp_path, options, tools, workers)
+                result['ok'] = graph.run(workers)
+                graph.print_summary()
+                result['failed'] = ', '.join(name for name, task in graph.tasks.items() if task.status == 'failed')
+            except Exception as ex:
+                result['failed'] = f"{type(ex).__name__}: {ex}"
+    result['duration'] = time.time() - started
+    result['triangles'] = count_triangles(os.path.join(out_dir, "mod"))
+    return result
+
+
+def format_summary(results):
+    rows = [("Map", "Status", "Time", "Triangles", "Failed")]
+    for r in results:
+        rows.append((
+            r['map'],
+            "ok" if r['ok'] else "FAILED",
+            f"{r['duration']:.1f}s" if r['duration'] is not None else "-",
+            str(r['triangles']) if r['triangles'] is not None else "-",
+            r['failed'],
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)) + "  " + row[-1] for row in rows]
+    failed = sum(1 for r in results if not r['ok'])
+    lines.append(f"{len(results) - failed} of {len(results)} maps converted, {failed} failed")
+    return '\n'.join(line.rstrip() for line in lines) + '\n'
+
+
+def run_batch(bsp_paths, options, tools):
+    """
+    Convert many maps on a pool of processes. A failing map does not stop the
+    others, and a summary table is written to output/batch-summary.txt.
+    """
+    cpu_count = os.cpu_count() or 1
+    jobs = min(options.jobs or max(1, cpu_count // 4), len(bsp_paths))
+    workers = options.workers or max(1, cpu_count // jobs)
+    print(f"Converting {len(bsp_paths)} maps, {jobs} at a time with {workers} workers each")
+
+    if not options.lua_only:
+        # WAD textures are shared between maps, decode each one once up front
+        hl_dir = goldsrc_wad.load_hl_dir(options.bspguy_ini)
+        count = goldsrc_wad.warm_texture_cache(bsp_paths, hl_dir, goldsrc_wad.get_texture_cache_dir(), cpu_count)
+        print(f"Decoded {count} shared WAD textures")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(convert_map, bsp_path, options, tools, workers): bsp_path for bsp_path in bsp_paths}
+        for future in as_completed(futures):
+            bsp_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as ex:
+                result = {'map': get_level_name(bsp_path), 'ok': False, 'duration': None, 'triangles': None,
+                          'failed': f"{type(ex).__name__}: {ex}"}
+            results[bsp_path] = result
+            if result['ok']:
+                print(f"✅ {result['map']} converted in {result['duration']:.1f}s")
+            else:
+                print(f"❌ {result['map']} failed: {result['failed']}, log: {os.path.join(get_out_dir(result['map']), 'logs', 'driver.log')}")
+
+    summary = format_summary([results[bsp_path] for bsp_path in bsp_paths])
+    os.makedirs(os.path.dirname(options.summary), exist_ok=True)
+    with open(options.summary, 'w', encoding='utf-8') as f:
+        f.write(summary)
+    print(summary, end="")
+    print(f"Summary written to {options.summary}")
+    return all(result['ok'] for result in results.values())
+
+
+def add_conversion_args(parser):
+    parser.add_argument("--kz", action="store_true", help="use the kz scale (-15 instead of -25)")
+    parser.add_argument("--lua-only", action="store_true", help="only regenerate the Lua files of an earlier conversion")
+    parser.add_argument("--output-mod", metavar="PATH", help="copy the generated mod folder to PATH")
+    parser.add_argument("--tool", action="append", default=[], metavar="NAME=PATH",
+                        help=f"use PATH for an external tool ({', '.join(DEFAULT_TOOLS)})")
+    parser.add_argument("--bspguy-ini", default=BSPGUY_INI_PATH, help="bspguy.ini holding the Half-Life directory")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Convert GoldSrc BSPs into sm64coopdx mods. More than one BSP, or a directory of them, runs a batch.",
+        fromfile_prefix_chars='@',
+    )
+    parser.add_argument("bsp_paths", nargs='+', metavar="BSP", help="a BSP file or a directory of them, @FILE reads a list")
+    parser.add_argument("--workers", type=int,
+                        help="tasks run at once per map, also used for the image stage and export workers "
+                             "(default: CPU count, divided by --jobs in a batch)")
+    parser.add_argument("--jobs", type=int, help="maps converted at once in a batch (default: a quarter of the CPU count)")
+    parser.add_argument("--summary", default=BATCH_SUMMARY_PATH, help="where a batch writes its summary table")
+    add_conversion_args(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    bsp_paths = find_bsps(options.bsp_paths)
+    for bsp_path in bsp_paths:
+        if not os.path.isfile(bsp_path):
+            raise SystemExit(f"Error: BSP file not found: {bsp_path}")
+    if not bsp_paths:
+        raise SystemExit("Error: no BSP files found")
+
+    level_names = [get_level_name(bsp_path) for bsp_path in bsp_paths]
+    duplicates = sorted({name for name in level_names if level_names.count(name) > 1})
+    if duplicates:
+        raise SystemExit(f"Error: maps share an output folder: {', '.join(duplicates)}")
+
+    tools = parse_tools(options.tool)
+    if not options.lua_only:
+        for name, path in tools.items():
+            check_tool(name, path)
+
+    set_hl_dir(options.bspguy_ini)
+
+    batch = len(bsp_paths) > 1 or any(os.path.isdir(path) for path in options.bsp_paths)
+    if batch:
+        ok = run_batch(bsp_paths, options, tools)
+    else:
+        bsp_path = bsp_paths[0]
+        print(f"Using BSP file: {bsp_path}")
+
+        workers = options.workers or os.cpu_count() or 1
+        graph = build_graph(bsp_path, options, tools, workers)
+        ok = graph.run(workers)
+        graph.print_summary()
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
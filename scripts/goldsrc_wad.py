@@ -0,0 +1,298 @@
+import os
+import shutil
+import sys
+import mmap
+import struct
+import hashlib
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import goldsrc_bsp
+import image_io
+
+WAD3_MAGIC = b'WAD3'
+WAD_TYPE_MIPTEX = 0x43
+
+# miptex header: name[16], width, height, offsets[4]
+MIPTEX_HEADER = struct.Struct('<16s6I')
+WAD_HEADER = struct.Struct('<4sii')
+WAD_ENTRY = struct.Struct('<iiibbh16s')
+
+# Directories next to a mod dir that the engine also loads WADs from
+mod_dir_suffixes = ['', '_addon', '_hd', '_downloads']
+
+# Base games searched after the map's own mod dir
+default_game_dirs = ['valve', 'cstrike']
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# (wad path, mtime, texture name) -> decoded RGBA, shared by every map converted in this process
+_decoded_textures = {}
+
+
+def _clean_name(raw):
+    return raw.split(b'\0', 1)[0].decode('ascii', errors='ignore')
+
+
+def decode_miptex(data, offset=0):
+    """
+    Expand the first mip of a miptex into an (h, w, 4) RGBA array using the
+    texture's own 256 colour palette. Palette index 255 of '{' textures is
+    the transparent colour.
+    """
+    raw_name, width, height, mip0, _, _, mip3 = MIPTEX_HEADER.unpack_from(data, offset)
+    name = _clean_name(raw_name)
+    if mip0 == 0:
+        raise ValueError(f"miptex {name} has no embedded pixels")
+
+    indices = np.frombuffer(data, dtype=np.uint8, count=width * height, offset=offset + mip0).reshape(height, width)
+
+    # the palette follows the smallest mip
+    palette_offset = offset + mip3 + (width // 8) * (height // 8)
+    palette_size = struct.unpack_from('<H', data, palette_offset)[0]
+    palette = np.frombuffer(data, dtype=np.uint8, count=palette_size * 3, offset=palette_offset + 2).reshape(-1, 3)
+
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[:len(palette), :3] = palette[:256]
+    lut[:, 3] = 255
+    if name.startswith('{'):
+        lut[255] = (0, 0, 0, 0)
+
+    return lut[indices]
+
+
+class WadFile:
+    """A WAD3 archive, its directory is read once and lumps are decoded on request."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, num_lumps, dir_offset = WAD_HEADER.unpack_from(self.data, 0)
+        if magic != WAD3_MAGIC:
+            raise ValueError(f"{path}: not a WAD3 file")
+
+        self.entries = {}
+        for i in range(num_lumps):
+            filepos, disksize, size, kind, compression, _, raw_name = WAD_ENTRY.unpack_from(self.data, dir_offset + i * WAD_ENTRY.size)
+            if kind != WAD_TYPE_MIPTEX or compression != 0:
+                continue
+            self.entries[_clean_name(raw_name).lower()] = filepos
+
+    def __contains__(self, name):
+        return name.lower() in self.entries
+
+    def decode(self, name):
+        key = (self.path, self.mtime, name.lower())
+        pixels = _decoded_textures.get(key)
+        if pixels is None:
+            pixels = decode_miptex(self.data, self.entries[name.lower()])
+            _decoded_textures[key] = pixels
+        return pixels
+
+
+def get_search_dirs(hl_dir, bsp_path=None):
+    """Directories to look for WADs in: the map's mod dir first, then the base games."""
+    game_dirs = []
+
+    # <hl_dir>/<mod>/maps/<map>.bsp
+    if bsp_path:
+        maps_dir = os.path.dirname(os.path.abspath(bsp_path))
+        game_dirs.append(os.path.dirname(maps_dir))
+        game_dirs.append(maps_dir)
+
+    if hl_dir:
+        game_dirs += [os.path.join(hl_dir, d) for d in default_game_dirs]
+
+    search_dirs = []
+    for game_dir in game_dirs:
+        for suffix in mod_dir_suffixes:
+            d = game_dir.rstrip('\\/') + suffix
+            if os.path.isdir(d) and d not in search_dirs:
+                search_dirs.append(d)
+    return search_dirs
+
+
+def find_wad_paths(wad_value, search_dirs):
+    """
+    Resolve the worldspawn 'wad' key against the search dirs. WADs not listed
+    in the key are appended afterwards as a fallback.
+    """
+    paths = []
+    for entry in wad_value.replace('\\', '/').split(';'):
+        basename = os.path.basename(entry.strip())
+        if not basename:
+            continue
+        for d in search_dirs:
+            path = os.path.join(d, basename)
+            if os.path.isfile(path):
+                paths.append(path)
+                break
+        else:
+            print(f"Warning: WAD not found: {basename}")
+
+    for d in search_dirs:
+        for filename in sorted(os.listdir(d)):
+            path = os.path.join(d, filename)
+            if filename.lower().endswith('.wad') and path not in paths:
+                paths.append(path)
+
+    return paths
+
+
+def get_bsp_textures(bsp):
+    """Yield (name, data, offset) for every miptex in the bsp, offset is None if the pixels live in a WAD."""
+    data = bsp.lump(goldsrc_bsp.LUMP_TEXTURES)
+    if len(data) < 4:
+        return
+    count = struct.unpack_from('<i', data, 0)[0]
+    offsets = struct.unpack_from(f'<{count}i', data, 4)
+    for offset in offsets:
+        if offset < 0:
+            continue
+        raw_name, _, _, mip0, _, _, _ = MIPTEX_HEADER.unpack_from(data, offset)
+        yield _clean_name(raw_name), data, (offset if mip0 != 0 else None)
+
+
+def get_texture_cache_dir():
+    return os.path.join(script_dir, '..', 'output', '.texture-cache')
+
+
+def get_texture_key(wad, name):
+    return (wad.path, wad.mtime, name.lower())
+
+
+def _get_tmp_path(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _write_png_atomic(path, pixels):
+    """Write a PNG through a temporary file, so a reader never sees half of it."""
+    tmp_path = _get_tmp_path(path)
+    image_io.write_png(tmp_path, pixels)
+    os.replace(tmp_path, path)
+
+
+def _cache_png(cache_dir, key_parts, decode):
+    """Path of the cached PNG for a texture, decoded and encoded only if it is not there yet."""
+    key = hashlib.blake2b(repr(key_parts).encode('utf-8'), digest_size=16).hexdigest()
+    cached_path = os.path.join(cache_dir, f"{key}.png")
+    if not os.path.exists(cached_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_png_atomic(cached_path, decode())
+    return cached_path
+
+
+def _write_cached_png(cache_dir, key_parts, decode, dest_path):
+    """Decode and encode a texture once and reuse the PNG on later runs."""
+    if not cache_dir:
+        _write_png_atomic(dest_path, decode())
+        return
+
+    cached_path = _cache_png(cache_dir, key_parts, decode)
+    tmp_path = _get_tmp_path(dest_path)
+    shutil.copyfile(cached_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+
+
+def find_texture_wad(name, wad_paths, wads):
+    """The first of the WADs that has the texture, opened WADs are kept in `wads`."""
+    for wad_path in wad_paths:
+        wad = wads.get(wad_path)
+        if wad is None:
+            wad = wads[wad_path] = WadFile(wad_path)
+        if name in wad:
+            return wad
+    return None
+
+
+def extract_textures(bsp_path, textures_dir, hl_dir, cache_dir=None):
+    """Write every texture used by the bsp to textures_dir as <name>.png."""
+    os.makedirs(textures_dir, exist_ok=True)
+    wads = {}
+    missing = []
+
+    with goldsrc_bsp.BspFile(bsp_path) as bsp:
+        search_dirs = get_search_dirs(hl_dir, bsp_path)
+        wad_paths = find_wad_paths(bsp.worldspawn().get('wad', ''), search_dirs)
+
+        for name, data, offset in get_bsp_textures(bsp):
+            dest_path = os.path.join(textures_dir, f"{name}.png")
+
+            # embedded in the bsp
+            if offset is not None:
+                _write_png_atomic(dest_path, decode_miptex(data, offset))
+                continue
+
+            wad = find_texture_wad(name, wad_paths, wads)
+            if wad is not None:
+                _write_cached_png(cache_dir, get_texture_key(wad, name), lambda: wad.decode(name), dest_path)
+            else:
+                missing.append(name)
+
+    for name in missing:
+        print(f"Warning: texture not found in any WAD: {name}")
+
+    return missing
+
+
+def warm_texture_cache(bsp_paths, hl_dir, cache_dir, workers=None):
+    """
+    Decode every WAD texture used by a set of maps into the texture cache,
+    each one once, so converting the maps side by side only copies cached
+    PNGs instead of decoding shared textures in every process.
+    """
+    wads = {}
+    textures = {}
+    for bsp_path in bsp_paths:
+        try:
+            with goldsrc_bsp.BspFile(bsp_path) as bsp:
+                wad_paths = find_wad_paths(bsp.worldspawn().get('wad', ''), get_search_dirs(hl_dir, bsp_path))
+                for name, _, offset in get_bsp_textures(bsp):
+                    if offset is not None:
+                        continue
+                    wad = find_texture_wad(name, wad_paths, wads)
+                    if wad is not None:
+                        textures.setdefault(get_texture_key(wad, name), (wad, name))
+        except Exception as ex:
+            print(f"Warning: could not read textures of {bsp_path}: {ex}")
+
+    def cache_texture(item):
+        key_parts, (wad, name) = item
+        # decoded directly, the pixels are not needed again in this process
+        _cache_png(cache_dir, key_parts, lambda: decode_miptex(wad.data, wad.entries[name.lower()]))
+
+    # zlib and NumPy release the GIL, so threads are enough
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(cache_texture, textures.items()))
+    return len(textures)
+
+
+def load_hl_dir(ini_path):
+    """Read the Half-Life dir that prompt-for-hl-dir.py stored in bspguy.ini."""
+    spec = importlib.util.spec_from_file_location('prompt_for_hl_dir', os.path.join(script_dir, 'prompt-for-hl-dir.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.get_hl_dir_from_ini_configparser(ini_path)
+
+
+def main():
+    if len(sys.argv) < 4:
+        print("Usage: python goldsrc_wad.py <bsp filepath> <textures dir> <path_to_bspguy.ini>")
+        sys.exit(1)
+
+    bsp_path = sys.argv[1]
+    textures_dir = sys.argv[2]
+    hl_dir = load_hl_dir(sys.argv[3])
+
+    extract_textures(bsp_path, textures_dir, hl_dir, get_texture_cache_dir())
+    print(f"✅ Textures extracted to: {textures_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG color types
+PNG_GRAY       = 0
+PNG_RGB        = 2
+PNG_PALETTE    = 3
+PNG_GRAY_ALPHA = 4
+PNG_RGBA       = 6
+
+
+def _png_chunk(kind, data):
+    chunk = kind + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff)
+
+
+def encode_png(pixels, compress_level=6):
+    """Encode an (h, w), (h, w, 3) or (h, w, 4) uint8 array as PNG bytes."""
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+
+    height, width, channels = pixels.shape
+    color_type = {1: PNG_GRAY, 2: PNG_GRAY_ALPHA, 3: PNG_RGB, 4: PNG_RGBA}[channels]
+
+    # every scanline uses filter type 0 (none)
+    raw = np.zeros((height, 1 + width * channels), dtype=np.uint8)
+    raw[:, 1:] = pixels.reshape(height, width * channels)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return (
+        PNG_SIGNATURE +
+        _png_chunk(b'IHDR', header) +
+        _png_chunk(b'IDAT', zlib.compress(raw.tobytes(), compress_level)) +
+        _png_chunk(b'IEND', b'')
+    )
+
+
+def write_png(path, pixels, compress_level=6):
+    with open(path, 'wb') as f:
+        f.write(encode_png(pixels, compress_level))
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa = np.abs(p - a)
+    pb = np.abs(p - b)
+    pc = np.abs(p - c)
+    return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+
+def _unfilter_rows(filters, data):
+    """Undo None/Sub/Up filters one scanline at a time."""
+    height, width, bpp = data.shape
+    out = np.empty((height, width, bpp), dtype=np.uint8)
+    prev = np.zeros((width, bpp), dtype=np.uint8)
+    for y in range(height):
+        line = data[y]
+        if filters[y] == 1:
+            line = np.cumsum(line, axis=0, dtype=np.uint8)
+        elif filters[y] == 2:
+            line = line + prev
+        out[y] = line
+        prev = out[y]
+    return out
+
+
+def _unfilter_wavefront(filters, data):
+    """
+    Undo any mix of PNG filters. A pixel depends on its left, upper and
+    upper-left neighbours, so every anti-diagonal can be reconstructed in
+    one vectorized step.
+    """
+    height, width, bpp = data.shape
+    out = np.zeros((height + 1, width + 1, bpp), dtype=np.int16)
+    raw = data.astype(np.int16)
+    filters = filters.astype(np.int16)
+
+    for k in range(height + width - 1):
+        ys = np.arange(max(0, k - width + 1), min(height - 1, k) + 1)
+        xs = k - ys
+        a = out[ys + 1, xs]
+        b = out[ys, xs + 1]
+        c = out[ys, xs]
+        f = filters[ys][:, None]
+
+        pred = np.where(f == 1, a,
+               np.where(f == 2, b,
+               np.where(f == 3, (a + b) >> 1,
+               np.where(f == 4, _paeth(a, b, c), 0))))
+        out[ys + 1, xs + 1] = (raw[ys, xs] + pred) & 0xff
+
+    return out[1:, 1:].astype(np.uint8)
+
+
+def decode_png(data):
+    """Decode 8-bit, non-interlaced PNG bytes into an (h, w, channels) uint8 array."""
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("not a PNG file")
+
+    pos = 8
+    idat = []
+    palette = None
+    transparency = None
+    while pos < len(data):
+        length, kind = struct.unpack_from('>I4s', data, pos)
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+        if kind == b'IHDR':
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', chunk)
+        elif kind == b'PLTE':
+            palette = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, 3)
+        elif kind == b'tRNS':
+            transparency = np.frombuffer(chunk, dtype=np.uint8)
+        elif kind == b'IDAT':
+            idat.append(chunk)
+        elif kind == b'IEND':
+            break
+
+    if interlace != 0 or bit_depth > 8 or (bit_depth < 8 and color_type not in (PNG_GRAY, PNG_PALETTE)):
+        raise ValueError(f"unsupported PNG (bit depth {bit_depth}, interlace {interlace})")
+
+    bpp = {PNG_GRAY: 1, PNG_RGB: 3, PNG_PALETTE: 1, PNG_GRAY_ALPHA: 2, PNG_RGBA: 4}[color_type]
+    stride = (width * bpp * bit_depth + 7) // 8
+    raw = np.frombuffer(zlib.decompress(b''.join(idat)), dtype=np.uint8)[:height * (1 + stride)].reshape(height, 1 + stride)
+    filters = raw[:, 0]
+
+    if bit_depth == 8:
+        scanlines = raw[:, 1:].reshape(height, width, bpp)
+    else:
+        # filters operate on whole bytes for packed samples
+        scanlines = raw[:, 1:, None]
+
+    if np.any(filters > 2):
+        pixels = _unfilter_wavefront(filters, scanlines)
+    else:
+        pixels = _unfilter_rows(filters, scanlines)
+
+    if bit_depth < 8:
+        bits = np.unpackbits(pixels[:, :, 0], axis=1)[:, :width * bit_depth].reshape(height, width, bit_depth)
+        weights = (1 << np.arange(bit_depth - 1, -1, -1)).astype(np.uint8)
+        pixels = (bits * weights).sum(axis=2, dtype=np.uint8)[:, :, None]
+        if color_type == PNG_GRAY:
+            pixels = pixels * (255 // ((1 << bit_depth) - 1))
+
+    if color_type == PNG_PALETTE:
+        lut = np.zeros((256, 4), dtype=np.uint8)
+        lut[:len(palette), :3] = palette
+        lut[:, 3] = 255
+        if transparency is not None:
+            lut[:len(transparency), 3] = transparency
+            return lut[pixels[:, :, 0]]
+        return lut[pixels[:, :, 0], :3]
+
+    return pixels
+
+
+def read_png(path):
+    with open(path, 'rb') as f:
+        return decode_png(f.read())
+
+
+def decode_tga(data):
+    """Decode an uncompressed or RLE true-colour, grayscale or colour-mapped TGA into RGB(A)."""
+    id_length, cmap_type, image_type, cmap_first, cmap_length, cmap_depth, _, _, width, height, depth, descriptor = \
+        struct.unpack_from('<BBBHHBHHHHBB', data, 0)
+
+    pos = 18 + id_length
+    colormap = None
+    if cmap_type == 1:
+        entry_bytes = (cmap_depth + 7) // 8
+        colormap = np.frombuffer(data, dtype=np.uint8, count=cmap_length * entry_bytes, offset=pos).reshape(cmap_length, entry_bytes)
+        pos += cmap_length * entry_bytes
+
+    base_type = image_type & ~8
+    if base_type not in (1, 2, 3):
+        raise ValueError(f"unsupported TGA image type {image_type}")
+
+    pixel_bytes = (depth + 7) // 8
+    count = width * height
+
+    if image_type & 8:
+        # run-length encoded packets
+        out = bytearray(count * pixel_bytes)
+        o = 0
+        end = len(out)
+        while o < end:
+            header = data[pos]
+            pos += 1
+            n = (header & 0x7f) + 1
+            if header & 0x80:
+                out[o:o + n * pixel_bytes] = data[pos:pos + pixel_bytes] * n
+                pos += pixel_bytes
+            else:
+                out[o:o + n * pixel_bytes] = data[pos:pos + n * pixel_bytes]
+                pos += n * pixel_bytes
+            o += n * pixel_bytes
+        pixels = np.frombuffer(bytes(out[:end]), dtype=np.uint8)
+    else:
+        pixels = np.frombuffer(data, dtype=np.uint8, count=count * pixel_bytes, offset=pos)
+
+    pixels = pixels.reshape(height, width, pixel_bytes)
+
+    if base_type == 1:
+        indices = pixels[:, :, 0].astype(np.int64) if pixel_bytes == 1 else pixels.view('<u2')[:, :, 0].astype(np.int64)
+        pixels = colormap[indices - cmap_first]
+
+    if pixels.shape[2] == 1:
+        pixels = pixels[:, :, 0]
+    elif pixels.shape[2] == 2:
+        raise ValueError("16-bit TGA is not supported")
+    else:
+        # BGR(A) -> RGB(A)
+        pixels = pixels[:, :, [2, 1, 0, 3][:pixels.shape[2]]]
+
+    # origin is bottom-left unless bit 5 is set, bit 4 mirrors horizontally
+    if not descriptor & 0x20:
+        pixels = pixels[::-1]
+    if descriptor & 0x10:
+        pixels = pixels[:, ::-1]
+
+    return np.ascontiguousarray(pixels)
+
+
+def read_tga(path):
+    with open(path, 'rb') as f:
+        return decode_tga(f.read())
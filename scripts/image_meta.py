@@ -0,0 +1,108 @@
+import os
+import pickle
+
+import numpy as np
+
+import goldsrc_cache
+
+META_FILENAME = 'image-meta.pickle'
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# file content hash -> meta dict, loaded from disk on first use
+_meta = None
+
+# entries computed since the last flush, written to disk together
+_pending = {}
+
+
+def get_meta_path():
+    # shared by every level like the decoded texture cache, entries are keyed by content
+    return os.path.join(script_dir, '..', 'output', '.texture-cache', META_FILENAME)
+
+
+def compute_image_meta(pixels):
+    """
+    Facts about an (h, w, channels) image that later stages ask for.
+    Accepts uint8 pixels or Blender's 0..1 floats.
+    """
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+    if pixels.dtype != np.uint8:
+        pixels = np.floor(np.clip(pixels, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+    height, width, channels = pixels.shape
+    has_alpha = channels in (2, 4) and bool(np.any(pixels[:, :, -1] < 255))
+
+    if channels >= 3:
+        rgb = pixels[:, :, :3]
+        grayscale = bool(np.all(rgb[:, :, 0] == rgb[:, :, 1]) and np.all(rgb[:, :, 1] == rgb[:, :, 2]))
+    else:
+        grayscale = True
+
+    # pack each pixel into one integer so np.unique works on whole colours
+    packed = np.zeros((height, width), dtype=np.uint32)
+    for c in range(channels):
+        packed |= pixels[:, :, c].astype(np.uint32) << (8 * c)
+
+    return {
+        'width': width,
+        'height': height,
+        'channels': channels,
+        'has_alpha': has_alpha,
+        'grayscale': grayscale,
+        'unique_colors': int(len(np.unique(packed))),
+    }
+
+
+def _read_meta():
+    try:
+        with open(get_meta_path(), 'rb') as f:
+            meta = pickle.load(f)
+        if meta.get('version') == goldsrc_cache.CACHE_VERSION:
+            return meta['images']
+    except Exception:
+        pass
+    return {}
+
+
+def _write_meta(images):
+    path = get_meta_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # merge with entries other processes wrote since we loaded
+    merged = _read_meta()
+    merged.update(images)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': goldsrc_cache.CACHE_VERSION, 'images': merged}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def get_image_meta(filepath, read_pixels):
+    """
+    Return the meta dict of an image file, scanning pixels through
+    read_pixels() only the first time a given file content is seen. New
+    entries are kept in memory until flush().
+    """
+    global _meta
+    if _meta is None:
+        _meta = _read_meta()
+
+    key = goldsrc_cache.hash_file(filepath) if filepath and os.path.isfile(filepath) else None
+    if key and key in _meta:
+        return _meta[key]
+
+    meta = compute_image_meta(read_pixels())
+    if key:
+        _meta[key] = meta
+        _pending[key] = meta
+    return meta
+
+
+def flush():
+    """Write the entries computed since the last flush, once per stage rather than once per image."""
+    if _pending:
+        _write_meta(_pending)
+        _pending.clear()
@@ -0,0 +1,132 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import image_io
+
+# Atlas adjustment, equivalent to
+#   magick IN -level 0%,100%,1.3 -function polynomial 1.0,0.1 OUT
+ATLAS_GAMMA = 1.3
+ATLAS_POLYNOMIAL = (1.0, 0.1)
+
+
+def get_atlas_lut():
+    """
+    Lookup table for the atlas adjustment. ImageMagick computes in floating
+    point and rounds once when writing 8-bit output, which is what the table
+    does per input level.
+    """
+    v = np.arange(256, dtype=np.float64) / 255.0
+    v = v ** (1.0 / ATLAS_GAMMA)
+    v = ATLAS_POLYNOMIAL[0] * v + ATLAS_POLYNOMIAL[1]
+    return np.floor(np.clip(v, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+ATLAS_LUT = get_atlas_lut()
+
+
+def adjust_atlas(pixels):
+    """Apply the atlas adjustment to the color channels, alpha is left untouched."""
+    out = pixels.copy()
+    if out.ndim == 2:
+        return ATLAS_LUT[out]
+    color_channels = 1 if out.shape[2] <= 2 else 3
+    out[:, :, :color_channels] = ATLAS_LUT[out[:, :, :color_channels]]
+    return out
+
+
+def make_additive(pixels):
+    """
+    RGBA copy whose alpha is the mean of the color channels, equivalent to
+      magick IN -alpha set -channel A -fx "(r+g+b)/3" OUT
+    """
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+    if pixels.shape[2] <= 2:
+        rgb = np.repeat(pixels[:, :, :1], 3, axis=2)
+    else:
+        rgb = pixels[:, :, :3]
+
+    total = rgb.astype(np.uint16).sum(axis=2)
+    out = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+    out[:, :, :3] = rgb
+    # round half up, like ImageMagick's quantization
+    out[:, :, 3] = (total * 2 + 3) // 6
+    return out
+
+
+def get_additive_path(path):
+    return path.replace('.png', '_additive.png')
+
+
+def process_atlas(path):
+    image_io.write_png(path, adjust_atlas(image_io.read_png(path)))
+    return path
+
+
+def write_additive(path):
+    additive_path = get_additive_path(path)
+    image_io.write_png(additive_path, make_additive(image_io.read_png(path)))
+    return additive_path
+
+
+def convert_tga(path):
+    png_path = path[:-4] + '.png'
+    if not os.path.exists(png_path):
+        image_io.write_png(png_path, image_io.read_tga(path))
+    return png_path
+
+
+def list_files(folder, extension, exclude_suffix=None):
+    if not os.path.isdir(folder):
+        return []
+    paths = []
+    for filename in sorted(os.listdir(folder)):
+        if not filename.lower().endswith(extension):
+            continue
+        if exclude_suffix and filename.lower().endswith(exclude_suffix):
+            continue
+        paths.append(os.path.join(folder, filename))
+    return paths
+
+
+def run_image_stage(out_dir, workers=None):
+    """
+    Run every image transform for a level in one process, spread over a thread pool.
+    Additive variants are not made here, set_fast64_stuff writes them on demand.
+    """
+    jobs = []
+    jobs += [(process_atlas, p) for p in list_files(os.path.join(out_dir, 'atlases'), '.png')]
+    jobs += [(convert_tga, p) for p in list_files(os.path.join(out_dir, 'skyboxes'), '.tga')]
+
+    failed = 0
+    # zlib and NumPy release the GIL, so threads are enough
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [(path, pool.submit(fn, path)) for fn, path in jobs]
+        for path, future in futures:
+            try:
+                future.result()
+            except Exception as ex:
+                failed += 1
+                print(f"❌ Failed to process image {path}: {ex}")
+
+    print(f"Processed {len(jobs) - failed} images")
+    return failed == 0
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python image_stage.py <output level dir> [workers]")
+        sys.exit(1)
+
+    out_dir = sys.argv[1]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    if not run_image_stage(out_dir, workers):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
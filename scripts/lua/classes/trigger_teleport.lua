@@ -61,9 +61,13 @@ function TriggerTeleport:update()
 
     -- Check if player is in the teleport area and cooldown is reset
     if goldsrc_intersects_aabb(m.pos, 10, self.ent._aabb) and (sTeleporteeCooldowns[m] or 0) <= 0 then
+        local tree = self.ent._tree
         local hulls = self.ent._hulls
         local hull_check = false
-        if hulls then
+        if tree then
+            -- a few plane tests down the model's bsp tree, only emitted when it has a solid leaf
+            hull_check = GoldsrcHull.tree_within_radius(m.pos.x, m.pos.y, m.pos.z, tree, 10)
+        elseif hulls then
             for _, hull in ipairs(hulls) do
                 hull_check = GoldsrcHull.within_radius(m.pos.x, m.pos.y, m.pos.z, hull, 10)
                 if hull_check then
@@ -71,7 +75,7 @@ function TriggerTeleport:update()
                 end
             end
         end
-        if hulls == nil or hull_check then
+        if (tree == nil and hulls == nil) or hull_check then
             self:teleport_entity(m)
             sTeleporteeCooldowns[m] = 1
         end
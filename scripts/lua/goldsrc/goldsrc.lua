@@ -70,6 +70,7 @@ function goldsrc_after_level_defined(level_dict)
     level_dict.targetnameToEnt = {}
     for _, ent in ipairs(level_dict.entities) do
         ent._hulls = goldsrc_get_hulls(level_dict, ent)
+        ent._tree = goldsrc_get_model_tree(level_dict, ent)
 
         if ent.targetname ~= nil then
             should_link = true
@@ -125,6 +126,18 @@ function goldsrc_get_hulls(level_data, ent)
     return hull
 end
 
+function goldsrc_get_model_tree(level_data, ent)
+    if not level_data or not level_data.model_trees then
+        return nil
+    end
+
+    if not ent.model or ent.model:sub(1,1) ~= '*' then
+        return nil
+    end
+
+    return level_data.model_trees[tonumber(ent.model:sub(2))]
+end
+
 function goldsrc_get_entities()
     local levelnum = gNetworkPlayers[0].currLevelNum
     return gGoldsrc.levels[levelnum].entities
@@ -381,18 +394,21 @@ local function update_water_level(m)
     local level_data = gGoldsrc.levels[gNetworkPlayers[0].currLevelNum]
     if not level_data then return end
 
-    local water_hulls = gGoldsrc.levels[gNetworkPlayers[0].currLevelNum].water_hulls
+    local water_hulls = level_data.water_hulls
     local water_level = gLevelValues.floorLowerLimit
 
-    for i = 1, #water_hulls do
-        local hull = water_hulls[i]
+    -- only the hulls near mario's grid cell, all of them for levels without a grid
+    local hull_ids = level_data.water_grid and GoldsrcHull.grid_cell(level_data.water_grid, px, pz)
+    local count = hull_ids and #hull_ids or #water_hulls
+
+    for i = 1, count do
+        local hull = water_hulls[hull_ids and hull_ids[i] or i]
 
-        local minv = hull.min
-        local maxv = hull.max
+        local min_x, min_y, min_z, max_x, max_y, max_z = GoldsrcHull.aabb(hull)
 
-        local cx = (px < minv[1]) and minv[1] or (px > maxv[1] and maxv[1] or px)
-        local cy = (py < minv[2]) and minv[2] or (py > maxv[2] and maxv[2] or py)
-        local cz = (pz < minv[3]) and minv[3] or (pz > maxv[3] and maxv[3] or pz)
+        local cx = (px < min_x) and min_x or (px > max_x and max_x or px)
+        local cy = (py < min_y) and min_y or (py > max_y and max_y or py)
+        local cz = (pz < min_z) and min_z or (pz > max_z and max_z or pz)
 
         local dx = px - cx
         local dy = py - cy
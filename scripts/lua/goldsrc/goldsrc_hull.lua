@@ -1,9 +1,29 @@
 local GoldsrcHull = {}
 
+-- hulls are flat arrays: min x, y, z, max x, y, z, then nx, ny, nz, d per plane,
+-- the box is part of the hull, sides it bounds alone have no plane
+local FIRST_PLANE = 7
+
+function GoldsrcHull.aabb(hull)
+    return hull[1], hull[2], hull[3], hull[4], hull[5], hull[6]
+end
+
+function GoldsrcHull.plane_count(hull)
+    return (#hull - FIRST_PLANE + 1) // 4
+end
+
+function GoldsrcHull.plane(hull, i)
+    local p = FIRST_PLANE + (i - 1) * 4
+    return hull[p], hull[p+1], hull[p+2], hull[p+3]
+end
+
 function GoldsrcHull.contains_point(point, hull)
-    for _, plane in ipairs(hull.planes) do
-        local n, d = plane.n, plane.d
-        local dist = n[1]*point[1] + n[2]*point[2] + n[3]*point[3] - d
+    local x, y, z = point[1], point[2], point[3]
+    if x < hull[1] or y < hull[2] or z < hull[3] or x > hull[4] or y > hull[5] or z > hull[6] then
+        return false
+    end
+    for p = FIRST_PLANE, #hull, 4 do
+        local dist = hull[p]*x + hull[p+1]*y + hull[p+2]*z - hull[p+3]
         if dist < 0 then
             -- outside this plane
             return false
@@ -14,9 +34,12 @@ end
 
 function GoldsrcHull.within_radius(x, y, z, hull, radius)
     radius = radius or 0
-    for _, plane in ipairs(hull.planes) do
-        local n, d = plane.n, plane.d
-        local dist = n[1]*x + n[2]*y + n[3]*z - d
+    if x < hull[1] - radius or y < hull[2] - radius or z < hull[3] - radius
+        or x > hull[4] + radius or y > hull[5] + radius or z > hull[6] + radius then
+        return false
+    end
+    for p = FIRST_PLANE, #hull, 4 do
+        local dist = hull[p]*x + hull[p+1]*y + hull[p+2]*z - hull[p+3]
         if dist < -radius then
             -- outside the hull by more than the radius
             return false
@@ -26,18 +49,16 @@ function GoldsrcHull.within_radius(x, y, z, hull, radius)
 end
 
 function GoldsrcHull.top_at(x, y, z, hull)
-    local top_y = hull.max[2]  -- start with AABB top
-
-    for _, plane in ipairs(hull.planes) do
-        local n, d = plane.n, plane.d
-
-        if math.abs(n[2]) > 0.01 then  -- any plane affecting Y
-            local y_plane = (d - n[1]*x - n[3]*z) / n[2]
-            if n[2] < 0 then
-                -- normal pointing down -> constrains top
-                if y_plane < top_y then
-                    top_y = y_plane
-                end
+    local top_y = hull[5]  -- start with AABB top
+
+    for p = FIRST_PLANE, #hull, 4 do
+        local ny = hull[p+1]
+
+        if ny < -0.01 then
+            -- normal pointing down -> constrains top
+            local y_plane = (hull[p+3] - hull[p]*x - hull[p+2]*z) / ny
+            if y_plane < top_y then
+                top_y = y_plane
             end
         end
     end
@@ -45,4 +66,71 @@ function GoldsrcHull.top_at(x, y, z, hull)
     return top_y
 end
 
+-- model trees: planes hold nx, ny, nz, d per plane, nodes hold plane, front, back per node,
+-- a child above 0 is a node and any other child is the contents of a leaf
+GoldsrcHull.CONTENTS_SOLID = -2
+
+function GoldsrcHull.tree_contents(x, y, z, tree)
+    local planes, nodes = tree.planes, tree.nodes
+    local node = tree.root
+    while node > 0 do
+        local i = node * 3 - 2
+        local p = nodes[i] * 4 - 3
+        local dist = planes[p]*x + planes[p+1]*y + planes[p+2]*z - planes[p+3]
+        if dist >= 0 then
+            node = nodes[i+1]
+        else
+            node = nodes[i+2]
+        end
+    end
+    return node
+end
+
+local tree_stack = {}
+
+function GoldsrcHull.tree_within_radius(x, y, z, tree, radius)
+    -- true if the point is within the radius of the inner side of every split plane on the
+    -- path to some solid leaf, planes closer than the radius descend both sides. This only
+    -- approximates within_radius on the extracted leaf hulls: the path also has planes that
+    -- never bound the leaf and none of the padding box planes, so near edges, corners and
+    -- padded sides the two can disagree
+    radius = radius or 0
+    local planes, nodes = tree.planes, tree.nodes
+    local stack = tree_stack
+    local top = 1
+    stack[1] = tree.root
+    while top > 0 do
+        local node = stack[top]
+        top = top - 1
+        if node > 0 then
+            local i = node * 3 - 2
+            local p = nodes[i] * 4 - 3
+            local dist = planes[p]*x + planes[p+1]*y + planes[p+2]*z - planes[p+3]
+            if dist >= -radius then
+                top = top + 1
+                stack[top] = nodes[i+1]
+            end
+            if dist <= radius then
+                top = top + 1
+                stack[top] = nodes[i+2]
+            end
+        elseif node == GoldsrcHull.CONTENTS_SOLID then
+            return true
+        end
+    end
+    return false
+end
+
+local EMPTY_CELL = {}
+
+function GoldsrcHull.grid_cell(grid, x, z)
+    -- hull indices of the grid cell holding x, z
+    local ix = math.floor((x - grid.x) / grid.cell)
+    local iz = math.floor((z - grid.z) / grid.cell)
+    if ix < 0 or iz < 0 or ix >= grid.nx or iz >= grid.nz then
+        return EMPTY_CELL
+    end
+    return grid.cells[iz * grid.nx + ix + 1] or EMPTY_CELL
+end
+
 return GoldsrcHull
@@ -19,8 +19,12 @@ $ENTITIES
     water_hulls = {
 $WATER_HULLS
     },
+    water_grid = $WATER_GRID,
     model_hulls = {
 $MODEL_HULLS
+    },
+    model_trees = {
+$MODEL_TREES
     },
     skyboxes = {
 $SKYBOXES
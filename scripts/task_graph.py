@@ -0,0 +1,89 @@
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Task:
+    """A named step that runs once all of its dependencies succeeded."""
+
+    def __init__(self, name, run, deps=()):
+        self.name = name
+        self.run = run
+        self.deps = tuple(deps)
+        self.status = 'pending'
+        self.error = None
+        self.traceback = None
+        self.duration = None
+
+
+class TaskGraph:
+    """
+    Dependency graph of tasks, run on a thread pool. Independent tasks run
+    side by side, a task whose dependency failed is skipped instead of run.
+    A failure is reported with its traceback unless it is one of the
+    expected error types, whose message already says what went wrong.
+    """
+
+    def __init__(self, expected_errors=()):
+        self.tasks = {}
+        self.expected_errors = tuple(expected_errors)
+
+    def add(self, name, run, deps=()):
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+        task = self.tasks[name] = Task(name, run, deps)
+        return task
+
+    def _run_task(self, task):
+        started = time.time()
+        try:
+            task.run()
+            task.status = 'ok'
+        except Exception as ex:
+            task.status = 'failed'
+            task.error = ex
+            task.traceback = traceback.format_exc()
+        task.duration = time.time() - started
+        return task
+
+    def run(self, workers=1):
+        """Run every task, return True if all of them succeeded."""
+        pending = dict(self.tasks)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            while pending or running:
+                for name, task in list(pending.items()):
+                    deps = [self.tasks[dep] for dep in task.deps]
+                    if any(dep.status in ('failed', 'skipped') for dep in deps):
+                        task.status = 'skipped'
+                        print(f"⏭️ Skipping {name}, a dependency failed")
+                        del pending[name]
+                    elif all(dep.status == 'ok' for dep in deps):
+                        print(f"▶️ Running {name}")
+                        task.status = 'running'
+                        running[pool.submit(self._run_task, task)] = task
+                        del pending[name]
+
+                if not running:
+                    # everything left waits on a task that will never run
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    if task.status == 'ok':
+                        print(f"✅ {task.name} finished in {task.duration:.1f}s")
+                    else:
+                        print(f"❌ {task.name} failed after {task.duration:.1f}s: {task.error}")
+                        if not isinstance(task.error, self.expected_errors):
+                            print(task.traceback, end='')
+
+        return all(task.status == 'ok' for task in self.tasks.values())
+
+    def print_summary(self):
+        width = max((len(name) for name in self.tasks), default=0)
+        for task in self.tasks.values():
+            duration = f"{task.duration:7.1f}s" if task.duration is not None else "       -"
+            print(f"    {task.name:<{width}}  {task.status:<8} {duration}")